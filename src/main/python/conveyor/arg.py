@@ -343,6 +343,15 @@ def slicer_settings(parser):
         )
 
 
+def stream(parser):
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help='receive OUTPUT-FILE from the conveyor service over the connection',
+        dest='stream',
+        )
+
+
 def version(parser):
     parser.add_argument(
         '-v',
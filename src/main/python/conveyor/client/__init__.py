@@ -19,6 +19,7 @@
 
 from __future__ import (absolute_import, print_function, unicode_literals)
 
+import base64
 import itertools
 import json
 import logging
@@ -29,6 +30,7 @@ import tempfile
 import textwrap
 import time
 
+import conveyor.address
 import conveyor.arg
 import conveyor.domain
 import conveyor.job
@@ -72,6 +74,7 @@ class _JsonRpcCommand(_ClientCommand):
         self._jsonrpc = None
         self._stop = False
         self._code = 0
+        self._files = []
 
     def run(self):
         address = self._config.get('common', 'address')
@@ -88,13 +91,65 @@ class _JsonRpcCommand(_ClientCommand):
         else:
             self._jsonrpc = conveyor.jsonrpc.JsonRpc(
                 self._connection, self._connection)
+            request_timeout = self._config.get('client', 'request_timeout')
+            if 0 != request_timeout:
+                self._jsonrpc.setrequesttimeout(request_timeout)
             self._export_methods()
+            # NOTE: compression only pays off over a network. A local pipe is
+            # faster without it.
+            if isinstance(address, conveyor.address.TcpAddress):
+                compressions = [conveyor.jsonrpc.COMPRESSION_ZLIB]
+            else:
+                compressions = []
+            hello_task = self._jsonrpc.hello(
+                [conveyor.jsonrpc.FRAMING_LENGTH], compressions)
+            hello_task.stoppedevent.attach(self._hello_framing_callback)
+            hello_task.start()
+            try:
+                self._jsonrpc.run()
+            finally:
+                for fp in self._files:
+                    fp.close()
+        return self._code
+
+    def _hello_framing_callback(self, hello_task):
+        '''
+        A callback invoked when the framing negotiation `hello` returns. Older
+        conveyor services reject the `framing` parameter; fall back to a plain
+        `hello` for them.
+
+        '''
+
+        if (conveyor.task.TaskConclusion.FAILED == hello_task.conclusion
+                and isinstance(hello_task.failure, dict)
+                and -32602 == hello_task.failure.get('code')):
             hello_task = self._jsonrpc.request('hello', {})
             hello_task.stoppedevent.attach(
                 self._guard_callback(self._hello_callback))
             hello_task.start()
-            self._jsonrpc.run()
-        return self._code
+        else:
+            callback = self._guard_callback(self._hello_callback)
+            callback(hello_task)
+
+    def _pass_files(self, params, input_file, output_file=None):
+        '''
+        Pass the input file, and the output file if there is one, to the
+        conveyor service as open descriptors when the connection supports it.
+        Their paths are still sent for the job name and the file type.
+
+        '''
+
+        if (self._config.get('client', 'pass_file_descriptors')
+                and self._connection.canpassdescriptors()):
+            fps = [open(input_file, 'rb')]
+            if None is not output_file:
+                fps.append(open(output_file, 'w+b'))
+            self._files.extend(fps)
+            numbers = self._connection.attachdescriptors(
+                [fp.fileno() for fp in fps])
+            params['input_descriptor'] = numbers[0]
+            if None is not output_file:
+                params['output_descriptor'] = numbers[1]
 
     def _pid_file_exists(self):
         pid_file = self._config.get('common', 'pid_file')
@@ -638,6 +693,7 @@ class PrintCommand(_ConnectedCommand):
             'slicer_name': self._parsed_args.slicer_name,
             'slicer_settings': slicer_settings.to_dict(),
         }
+        self._pass_files(params, self._parsed_args.input_file)
         method_task = self._jsonrpc.request('print', params)
         return method_task
 
@@ -651,6 +707,7 @@ class PrintCommand(_ConnectedCommand):
 @args(conveyor.arg.profile)
 @args(conveyor.arg.slicer)
 @args(conveyor.arg.slicer_settings)
+@args(conveyor.arg.stream)
 @args(conveyor.arg.positional_input_file)
 @args(conveyor.arg.positional_output_file)
 class PrintToFileCommand(_MonitorCommand):
@@ -658,6 +715,40 @@ class PrintToFileCommand(_MonitorCommand):
 
     help = 'print an object to an .s3g or .x3g file'
 
+    def __init__(self, parsed_args, config):
+        _MonitorCommand.__init__(self, parsed_args, config)
+        self._output_fp = None
+        self._output_sequence = 0
+
+    def _export_methods(self):
+        _MonitorCommand._export_methods(self)
+        if self._parsed_args.stream:
+            self._jsonrpc.addmethod('job_output', self._job_output)
+
+    def _job_output(self, id, sequence, data, eof):
+        '''
+        Invoked by the conveyor service with the next chunk of a streamed
+        output file. The chunk is acknowledged once it is written so that the
+        service can send more.
+
+        '''
+
+        # NOTE: the first chunks may arrive before the job id is known.
+        if not self._stop and (None is self._job_id or self._job_id == id):
+            if self._output_sequence != sequence:
+                self._code = 1
+                self._log.error(
+                    'missing output; expected chunk %d, received %d',
+                    self._output_sequence, sequence)
+                self._stop_jsonrpc()
+            else:
+                self._output_fp.write(base64.b64decode(data))
+                self._output_sequence += 1
+                params = {'id': id, 'sequence': sequence}
+                self._jsonrpc.notify('job_output_ack', params)
+                if eof:
+                    self._output_fp.close()
+
     def _create_method_task(self):
         slicer_settings = _create_slicer_settings(
             self._parsed_args, self._config)
@@ -676,6 +767,15 @@ class PrintToFileCommand(_MonitorCommand):
             'slicer_name': self._parsed_args.slicer_name,
             'slicer_settings': slicer_settings.to_dict(),
         }
+        if self._parsed_args.stream:
+            params['stream'] = True
+            self._output_fp = open(self._parsed_args.output_file, 'wb')
+            self._files.append(self._output_fp)
+            self._pass_files(params, self._parsed_args.input_file)
+        else:
+            self._pass_files(
+                params, self._parsed_args.input_file,
+                self._parsed_args.output_file)
         method_task = self._jsonrpc.request('print_to_file', params)
         return method_task
 
@@ -812,6 +912,9 @@ class SliceCommand(_MonitorCommand):
             'slicer_name': self._parsed_args.slicer_name,
             'slicer_settings': slicer_settings.to_dict(),
         }
+        self._pass_files(
+            params, self._parsed_args.input_file,
+            self._parsed_args.output_file)
         method_task = self._jsonrpc.request('slice', params)
         return method_task
 
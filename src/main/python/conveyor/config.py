@@ -250,6 +250,25 @@ class _LogLevel(_Type):
             return value
 
 
+class _Choice(_Type):
+    '''A type representing one of a fixed set of strings.'''
+
+    def __init__(self, choices, default):
+        self._choices = choices
+        self._default = default
+
+    def _getdefault(self):
+        return self._default
+
+    def convert(self, config_path, key, value):
+        if not isinstance(value, basestring):
+            raise conveyor.error.ConfigTypeError(config_path, key, value)
+        elif value not in self._choices:
+            raise conveyor.error.ConfigValueError(config_path, key, value)
+        else:
+            return value
+
+
 class _FilesystemItem(_Type):
     '''
     An abstract type that represents a filesystem item. No check is made for
@@ -360,6 +379,10 @@ class _Formatter(conveyor.visitor.Visitor):
         self._text(conveyor.json.dumps(level._default))
         self._newline()
 
+    def accept__Choice(self, choice):
+        self._text(conveyor.json.dumps(choice._default))
+        self._newline()
+
     def accept__FilesystemItem(self, filesystem_item):
         self._text(conveyor.json.dumps(os.path.join(*filesystem_item._path)))
         self._newline()
@@ -494,6 +517,104 @@ def _gettype():
                     'event_threads',
                     _Int(4),
                 ),
+                _Field(
+                    'The number of seconds that the handlers of one event may run before the event is logged as slow. Slow events are not logged when this is 0.',
+                    'slow_event_handler_seconds',
+                    _Float(0.5),
+                ),
+                _Field(
+                    'The number of threads that run slicing and other long work. Independent stages, like the two slices of a dual-extrusion job, run at the same time when this is more than 1.',
+                    'work_threads',
+                    _Int(2),
+                ),
+                _Field(
+                    'The number of threads available for running JSON-RPC requests concurrently, like connect and print. This is opt-in: requests are run in order on each connection\'s thread when this is 0, which is the default.',
+                    'jsonrpc_threads',
+                    _Int(0),
+                ),
+                _Field(
+                    'The number of threads that process the requests of all client connections. The requests of each connection are processed in order, by one of these threads at a time. A thread is created for each connection instead when this is 0. Windows always uses a thread for each connection.',
+                    'connection_threads',
+                    _Int(4),
+                ),
+                _Field(
+                    'The maximum number of bytes in one message from a client that uses the newline or length framing, or compression with any framing. A client that sends a longer message is disconnected. Compressed input is never inflated more than this many bytes at a time.',
+                    'max_message_bytes',
+                    _Int(4194304),
+                ),
+                _Field(
+                    'The maximum number of bytes queued for a client that is not reading its messages.',
+                    'outbound_queue_bytes',
+                    _Int(1048576),
+                ),
+                _Field(
+                    'What to do when a client\'s queue is full: "drop" discards notifications that are superseded by a newer one and disconnects the client if that is not enough, "disconnect" disconnects the client.',
+                    'outbound_queue_overflow',
+                    _Choice(('drop', 'disconnect'), 'drop'),
+                ),
+                _Field(
+                    'The minimum number of seconds between progress and temperature notifications for the same job or machine sent to a client. Notifications in between are coalesced into the latest one. Notifications are never delayed when this is 0.',
+                    'notification_interval',
+                    _Float(0.25),
+                ),
+                _Field(
+                    'The number of requests each client may make for each class of methods. A client may make up to "burst" requests at once and "rate" requests per second on average; requests beyond that are rejected with a "rate limited" error. A class is not limited when its rate is 0, which is the default.',
+                    'request_rates',
+                    _Group(
+                        _Field(
+                            'Methods that only read the state of the service, like getprinters and getjobs.',
+                            'query',
+                            _Group(
+                                _Field(
+                                    'The average number of requests per second.',
+                                    'rate',
+                                    _Float(0.0),
+                                ),
+                                _Field(
+                                    'The number of requests a client may make at once.',
+                                    'burst',
+                                    _Int(40),
+                                ),
+                            ),
+                        ),
+                        _Field(
+                            'Methods that create jobs, like print, printtofile and slice.',
+                            'job',
+                            _Group(
+                                _Field(
+                                    'The average number of requests per second.',
+                                    'rate',
+                                    _Float(0.0),
+                                ),
+                                _Field(
+                                    'The number of requests a client may make at once.',
+                                    'burst',
+                                    _Int(10),
+                                ),
+                            ),
+                        ),
+                    ),
+                ),
+                _Field(
+                    'The number of bytes in each chunk of print-to-file output that is streamed to a client.',
+                    'output_stream_chunk_bytes',
+                    _Int(65536),
+                ),
+                _Field(
+                    'The number of streamed chunks a client may leave unacknowledged before the print-to-file job waits for it.',
+                    'output_stream_window',
+                    _Int(4),
+                ),
+                _Field(
+                    'The path of the status board, a memory-mapped file with the state and temperatures of each machine and the progress of its job, for local tools that poll them. No status board is written when this is empty.',
+                    'status_board_file',
+                    _File(conveyor.platform.DEFAULT_CONFIG_SERVER_STATUS_BOARD_FILE),
+                ),
+                _Field(
+                    'The number of machines the status board has room for.',
+                    'status_board_slots',
+                    _Int(16),
+                ),
                 _Field(
                     'The logging configuration for the conveyor service.',
                     'logging',
@@ -531,6 +652,16 @@ def _gettype():
                     'event_threads',
                     _Int(2),
                 ),
+                _Field(
+                    'The number of seconds to wait for the conveyor service to respond to a request before giving up. The client waits forever when this is 0.',
+                    'request_timeout',
+                    _Int(0),
+                ),
+                _Field(
+                    'Whether or not to pass the input and output files of a job to the conveyor service as open file descriptors when it is reached through a local pipe. The service then does not need to see the same paths as the client.',
+                    'pass_file_descriptors',
+                    _Bool(True),
+                ),
                 _Field(
                     'The logging configuration for the conveyor client.',
                     'logging',
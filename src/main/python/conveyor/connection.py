@@ -27,6 +27,8 @@ import select
 import socket
 import threading
 
+import conveyor.error
+import conveyor.fdpass
 import conveyor.log
 import conveyor.stoppable
 
@@ -49,6 +51,21 @@ class Connection(conveyor.stoppable.StoppableInterface):
     def close(self):
         raise NotImplementedError
 
+    def disconnect(self):
+        """ Disconnect the peer so that a pending or subsequent read returns
+        end-of-file. """
+        self.stop()
+
+    def canpassdescriptors(self):
+        """ Whether open file descriptors can be passed on this connection.
+        """
+        return False
+
+    def takedescriptor(self, number):
+        """ Removes a descriptor received from the peer and returns it. The
+        caller must close it. """
+        raise conveyor.error.UnknownDescriptorError(number)
+
 class ConnectionWriteException(Exception):
     """ Default connection exception class."""
     pass
@@ -71,6 +88,9 @@ class _AbstractSocketConnection(Connection):
     def getaddress(self):
         return self._address
 
+    def fileno(self):
+        return self._socket.fileno()
+
     def stop(self):
         """ Sets stop flag to true, which will case the  write loop. """
         self._stopped = True
@@ -103,6 +123,31 @@ class _AbstractSocketConnection(Connection):
                 else:
                     i += sent
 
+    def trysend(self, data):
+        """ sends as much of the data as the socket accepts without blocking.
+        @param data The data you want to send
+        @return the number of bytes sent
+        """
+        try:
+            sent = self._socket.send(data, socket.MSG_DONTWAIT)
+        except IOError as e:
+            if e.args[0] in (errno.EINTR, errno.EAGAIN, errno.EWOULDBLOCK):
+                sent = 0
+            elif e.args[0] in (errno.EBADF, errno.EPIPE, errno.ECONNRESET):
+                self._log.debug('handled exception', exc_info=True)
+                raise ConnectionWriteException
+            else:
+                raise
+        return sent
+
+    def disconnect(self):
+        """ Shuts down the socket without closing it. The reader sees
+        end-of-file and closes the connection. """
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except IOError:
+            self._log.debug('handled exception', exc_info=True)
+
     def close(self):
         self._socket.close()
 
@@ -113,7 +158,53 @@ if 'nt' != os.name:
     class _PosixSocketConnection(_AbstractSocketConnection):
         """ A Posix socket connection. 
         Major functionality is via 'read','write','stop'.
+        On a Unix domain socket it also passes open file descriptors; see
+        conveyor.fdpass.
         """
+        def __init__(self, sock, address):
+            _AbstractSocketConnection.__init__(self, sock, address)
+            if (socket.AF_UNIX == sock.family
+                    and conveyor.fdpass.isavailable()):
+                self._descriptors = conveyor.fdpass.DescriptorTable()
+            else:
+                self._descriptors = None
+            self._outfds = []
+            self._sentdescriptors = 0
+
+        def canpassdescriptors(self):
+            return None is not self._descriptors
+
+        def attachdescriptors(self, fds):
+            """ Queues descriptors to be sent with the next write.
+            @param fds the descriptors; the caller keeps them open
+            @return the numbers the peer knows them by
+            """
+            if not self.canpassdescriptors():
+                raise NotImplementedError
+            with self._condition:
+                self._outfds.extend(fds)
+                first = self._sentdescriptors
+                self._sentdescriptors += len(fds)
+            return list(range(first, first + len(fds)))
+
+        def takedescriptor(self, number):
+            if not self.canpassdescriptors():
+                raise conveyor.error.UnknownDescriptorError(number)
+            return self._descriptors.take(number)
+
+        def write(self, data):
+            with self._condition:
+                if 0 != len(self._outfds) and 0 != len(data):
+                    fds, self._outfds = self._outfds, []
+                    sent = conveyor.fdpass.sendfds(self._socket, data, fds)
+                    data = data[sent:]
+                _AbstractSocketConnection.write(self, data)
+
+        def close(self):
+            _AbstractSocketConnection.close(self)
+            if None is not self._descriptors:
+                self._descriptors.close()
+
         def stop(self):
             _AbstractSocketConnection.stop(self)
             # NOTE: use SHUT_RD instead of SHUT_RDWR or you will get annoying
@@ -135,7 +226,7 @@ if 'nt' != os.name:
                     return ''
                 else:
                     try:
-                        data = self._socket.recv(4096)
+                        data = self._recv()
                     except IOError as e:
                         if e.args[0] in (errno.EINTR, errno.EAGAIN, errno.EWOULDBLOCK):
                             # NOTE: too spammy
@@ -148,6 +239,27 @@ if 'nt' != os.name:
                             raise
                     else:
                         return data
+
+        def _recv(self):
+            if None is self._descriptors:
+                data = self._socket.recv(4096)
+            else:
+                data, fds, truncated = conveyor.fdpass.recvfds(
+                    self._socket, 4096)
+                if truncated:
+                    # NOTE: the kernel discarded descriptors, so the numbers
+                    # no longer match the peer's and a later request could
+                    # take the wrong file. This is a protocol error; the
+                    # connection is treated as closed.
+                    self._log.warning(
+                        'peer sent more than %d descriptors at once;'
+                        ' disconnecting', conveyor.fdpass.MAXFDS)
+                    for fd in fds:
+                        os.close(fd)
+                    data = b''
+                else:
+                    self._descriptors.add(fds)
+            return data
     # Custom posix classes as 'PipeConnection' and 'SocketConnection
     PipeConnection = _PosixSocketConnection
     SocketConnection = _PosixSocketConnection
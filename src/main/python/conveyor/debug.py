@@ -26,17 +26,21 @@ import sys
 import threading
 import traceback
 
+import conveyor.event
+import conveyor.json
+
 def initdebug(): # pragma: no cover
     '''Initialize thread debugging support.
 
-    The process will log the list of threads when it receives SIGUSR1 (on
-    platforms that have SIGUSR1; sorry Windows).
+    The process will log the list of threads and the event queue statistics
+    when it receives SIGUSR1 (on platforms that have SIGUSR1; sorry Windows).
 
     '''
 
     if hasattr(signal, 'SIGUSR1'):
         def _sigusr1(signum, frame): # pragma: no cover
             logthreads(logging.INFO)
+            logeventstats(logging.INFO)
         signal.signal(signal.SIGUSR1, _sigusr1)
 
 def logthreads(level): # pragma: no cover
@@ -53,3 +57,10 @@ def logthreads(level): # pragma: no cover
         traceback.print_stack(frame, file=fp)
         message = fp.getvalue().strip()
         log.log(level, message, threads[threadident])
+
+def logeventstats(level): # pragma: no cover
+    '''Log the event queue statistics at the specified logging level.'''
+
+    log = logging.getLogger('conveyor.debug')
+    report = conveyor.event.geteventqueue().getreport()
+    log.log(level, 'event queue: %s', conveyor.json.dumps(report))
@@ -40,9 +40,11 @@ def command(command_class):
     return decorator
 
 
-def jsonrpc(name=None):
+def jsonrpc(name=None, ordered=True, rate_class=None):
     def decorator(func):
         setattr(func, '_jsonrpc', True)
         setattr(func, '_jsonrpc_name', name)
+        setattr(func, '_jsonrpc_ordered', ordered)
+        setattr(func, '_jsonrpc_rate_class', rate_class)
         return func
     return decorator
@@ -0,0 +1,203 @@
+# vim:ai:et:ff=unix:fileencoding=utf-8:sw=4:ts=4:
+# conveyor/src/main/python/conveyor/delta.py
+#
+# conveyor - Printing dispatch engine for 3D objects and their friends.
+# Copyright © 2012 Matthew W. Samsonoff <matthew.samsonoff@makerbot.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Versioned snapshots of the objects that the server broadcasts, like jobs and
+machines, so that a notification can carry only the fields that changed.
+
+The server keeps a `VersionedStore`. Each new snapshot of an object gets the
+next version number and is compared to the previous one with `diff`. A client
+keeps a `DeltaReceiver` and applies each delta to the snapshot it holds. A
+delta whose version does not immediately follow the client's is rejected and
+the client must fetch a fresh snapshot.
+
+'''
+
+from __future__ import (absolute_import, print_function, unicode_literals)
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+def diff(old, new):
+    '''
+    Return the top-level fields of the dict `new` that are missing from or
+    different in `old`. Nested values are compared and sent whole. Fields
+    missing from `new` are returned as `None`.
+
+    '''
+
+    changes = {}
+    for key, value in new.iteritems():
+        if key not in old or old[key] != value:
+            changes[key] = value
+    for key in old:
+        if key not in new:
+            changes[key] = None
+    return changes
+
+
+class VersionedStore(object):
+    '''
+    The latest snapshot and version of each object. It is not locked; the
+    server guards every call with its versions lock, so that each version and
+    its changes are computed against the snapshot just before it.
+
+    The result of `update` is broadcast after that lock is released, so the
+    store does not order delivery. The versions of one object are produced one
+    at a time, in order, by the event lane of the job or machine, which is what
+    keeps them in order for each connection. A delta that does not follow the
+    version a client holds, because it arrived out of order or notifications
+    were coalesced, carries the `base_version` it applies to.
+    `DeltaReceiver.apply` ignores a delta older than the held snapshot and
+    refuses one whose base is not the held version, and the client then
+    fetches a fresh snapshot.
+
+    '''
+
+    def __init__(self):
+        self._objects = {} # of key -> (version, snapshot)
+        self.version = 0 # the number of changes to any object
+
+    def update(self, key, snapshot):
+        '''
+        Record a new snapshot of the object `key`. Returns its version and the
+        fields that changed since the previous snapshot.
+
+        '''
+
+        version, old = self._objects.get(key, (0, {}))
+        version += 1
+        changes = diff(old, snapshot)
+        self._objects[key] = version, snapshot
+        self.version += 1
+        return version, changes
+
+    def remove(self, key):
+        '''Forget the object `key`. This counts as a change.'''
+
+        self._objects.pop(key, None)
+        self.version += 1
+
+    def get(self, key):
+        '''Return the version and snapshot of `key`, or `(0, None)`.'''
+
+        result = self._objects.get(key, (0, None))
+        return result
+
+
+class DeltaReceiver(object):
+    '''The client side of a `VersionedStore`.'''
+
+    def __init__(self):
+        self._objects = {} # of key -> (version, snapshot)
+
+    def reset(self, key, version, snapshot):
+        '''Replace the snapshot of `key`, unless a newer one is held.'''
+
+        current, old = self._objects.get(key, (0, None))
+        if version >= current:
+            self._objects[key] = version, dict(snapshot)
+
+    def apply(self, key, version, changes, base_version=None):
+        '''
+        Apply a delta to the snapshot of `key`. The delta applies to the
+        snapshot with `base_version`, which defaults to the previous version.
+        Returns `False`, and leaves the snapshot alone, if the delta does not
+        follow the held version; the caller should then fetch a fresh
+        snapshot. A delta that is already included in the held snapshot is
+        ignored.
+
+        '''
+
+        if None is base_version:
+            base_version = version - 1
+        current, snapshot = self._objects.get(key, (0, None))
+        if None is not snapshot and version <= current:
+            result = True
+        elif None is snapshot or current != base_version:
+            result = False
+        else:
+            snapshot = dict(snapshot)
+            snapshot.update(changes)
+            self._objects[key] = version, snapshot
+            result = True
+        return result
+
+    def get(self, key):
+        '''Return the version and snapshot of `key`, or `(0, None)`.'''
+
+        result = self._objects.get(key, (0, None))
+        return result
+
+
+class _DeltaTestCase(unittest.TestCase):
+    def test_diff(self):
+        '''Test that only changed, added, and removed fields are returned.'''
+
+        old = {'a': 1, 'b': {'c': 2}, 'd': 3}
+        new = {'a': 1, 'b': {'c': 4}, 'e': 5}
+        self.assertEqual({'b': {'c': 4}, 'd': None, 'e': 5}, diff(old, new))
+        self.assertEqual({}, diff(new, dict(new)))
+
+    def test_roundtrip(self):
+        '''Test that a receiver rebuilds every snapshot from the deltas.'''
+
+        store = VersionedStore()
+        receiver = DeltaReceiver()
+        snapshots = [
+            {'id': 1, 'state': 'PENDING', 'progress': None},
+            {'id': 1, 'state': 'RUNNING', 'progress': {'progress': 1}},
+            {'id': 1, 'state': 'RUNNING', 'progress': {'progress': 2}},
+        ]
+        for snapshot in snapshots:
+            version, changes = store.update(1, snapshot)
+            if 1 == version:
+                receiver.reset(1, version, snapshot)
+            else:
+                self.assertTrue(receiver.apply(1, version, changes))
+            self.assertEqual((version, snapshot), receiver.get(1))
+        self.assertEqual({'progress': {'progress': 2}}, changes)
+        self.assertEqual(3, store.version)
+        store.update(2, {'id': 2})
+        store.remove(1)
+        self.assertEqual((0, None), store.get(1))
+        self.assertEqual(5, store.version)
+
+    def test_gap(self):
+        '''Test that a missed delta is detected and fixed by a resync.'''
+
+        store = VersionedStore()
+        receiver = DeltaReceiver()
+        version, changes = store.update('m', {'name': 'm', 'temperature': 1})
+        receiver.reset('m', version, store.get('m')[1])
+        store.update('m', {'name': 'm', 'temperature': 2})
+        version, changes = store.update('m', {'name': 'm', 'temperature': 3})
+        self.assertFalse(receiver.apply('m', version, changes))
+        self.assertFalse(receiver.apply('x', 1, {}))
+        self.assertTrue(
+            receiver.apply(
+                'm', version, {'temperature': 3}, base_version=version - 2))
+        self.assertEqual(3, receiver.get('m')[1]['temperature'])
+        receiver.reset('m', *store.get('m'))
+        self.assertEqual(3, receiver.get('m')[1]['temperature'])
+        self.assertTrue(receiver.apply('m', 2, {'temperature': 2}))
+        self.assertEqual((3, {'name': 'm', 'temperature': 3}), receiver.get('m'))
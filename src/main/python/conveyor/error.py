@@ -197,6 +197,16 @@ class ProfileMismatchException(Exception, Handleable):
         return 1
 
 
+class StreamAbortedException(Exception, Handleable):
+    def __init__(self, job_id):
+        Exception.__init__(self, job_id)
+        self.job_id = job_id
+
+    def handle(self, log):
+        log.error('the output stream was aborted: %s', self.job_id, exc_info=True)
+        return 1
+
+
 class UnknownDriverError(KeyError, Handleable):
     def __init__(self, driver_name):
         KeyError.__init__(self, driver_name)
@@ -207,6 +217,26 @@ class UnknownDriverError(KeyError, Handleable):
         return 1
 
 
+class UnknownDescriptorError(KeyError, Handleable):
+    def __init__(self, number):
+        KeyError.__init__(self, number)
+        self.number = number
+
+    def handle(self, log):
+        log.critical('unknown descriptor: %s', self.number, exc_info=True)
+        return 1
+
+
+class UnknownEventError(KeyError, Handleable):
+    def __init__(self, event):
+        KeyError.__init__(self, event)
+        self.event = event
+
+    def handle(self, log):
+        log.critical('unknown event: %s', self.event, exc_info=True)
+        return 1
+
+
 class UnknownJobError(KeyError, Handleable):
     def __init__(self, job_id):
         KeyError.__init__(self, job_id)
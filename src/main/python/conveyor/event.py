@@ -19,6 +19,7 @@
 
 from __future__ import (absolute_import, print_function, unicode_literals)
 
+import bisect
 import collections
 import logging
 import threading
@@ -29,6 +30,7 @@ try:
 except ImportError:
     import unittest
 
+import conveyor.enum
 import conveyor.log
 import conveyor.stoppable
 import conveyor.test
@@ -56,40 +58,356 @@ class EventQueueThread(conveyor.stoppable.StoppableThread):
     def stop(self):
         self._eventqueue.stop()
 
-class EventQueue(object):
+EventPriority = conveyor.enum.enum('EventPriority', 'CONTROL', 'BULK')
+
+class _Lane(object):
+    __slots__ = ('events', 'control', 'priority')
+
+    def __init__(self):
+        self.events = collections.deque() # of (event, args, kwargs, time)
+        self.control = 0 # the number of queued control events
+        self.priority = None # the ready queue that holds the lane, if any
+
+class _DelayStats(object):
+    __slots__ = ('depth', 'delivered', 'total_delay', 'max_delay')
+
     def __init__(self):
+        self.depth = 0
+        self.delivered = 0
+        self.total_delay = 0.0
+        self.max_delay = 0.0
+
+    def todict(self):
+        if 0 == self.delivered:
+            mean_delay = 0.0
+        else:
+            mean_delay = self.total_delay / self.delivered
+        dct = {
+            'depth': self.depth,
+            'delivered': self.delivered,
+            'mean_delay': mean_delay,
+            'max_delay': self.max_delay,
+        }
+        return dct
+
+class _Histogram(object):
+    __slots__ = ('counts',)
+
+    # The upper bounds of the buckets, in seconds. The last bucket has no
+    # upper bound.
+    bounds = (0.001, 0.01, 0.1, 1.0, 10.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+
+    def tolist(self):
+        bounds = list(self.bounds)
+        bounds.append(None)
+        histogram = [list(pair) for pair in zip(bounds, self.counts)]
+        return histogram
+
+class _EventStats(object):
+    __slots__ = (
+        'queued', 'delivered', 'depth', 'max_depth', 'total_delay',
+        'max_delay', 'delay_histogram', 'total_handler_time',
+        'max_handler_time', 'handler_histogram', 'slow')
+
+    def __init__(self):
+        self.queued = 0
+        self.delivered = 0
+        self.depth = 0
+        self.max_depth = 0
+        self.total_delay = 0.0
+        self.max_delay = 0.0
+        self.delay_histogram = _Histogram()
+        self.total_handler_time = 0.0
+        self.max_handler_time = 0.0
+        self.handler_histogram = _Histogram()
+        self.slow = 0
+
+    def todict(self):
+        if 0 == self.delivered:
+            mean_delay = 0.0
+            mean_handler_time = 0.0
+        else:
+            mean_delay = self.total_delay / self.delivered
+            mean_handler_time = self.total_handler_time / self.delivered
+        dct = {
+            'queued': self.queued,
+            'delivered': self.delivered,
+            'depth': self.depth,
+            'max_depth': self.max_depth,
+            'delay': {
+                'mean': mean_delay,
+                'max': self.max_delay,
+                'histogram': self.delay_histogram.tolist(),
+            },
+            'handler_time': {
+                'mean': mean_handler_time,
+                'max': self.max_handler_time,
+                'histogram': self.handler_histogram.tolist(),
+                'slow': self.slow,
+            },
+        }
+        return dct
+
+class EventQueue(object):
+    """
+    Delivers events on any number of threads that invoke `run`. Events are
+    queued in lanes by the key of their `Event`. The events in one lane are
+    delivered one at a time and in order, and different lanes are delivered
+    in parallel. A worker delivers one event from a lane and then puts the
+    lane at the back of the ready lanes, so a busy lane cannot hold up the
+    others.
+
+    The ready lanes are kept in one queue per `EventPriority`. A lane with a
+    queued CONTROL event, like a task cancel or a machine state change, is
+    taken ahead of the BULK lanes, along with the events queued before the
+    control event so that the lane stays in order. After `control_burst`
+    control lanes in a row a waiting bulk lane is taken, so bulk traffic is
+    never starved.
+
+    Only one waiting worker is woken for each lane that becomes ready.
+
+    The queue also keeps statistics for each event name: the queue depth, the
+    delay from enqueue to delivery and the time spent in the handlers. An
+    event whose handlers take longer than the slow handler budget is logged.
+
+    """
+
+    def __init__(self, control_burst=8, clock=time.time):
         self._lock = threading.Lock()
         self._log = conveyor.log.getlogger(self)
         self._condition = threading.Condition(self._lock)
-        self._queue = collections.deque()
+        self._control_burst = control_burst
+        self._clock = clock
+        self._slow_handler_budget = None
+        self._clear()
         self._stop = False
 
-    def runiteration(self, block):
-        self._log.debug('block=%r', block)
+    def _clear(self):
+        self._lanes = {} # of key -> _Lane
+        # NOTE: a lane that gets a control event while it waits in the bulk
+        # queue is also put in the control queue. The bulk entry is skipped
+        # because its priority no longer matches the lane.
+        self._ready = {
+            EventPriority.CONTROL: collections.deque(), # of key
+            EventPriority.BULK: collections.deque(),
+        }
+        self._readycount = {
+            EventPriority.CONTROL: 0,
+            EventPriority.BULK: 0,
+        }
+        self._stats = {
+            EventPriority.CONTROL: _DelayStats(),
+            EventPriority.BULK: _DelayStats(),
+        }
+        self._eventstats = {} # of event name -> _EventStats
+        self._burst = 0
+
+    def clear(self):
+        """Discard every queued event and reset the statistics."""
+
         with self._condition:
-            if block:
-                while 0 == len(self._queue) and not self._stop:
-                    self._log.debug('waiting')
-                    self._condition.wait()
-                    self._log.debug('resumed')
-            if 0 == len(self._queue):
-                tuple_ = None
-            else:
-                tuple_ = self._queue.pop()
+            self._clear()
+
+    def getstats(self):
+        """
+        Return the queueing statistics of each priority: the number of queued
+        events, the number of delivered events and the mean and maximum
+        seconds that a delivered event waited in the queue.
+
+        """
+
+        with self._condition:
+            stats = dict(
+                (priority.lower(), stats.todict())
+                for priority, stats in self._stats.items())
+        return stats
+
+    def geteventstats(self):
+        """
+        Return the statistics of each event name: the number of queued and
+        delivered events, the current and maximum queue depth, and the mean,
+        maximum and histogram of the seconds that an event waited in the queue
+        and that its handlers ran. The histograms are lists of [upper bound,
+        count] pairs. The last bound is None.
+
+        """
+
+        with self._condition:
+            stats = dict(
+                (name, stats.todict())
+                for name, stats in self._eventstats.items())
+        return stats
+
+    def getreport(self):
+        """Return the statistics of each priority and of each event
+        name."""
+
+        report = {
+            'priorities': self.getstats(),
+            'events': self.geteventstats(),
+        }
+        return report
+
+    def setslowhandlerbudget(self, seconds):
+        """Log the events whose handlers take more than `seconds`. Slow
+        handlers are not logged when `seconds` is None."""
+
+        self._slow_handler_budget = seconds
+
+    def runiteration(self, block):
+        debug = self._log.isEnabledFor(logging.DEBUG)
+        if debug:
+            self._log.debug('block=%r', block)
+        key, tuple_ = self._take(block, None)
         if None is not tuple_:
             event, args, kwargs = tuple_
-            event._deliver(args, kwargs)
+            start = self._clock()
+            try:
+                event._deliver(args, kwargs)
+            finally:
+                with self._condition:
+                    self._release((key, event, self._clock() - start))
         result = None is not tuple_
-        self._log.debug('result=%r', result)
+        if debug:
+            self._log.debug('result=%r', result)
         return result
 
     def run(self):
         self._log.debug('starting')
         self._stop = False
-        while not self._stop:
-            self.runiteration(True)
+        delivered = None
+        try:
+            while not self._stop:
+                # NOTE: the lane of the last event is released in the same
+                # critical section that takes the next one.
+                key, tuple_ = self._take(True, delivered)
+                if None is tuple_:
+                    delivered = None
+                else:
+                    event, args, kwargs = tuple_
+                    delivered = key, event, None
+                    start = self._clock()
+                    event._deliver(args, kwargs)
+                    delivered = key, event, self._clock() - start
+        finally:
+            if None is not delivered:
+                with self._condition:
+                    self._release(delivered)
         self._log.debug('ending')
 
+    def _take(self, block, delivered):
+        with self._condition:
+            if None is not delivered:
+                self._release(delivered)
+            if block:
+                while not self._isready() and not self._stop:
+                    self._log.debug('waiting')
+                    self._condition.wait()
+                    self._log.debug('resumed')
+            if not self._isready():
+                key = None
+                tuple_ = None
+            else:
+                key, tuple_ = self._takelane()
+        return key, tuple_
+
+    def _isready(self):
+        ready = (0 != self._readycount[EventPriority.CONTROL]
+            or 0 != self._readycount[EventPriority.BULK])
+        return ready
+
+    def _takelane(self):
+        if 0 == self._readycount[EventPriority.CONTROL]:
+            priority = EventPriority.BULK
+        elif 0 == self._readycount[EventPriority.BULK]:
+            priority = EventPriority.CONTROL
+        elif self._burst < self._control_burst:
+            priority = EventPriority.CONTROL
+            self._burst += 1
+        else:
+            priority = EventPriority.BULK
+        if EventPriority.BULK == priority:
+            self._burst = 0
+        ready = self._ready[priority]
+        while True:
+            # NOTE: a ready lane is not in a ready queue while its event is
+            # being delivered, so no other worker takes the next one.
+            key = ready.popleft()
+            lane = self._lanes.get(key)
+            if None is not lane and priority == lane.priority:
+                break
+        lane.priority = None
+        self._readycount[priority] -= 1
+        event, args, kwargs, enqueued = lane.events.popleft()
+        eventpriority = event._priority
+        if EventPriority.CONTROL == eventpriority:
+            lane.control -= 1
+        delay = self._clock() - enqueued
+        stats = self._stats[eventpriority]
+        stats.depth -= 1
+        stats.delivered += 1
+        stats.total_delay += delay
+        if delay > stats.max_delay:
+            stats.max_delay = delay
+        eventstats = self._eventstats[event._name]
+        eventstats.depth -= 1
+        eventstats.total_delay += delay
+        if delay > eventstats.max_delay:
+            eventstats.max_delay = delay
+        eventstats.delay_histogram.add(delay)
+        tuple_ = event, args, kwargs
+        return key, tuple_
+
+    def _makeready(self, key, lane):
+        if 0 != lane.control:
+            priority = EventPriority.CONTROL
+        else:
+            priority = EventPriority.BULK
+        lane.priority = priority
+        self._ready[priority].append(key)
+        self._readycount[priority] += 1
+
+    def _release(self, delivered):
+        key, event, elapsed = delivered
+        # NOTE: the time is None when the handlers were interrupted by an
+        # exception that stops the worker.
+        if None is not elapsed:
+            self._addhandlertime(event, elapsed)
+        lane = self._lanes.get(key)
+        if None is not lane:
+            if 0 == len(lane.events):
+                del self._lanes[key]
+            else:
+                # NOTE: the worker is about to take another lane so there is
+                # no need to wake a second one.
+                self._makeready(key, lane)
+
+    def _addhandlertime(self, event, elapsed):
+        eventstats = self._eventstats.get(event._name)
+        if None is not eventstats:
+            eventstats.delivered += 1
+            eventstats.total_handler_time += elapsed
+            if elapsed > eventstats.max_handler_time:
+                eventstats.max_handler_time = elapsed
+            eventstats.handler_histogram.add(elapsed)
+            budget = self._slow_handler_budget
+            if None is not budget and elapsed > budget:
+                eventstats.slow += 1
+                handles = event._handles
+                if None is handles:
+                    funcs = []
+                else:
+                    funcs = list(handles.values())
+                self._log.warning(
+                    'slow handlers for event %s: %.3fs (budget %.3fs): %r',
+                    event._name, elapsed, budget, funcs)
+
     def stop(self):
         event = Event('EventQueue.quit', self)
         def func():
@@ -100,11 +418,43 @@ class EventQueue(object):
         event()
 
     def _enqueue(self, event, args, kwargs):
-        self._log.debug('event=%r, args=%r, kwargs=%r', event, args, kwargs)
-        tuple_ = event, args, kwargs
+        if self._log.isEnabledFor(logging.DEBUG):
+            self._log.debug(
+                'event=%r, args=%r, kwargs=%r', event, args, kwargs)
+        tuple_ = event, args, kwargs, self._clock()
+        key = event._key
+        priority = event._priority
         with self._condition:
-            self._queue.appendleft(tuple_)
-            self._condition.notify_all()
+            self._stats[priority].depth += 1
+            eventstats = self._eventstats.get(event._name)
+            if None is eventstats:
+                eventstats = _EventStats()
+                self._eventstats[event._name] = eventstats
+            eventstats.queued += 1
+            eventstats.depth += 1
+            if eventstats.depth > eventstats.max_depth:
+                eventstats.max_depth = eventstats.depth
+            lane = self._lanes.get(key)
+            if None is lane:
+                lane = _Lane()
+                self._lanes[key] = lane
+                lane.events.append(tuple_)
+                if EventPriority.CONTROL == priority:
+                    lane.control += 1
+                self._makeready(key, lane)
+                self._condition.notify()
+            else:
+                lane.events.append(tuple_)
+                if EventPriority.CONTROL == priority:
+                    lane.control += 1
+                    if EventPriority.BULK == lane.priority:
+                        self._readycount[EventPriority.BULK] -= 1
+                        self._makeready(key, lane)
+
+# Guards the creation of the handler table of every event. It is only taken
+# by the first call to `attach`.
+_handleslock = threading.Lock()
+
 
 class Event(object):
     """ This represents some kind of event in the conveyor system, mostly 
@@ -112,43 +462,71 @@ class Event(object):
     a subproject or subsystem. 
     """
 
-    def __init__(self, name, eventqueue=None):
+    __slots__ = ('_name', '_eventqueue', '_key', '_priority', '_handles')
+
+    # NOTE: every event shares one logger, the same one that
+    # `conveyor.log.getlogger` returns for an `Event`.
+    _log = logging.getLogger('.'.join((__name__, 'Event')))
+
+    def __init__(
+            self, name, eventqueue=None, key=None,
+            priority=EventPriority.BULK):
         """ Creates an event object.
         @param eventqueue if a specifi eventqueue is desired.
+        @param key the object whose events are delivered in order, like a
+            task or a machine. Each event is its own key by default.
+        @param priority an EventPriority. CONTROL events, like a cancel,
+            are delivered ahead of BULK events, like a heartbeat.
         """
         self._name = name
         self._eventqueue = eventqueue
-        self._handles = {}
-        self._log = conveyor.log.getlogger(self)
+        if None is key:
+            key = self
+        self._key = key
+        self._priority = priority
+        self._handles = None # created by the first call to `attach`
 
     def attach(self, func):
         handle = object()
-        self._handles[handle] = func
-        self._log.debug(
-            'name=%r, func=%r, handle=%r', self._name, func, handle)
+        handles = self._handles
+        if None is handles:
+            with _handleslock:
+                handles = self._handles
+                if None is handles:
+                    handles = self._handles = {}
+        handles[handle] = func
+        if self._log.isEnabledFor(logging.DEBUG):
+            self._log.debug(
+                'name=%r, func=%r, handle=%r', self._name, func, handle)
         return handle
 
     def detach(self, handle):
-        self._log.debug('handle=%r', handle)
+        if self._log.isEnabledFor(logging.DEBUG):
+            self._log.debug('handle=%r', handle)
+        if None is self._handles:
+            raise KeyError(handle)
         del self._handles[handle]
 
     def __call__(self, *args, **kwargs):
         """allows calls as Event(foo) to work  """
-        self._log.debug(
-            'name=%r, args=%r, kwargs=%r', self._name, args, kwargs)
+        if self._log.isEnabledFor(logging.DEBUG):
+            self._log.debug(
+                'name=%r, args=%r, kwargs=%r', self._name, args, kwargs)
         eventqueue = self._eventqueue
         if None is eventqueue:
             eventqueue = geteventqueue()
         eventqueue._enqueue(self, args, kwargs)
 
     def _deliver(self, args, kwargs):
-        self._log.debug(
-            'name=%r, args=%r, kwargs=%r', self._name, args, kwargs)
-        for func in self._handles.itervalues():
-            try:
-                func(*args, **kwargs)
-            except:
-                self._log.exception('internal error')
+        if self._log.isEnabledFor(logging.DEBUG):
+            self._log.debug(
+                'name=%r, args=%r, kwargs=%r', self._name, args, kwargs)
+        if None is not self._handles:
+            for func in self._handles.itervalues():
+                try:
+                    func(*args, **kwargs)
+                except:
+                    self._log.exception('internal error')
 
     def __repr__(self):
         result = '%s(name=%r, eventqueue=%r)' % (
@@ -179,7 +557,7 @@ class EventQueueTestCase(unittest.TestCase):
         '''Test the event queue.'''
 
         eventqueue = geteventqueue()
-        eventqueue._queue.clear()
+        eventqueue.clear()
 
         event = Event('event')
         callback1 = Callback()
@@ -219,7 +597,7 @@ class EventQueueTestCase(unittest.TestCase):
         '''Test the runiteration method with an empty queue.'''
 
         eventqueue = geteventqueue()
-        eventqueue._queue.clear()
+        eventqueue.clear()
 
         self.assertFalse(eventqueue.runiteration(False))
 
@@ -227,7 +605,7 @@ class EventQueueTestCase(unittest.TestCase):
         '''Test waiting for an event to be delivered by a second thread.'''
 
         eventqueue = geteventqueue()
-        eventqueue._queue.clear()
+        eventqueue.clear()
 
         event = Event('event')
         callback = Callback()
@@ -245,7 +623,7 @@ class EventQueueTestCase(unittest.TestCase):
         '''Test the stop method.'''
 
         eventqueue = geteventqueue()
-        eventqueue._queue.clear()
+        eventqueue.clear()
 
         event1 = Event('event1')
         callback1 = Callback()
@@ -260,11 +638,214 @@ class EventQueueTestCase(unittest.TestCase):
         self.assertTrue(callback1.delivered)
         self.assertFalse(callback2.delivered)
 
+    def test_key_order(self):
+        '''Test that the events for one key are delivered in order and
+        never at the same time.'''
+
+        eventqueue = EventQueue()
+        key = object()
+        event1 = Event('event1', eventqueue, key)
+        event2 = Event('event2', eventqueue, key)
+        delivered = []
+        active = []
+        overlapped = []
+        def callback(value):
+            active.append(value)
+            if 1 != len(active):
+                overlapped.append(value)
+            time.sleep(0.001)
+            delivered.append(value)
+            active.remove(value)
+        event1.attach(callback)
+        event2.attach(callback)
+        for value in range(20):
+            if 0 == value % 2:
+                event1(value)
+            else:
+                event2(value)
+        threads = []
+        for i in range(4):
+            thread = threading.Thread(target=eventqueue.run)
+            thread.start()
+            threads.append(thread)
+        while len(delivered) < 20:
+            time.sleep(0.01)
+        eventqueue.stop()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(range(20), delivered)
+        self.assertEqual([], overlapped)
+
+    def test_key_parallel(self):
+        '''Test that a slow handler does not hold up the events for another
+        key.'''
+
+        eventqueue = EventQueue()
+        release = threading.Event()
+        slow = Event('slow', eventqueue, 'slow')
+        slow.attach(release.wait)
+        fast = Event('fast', eventqueue, 'fast')
+        callback = Callback()
+        fast.attach(callback)
+        slow()
+        fast()
+        threads = []
+        for i in range(2):
+            thread = threading.Thread(target=eventqueue.run)
+            thread.start()
+            threads.append(thread)
+        for i in range(100):
+            if callback.delivered:
+                break
+            time.sleep(0.01)
+        self.assertTrue(callback.delivered)
+        release.set()
+        eventqueue.stop()
+        for thread in threads:
+            thread.join()
+
+    def test_priority(self):
+        '''Test that a control event is delivered ahead of the bulk events
+        for other keys, after the events queued before it for its own key.'''
+
+        eventqueue = EventQueue()
+        delivered = []
+        bulk1 = Event('bulk1', eventqueue, 'a')
+        bulk1.attach(lambda: delivered.append('bulk1'))
+        bulk2 = Event('bulk2', eventqueue, 'b')
+        bulk2.attach(lambda: delivered.append('bulk2'))
+        bulk3 = Event('bulk3', eventqueue, 'c')
+        bulk3.attach(lambda: delivered.append('bulk3'))
+        control = Event(
+            'control', eventqueue, 'c', priority=EventPriority.CONTROL)
+        control.attach(lambda: delivered.append('control'))
+        bulk1()
+        bulk2()
+        bulk3()
+        control()
+        while eventqueue.runiteration(False):
+            pass
+        self.assertEqual(['bulk3', 'control', 'bulk1', 'bulk2'], delivered)
+
+    def test_priority_starvation(self):
+        '''Test that a bulk event is delivered after `control_burst` control
+        events in a row.'''
+
+        eventqueue = EventQueue(control_burst=2)
+        delivered = []
+        bulk = Event('bulk', eventqueue)
+        bulk.attach(lambda: delivered.append('bulk'))
+        bulk()
+        for i in range(4):
+            control = Event(
+                'control', eventqueue, priority=EventPriority.CONTROL)
+            control.attach(lambda: delivered.append('control'))
+            control()
+        while eventqueue.runiteration(False):
+            pass
+        self.assertEqual(
+            ['control', 'control', 'bulk', 'control', 'control'], delivered)
+
+    def test_getstats(self):
+        '''Test the queueing delay statistics of each priority.'''
+
+        now = [100.0]
+        eventqueue = EventQueue(clock=lambda: now[0])
+        bulk = Event('bulk', eventqueue)
+        control = Event('control', eventqueue, priority=EventPriority.CONTROL)
+        bulk()
+        bulk()
+        control()
+        stats = eventqueue.getstats()
+        self.assertEqual(2, stats['bulk']['depth'])
+        self.assertEqual(1, stats['control']['depth'])
+        now[0] = 101.0
+        self.assertTrue(eventqueue.runiteration(False))
+        now[0] = 103.0
+        while eventqueue.runiteration(False):
+            pass
+        stats = eventqueue.getstats()
+        self.assertEqual(
+            {'depth': 0, 'delivered': 1, 'mean_delay': 1.0, 'max_delay': 1.0},
+            stats['control'])
+        self.assertEqual(
+            {'depth': 0, 'delivered': 2, 'mean_delay': 3.0, 'max_delay': 3.0},
+            stats['bulk'])
+
+    def test_geteventstats(self):
+        '''Test the depth, delay and handler time statistics of each event
+        name.'''
+
+        now = [100.0]
+        eventqueue = EventQueue(clock=lambda: now[0])
+        def callback():
+            now[0] += 0.5
+        event1 = Event('event1', eventqueue)
+        event1.attach(callback)
+        event2 = Event('event2', eventqueue)
+        event1()
+        event1()
+        event2()
+        stats = eventqueue.geteventstats()
+        self.assertEqual(2, stats['event1']['depth'])
+        self.assertEqual(2, stats['event1']['max_depth'])
+        self.assertEqual(1, stats['event2']['queued'])
+        now[0] = 102.0
+        while eventqueue.runiteration(False):
+            pass
+        stats = eventqueue.geteventstats()
+        self.assertEqual(2, stats['event1']['queued'])
+        self.assertEqual(2, stats['event1']['delivered'])
+        self.assertEqual(0, stats['event1']['depth'])
+        self.assertEqual(2, stats['event1']['max_depth'])
+        self.assertEqual(2.25, stats['event1']['delay']['mean'])
+        self.assertEqual(2.5, stats['event1']['delay']['max'])
+        self.assertEqual(
+            [[0.001, 0], [0.01, 0], [0.1, 0], [1.0, 0], [10.0, 2], [None, 0]],
+            stats['event1']['delay']['histogram'])
+        self.assertEqual(0.5, stats['event1']['handler_time']['mean'])
+        self.assertEqual(0.5, stats['event1']['handler_time']['max'])
+        self.assertEqual(
+            [[0.001, 0], [0.01, 0], [0.1, 0], [1.0, 2], [10.0, 0], [None, 0]],
+            stats['event1']['handler_time']['histogram'])
+        self.assertEqual(0, stats['event1']['handler_time']['slow'])
+        self.assertEqual(0.0, stats['event2']['handler_time']['max'])
+        report = eventqueue.getreport()
+        self.assertEqual(stats, report['events'])
+        self.assertEqual(3, report['priorities']['bulk']['delivered'])
+        eventqueue.clear()
+        self.assertEqual({}, eventqueue.geteventstats())
+
+    def test_slowhandler(self):
+        '''Test that an event whose handlers take longer than the slow handler
+        budget is logged.'''
+
+        conveyor.test.listlogging('WARNING')
+        conveyor.test.ListHandler.list = []
+        now = [100.0]
+        eventqueue = EventQueue(clock=lambda: now[0])
+        eventqueue.setslowhandlerbudget(1.0)
+        durations = [0.5, 2.0]
+        def callback():
+            now[0] += durations.pop(0)
+        event = Event('event', eventqueue)
+        event.attach(callback)
+        event()
+        event()
+        while eventqueue.runiteration(False):
+            pass
+        self.assertEqual(1, len(conveyor.test.ListHandler.list))
+        record = conveyor.test.ListHandler.list[0]
+        self.assertEqual('event', record.args[0])
+        self.assertEqual(2.0, record.args[1])
+        stats = eventqueue.geteventstats()
+        self.assertEqual(1, stats['event']['handler_time']['slow'])
+
     def test_Exception(self):
         '''Test an event handler that throws an exception.'''
 
         eventqueue = geteventqueue()
-        eventqueue._queue.clear()
+        eventqueue.clear()
 
         conveyor.test.listlogging('ERROR')
         conveyor.test.ListHandler.list = []
@@ -0,0 +1,245 @@
+# vim:ai:et:ff=unix:fileencoding=utf-8:sw=4:ts=4:
+# conveyor/src/main/python/conveyor/executor.py
+#
+# conveyor - Printing dispatch engine for 3D objects and their friends.
+# Copyright © 2012 Matthew W. Samsonoff <matthew.samsonoff@makerbot.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import (absolute_import, print_function, unicode_literals)
+
+import collections
+import threading
+import time
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import conveyor.error
+import conveyor.log
+import conveyor.stoppable
+
+
+class Executor(conveyor.stoppable.StoppableInterface):
+    '''
+    A fixed pool of worker threads that run submitted work items. The queue of
+    pending work is bounded: `submit` blocks while it is full so that a busy
+    producer is slowed down instead of buffering without limit.
+
+    '''
+
+    def __init__(self, name, threads, maxsize):
+        conveyor.stoppable.StoppableInterface.__init__(self)
+        self._name = name
+        self._log = conveyor.log.getlogger(self)
+        self._condition = threading.Condition()
+        self._queue = collections.deque()
+        self._maxsize = maxsize
+        self._stop = False
+        self._threads = []
+        for i in range(threads):
+            thread_name = '%s-%d' % (name, i)
+            thread = threading.Thread(target=self._target, name=thread_name)
+            thread.daemon = True
+            self._threads.append(thread)
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def run(self):
+        self.start()
+
+    def stop(self):
+        with self._condition:
+            self._stop = True
+            self._condition.notify_all()
+
+    def join(self, timeout=None):
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def submit(self, func):
+        '''
+        Queue `func` to be invoked by one of the worker threads. Blocks while
+        the queue is full. Returns `False` if the executor is stopped.
+
+        '''
+
+        with self._condition:
+            while not self._stop and len(self._queue) >= self._maxsize:
+                self._condition.wait()
+            if self._stop:
+                result = False
+            else:
+                self._queue.append(func)
+                self._condition.notify_all()
+                result = True
+        return result
+
+    def _target(self):
+        while True:
+            with self._condition:
+                while not self._stop and 0 == len(self._queue):
+                    self._condition.wait()
+                if self._stop:
+                    break
+                else:
+                    func = self._queue.popleft()
+                    self._condition.notify_all()
+            conveyor.error.guard(self._log, func)
+
+
+class SerialQueue(object):
+    '''
+    Runs submitted work items one at a time and in order on the worker threads
+    of a shared `Executor`. The queue is scheduled on the executor when work is
+    submitted to it while it is idle, and a worker runs its items until it is
+    empty. An idle queue holds no worker, and many queues share the threads of
+    one executor, so the number of threads does not grow with the number of
+    queues.
+
+    '''
+
+    def __init__(self, executor):
+        self._executor = executor
+        self._log = conveyor.log.getlogger(self)
+        self._condition = threading.Condition()
+        self._queue = collections.deque()
+        self._scheduled = False
+
+    def submit(self, func):
+        '''
+        Queue `func` to be invoked after the work submitted before it. The
+        queue is run on the calling thread if the executor is stopped.
+
+        '''
+
+        with self._condition:
+            self._queue.append(func)
+            schedule = not self._scheduled
+            self._scheduled = True
+        if schedule and not self._executor.submit(self._run):
+            self._run()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if 0 == len(self._queue):
+                    self._scheduled = False
+                    break
+                else:
+                    func = self._queue.popleft()
+            conveyor.error.guard(self._log, func)
+
+
+class _ExecutorTestCase(unittest.TestCase):
+    def test_submit(self):
+        '''Test that submitted work runs concurrently on the worker threads.'''
+
+        executor = Executor('test', 2, 4)
+        executor.start()
+        try:
+            barrier = threading.Condition()
+            arrived = []
+            def func():
+                with barrier:
+                    arrived.append(threading.current_thread().name)
+                    barrier.notify_all()
+                    while len(arrived) < 2:
+                        barrier.wait(1.0)
+            self.assertTrue(executor.submit(func))
+            self.assertTrue(executor.submit(func))
+            with barrier:
+                while len(arrived) < 2:
+                    barrier.wait(1.0)
+            self.assertEqual(set(['test-0', 'test-1']), set(arrived))
+        finally:
+            executor.stop()
+            executor.join(1)
+
+    def test_stop(self):
+        '''Test that `submit` refuses work after the executor stops.'''
+
+        executor = Executor('test', 1, 1)
+        executor.stop()
+        self.assertFalse(executor.submit(lambda: None))
+
+
+class _SerialQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self._executor = Executor('test', 2, 16)
+        self._executor.start()
+
+    def tearDown(self):
+        self._executor.stop()
+        self._executor.join(1)
+
+    def test_submit(self):
+        '''Test that the work of each queue runs in order, one item at a time,
+        on the threads of the executor, and that an idle queue is scheduled
+        again.'''
+
+        queues = [SerialQueue(self._executor) for i in range(8)]
+        condition = threading.Condition()
+        calls = collections.defaultdict(list)
+        running = set()
+        overlaps = []
+        def func(queue, i):
+            with condition:
+                if queue in running:
+                    overlaps.append(queue)
+                running.add(queue)
+            time.sleep(0.001)
+            with condition:
+                running.discard(queue)
+                calls[queue].append((i, threading.current_thread().name))
+                condition.notify_all()
+        threads = threading.active_count()
+        for i in range(5):
+            for queue in queues:
+                queue.submit(lambda queue=queue, i=i: func(queue, i))
+        with condition:
+            while sum(len(c) for c in calls.values()) < 40:
+                condition.wait(1.0)
+        self.assertEqual(threads, threading.active_count())
+        self.assertEqual([], overlaps)
+        for queue in queues:
+            self.assertEqual(range(5), [i for i, name in calls[queue]])
+        names = set(
+            name for c in calls.values() for i, name in c)
+        self.assertTrue(names <= set(['test-0', 'test-1']))
+        for i in range(100):
+            with queues[0]._condition:
+                if not queues[0]._scheduled:
+                    break
+            time.sleep(0.01)
+        self.assertFalse(queues[0]._scheduled)
+        queues[0].submit(lambda: func(queues[0], 5))
+        with condition:
+            while len(calls[queues[0]]) < 6:
+                condition.wait(1.0)
+        self.assertEqual(5, calls[queues[0]][-1][0])
+
+    def test_stopped(self):
+        '''Test that a queue runs its work on the calling thread once the
+        executor is stopped.'''
+
+        self._executor.stop()
+        queue = SerialQueue(self._executor)
+        calls = []
+        queue.submit(lambda: calls.append(threading.current_thread()))
+        self.assertEqual([threading.current_thread()], calls)
@@ -0,0 +1,404 @@
+# vim:ai:et:ff=unix:fileencoding=utf-8:sw=4:ts=4:
+# conveyor/src/main/python/conveyor/fdpass.py
+#
+# conveyor - Printing dispatch engine for 3D objects and their friends.
+# Copyright © 2012 Matthew W. Samsonoff <matthew.samsonoff@makerbot.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Pass open file descriptors over a local socket with SCM_RIGHTS, so that a
+client can hand the conveyor service the files it prints from and to instead
+of their paths.
+
+The descriptors ride along with the bytes of a message. The receiving end of a
+connection numbers them in the order they arrive, starting at 0, and the
+sending end counts them the same way, so a request can refer to a descriptor
+by its number.
+
+Python 2 has no `socket.sendmsg`, so `sendmsg(2)` and `recvmsg(2)` are invoked
+through `ctypes`. Passing descriptors is only supported on Linux.
+
+'''
+
+from __future__ import (absolute_import, print_function, unicode_literals)
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import os.path
+import shutil
+import socket
+import tempfile
+import threading
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import conveyor.error
+import conveyor.log
+import conveyor.platform
+
+# The most descriptors that can arrive with one read.
+MAXFDS = 16
+
+# The most received descriptors a connection holds before they are taken by a
+# request. Any more are closed.
+_MAXDESCRIPTORS = 64
+
+_SCM_RIGHTS = 1
+
+_MSG_CTRUNC = 0x08
+
+_MSG_CMSG_CLOEXEC = 0x40000000
+
+
+class _iovec(ctypes.Structure):
+    _fields_ = [
+        (b'iov_base', ctypes.c_void_p),
+        (b'iov_len', ctypes.c_size_t),
+    ]
+
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [
+        (b'msg_name', ctypes.c_void_p),
+        (b'msg_namelen', ctypes.c_uint32),
+        (b'msg_iov', ctypes.POINTER(_iovec)),
+        (b'msg_iovlen', ctypes.c_size_t),
+        (b'msg_control', ctypes.c_void_p),
+        (b'msg_controllen', ctypes.c_size_t),
+        (b'msg_flags', ctypes.c_int),
+    ]
+
+
+class _cmsghdr(ctypes.Structure):
+    _fields_ = [
+        (b'cmsg_len', ctypes.c_size_t),
+        (b'cmsg_level', ctypes.c_int),
+        (b'cmsg_type', ctypes.c_int),
+    ]
+
+
+def _align(length):
+    size = ctypes.sizeof(ctypes.c_size_t)
+    result = (length + size - 1) & ~(size - 1)
+    return result
+
+
+def _cmsglen(length):
+    result = _align(ctypes.sizeof(_cmsghdr)) + length
+    return result
+
+
+def _cmsgspace(length):
+    result = _align(ctypes.sizeof(_cmsghdr)) + _align(length)
+    return result
+
+
+_libc = None
+
+_libclock = threading.Lock()
+
+
+def _getlibc():
+    global _libc
+    with _libclock:
+        if None is _libc:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            libc.sendmsg.argtypes = [
+                ctypes.c_int, ctypes.POINTER(_msghdr), ctypes.c_int]
+            libc.sendmsg.restype = ctypes.c_ssize_t
+            libc.recvmsg.argtypes = [
+                ctypes.c_int, ctypes.POINTER(_msghdr), ctypes.c_int]
+            libc.recvmsg.restype = ctypes.c_ssize_t
+            _libc = libc
+    return _libc
+
+
+def isavailable():
+    '''Return whether descriptors can be passed on this platform.'''
+
+    result = conveyor.platform.is_linux()
+    return result
+
+
+def _raiseerrno():
+    code = ctypes.get_errno()
+    raise socket.error(code, os.strerror(code))
+
+
+def sendfds(sock, data, fds):
+    '''
+    Send a prefix of `data` and the descriptors `fds` on the Unix domain socket
+    `sock`. Returns the number of bytes sent, like `socket.send`. The caller
+    keeps its descriptors open; the receiver gets its own copies.
+
+    '''
+
+    if 0 == len(data):
+        raise ValueError(data)
+    buf = ctypes.create_string_buffer(data, len(data))
+    iov = _iovec(ctypes.cast(buf, ctypes.c_void_p), len(data))
+    space = _cmsgspace(len(fds) * ctypes.sizeof(ctypes.c_int))
+    control = ctypes.create_string_buffer(space)
+    header = _cmsghdr.from_buffer(control)
+    header.cmsg_len = _cmsglen(len(fds) * ctypes.sizeof(ctypes.c_int))
+    header.cmsg_level = socket.SOL_SOCKET
+    header.cmsg_type = _SCM_RIGHTS
+    array = (ctypes.c_int * len(fds)).from_buffer(
+        control, _align(ctypes.sizeof(_cmsghdr)))
+    array[:] = fds
+    msg = _msghdr(
+        None, 0, ctypes.pointer(iov), 1, ctypes.cast(control, ctypes.c_void_p),
+        space, 0)
+    libc = _getlibc()
+    while True:
+        sent = libc.sendmsg(sock.fileno(), ctypes.byref(msg), 0)
+        if -1 != sent:
+            return sent
+        elif errno.EINTR != ctypes.get_errno():
+            _raiseerrno()
+
+
+def recvfds(sock, size, maxfds=MAXFDS):
+    '''
+    Receive up to `size` bytes and any descriptors that arrive with them from
+    the Unix domain socket `sock`. Returns the data, a list of the received
+    descriptors, which the caller must close, and whether descriptors beyond
+    `maxfds` were discarded by the kernel.
+
+    '''
+
+    buf = ctypes.create_string_buffer(size)
+    iov = _iovec(ctypes.cast(buf, ctypes.c_void_p), size)
+    space = _cmsgspace(maxfds * ctypes.sizeof(ctypes.c_int))
+    control = ctypes.create_string_buffer(space)
+    msg = _msghdr(
+        None, 0, ctypes.pointer(iov), 1, ctypes.cast(control, ctypes.c_void_p),
+        space, 0)
+    libc = _getlibc()
+    while True:
+        count = libc.recvmsg(
+            sock.fileno(), ctypes.byref(msg), _MSG_CMSG_CLOEXEC)
+        if -1 != count:
+            break
+        elif errno.EINTR != ctypes.get_errno():
+            _raiseerrno()
+    fds = []
+    offset = 0
+    hdrlen = _align(ctypes.sizeof(_cmsghdr))
+    while offset + ctypes.sizeof(_cmsghdr) <= msg.msg_controllen:
+        header = _cmsghdr.from_buffer(control, offset)
+        if header.cmsg_len < hdrlen:
+            break
+        elif (socket.SOL_SOCKET == header.cmsg_level
+                and _SCM_RIGHTS == header.cmsg_type):
+            n = (header.cmsg_len - hdrlen) // ctypes.sizeof(ctypes.c_int)
+            array = (ctypes.c_int * n).from_buffer(control, offset + hdrlen)
+            fds.extend(array)
+        offset += _align(header.cmsg_len)
+    truncated = bool(msg.msg_flags & _MSG_CTRUNC)
+    return buf.raw[:count], fds, truncated
+
+
+class DescriptorTable(object):
+    '''
+    The descriptors received on a connection, by number, until a request takes
+    them. The numbers count every descriptor received, even those that are
+    closed because too many are held, so that they match the sender's count.
+
+    '''
+
+    def __init__(self, maxdescriptors=_MAXDESCRIPTORS):
+        self._log = conveyor.log.getlogger(self)
+        self._lock = threading.Lock()
+        self._maxdescriptors = maxdescriptors
+        self._fds = {} # of number -> fd
+        self._next = 0
+
+    def add(self, fds):
+        closed = []
+        with self._lock:
+            for fd in fds:
+                if len(self._fds) < self._maxdescriptors:
+                    self._fds[self._next] = fd
+                else:
+                    closed.append(fd)
+                self._next += 1
+        for fd in closed:
+            os.close(fd)
+        if 0 != len(closed):
+            self._log.warning(
+                'closed %d unclaimed descriptors', len(closed))
+
+    def take(self, number):
+        '''
+        Remove the descriptor `number` from the table and return it. The
+        caller must close it.
+
+        '''
+
+        with self._lock:
+            fd = self._fds.pop(number, None)
+        if None is fd:
+            raise conveyor.error.UnknownDescriptorError(number)
+        return fd
+
+    def close(self):
+        '''Close the descriptors that were never taken.'''
+
+        with self._lock:
+            fds = list(self._fds.values())
+            self._fds.clear()
+        for fd in fds:
+            os.close(fd)
+
+
+class DescriptorFile(object):
+    '''
+    A received descriptor under a path with the base name of the file it was
+    opened from, so that the stages of a recipe and the processes they run can
+    open it like any other file and tell its type by its extension.
+
+    The path is a private copy. The file is only ever read or written through
+    the descriptor itself, never reopened by path, so the service does not need
+    permission to open the client's file. The contents of an input file are
+    copied to the path when it is created. The contents of the path of an
+    `output` file are copied to the descriptor when it is closed.
+
+    '''
+
+    def __init__(self, fd, name, output=False):
+        self.fd = fd
+        self._output = output
+        basename = os.path.basename(name or '') or 'file'
+        self._directory = tempfile.mkdtemp(prefix='conveyor-fd-')
+        self.path = os.path.join(self._directory, basename)
+        try:
+            with open(self.path, 'wb') as dst:
+                if not output:
+                    with os.fdopen(os.dup(fd), 'rb') as src:
+                        src.seek(0)
+                        shutil.copyfileobj(src, dst)
+        except:
+            self._remove()
+            raise
+
+    def close(self):
+        '''Copy an output file to the descriptor, remove the path and close the
+        descriptor.'''
+
+        try:
+            if self._output and os.path.exists(self.path):
+                with open(self.path, 'rb') as src:
+                    with os.fdopen(os.dup(self.fd), 'wb') as dst:
+                        dst.seek(0)
+                        dst.truncate()
+                        shutil.copyfileobj(src, dst)
+        finally:
+            try:
+                self._remove()
+            finally:
+                os.close(self.fd)
+
+    def _remove(self):
+        if os.path.lexists(self.path):
+            os.unlink(self.path)
+        os.rmdir(self._directory)
+
+
+class _FdPassTestCase(unittest.TestCase):
+    def setUp(self):
+        if not isavailable():
+            self.skipTest('passing descriptors is not supported')
+
+    def test_roundtrip(self):
+        '''Test that descriptors arrive with the bytes they were sent with.'''
+
+        a, b = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        r, w = os.pipe()
+        try:
+            self.assertEqual(5, sendfds(a, b'hello', [r, w]))
+            data, fds, truncated = recvfds(b, 1024)
+            self.assertEqual(b'hello', data)
+            self.assertEqual(2, len(fds))
+            os.write(fds[1], b'x')
+            self.assertEqual(b'x', os.read(r, 1))
+            for fd in fds:
+                os.close(fd)
+            a.sendall(b'plain')
+            self.assertEqual((b'plain', [], False), recvfds(b, 1024))
+        finally:
+            for fd in (r, w):
+                os.close(fd)
+            a.close()
+            b.close()
+
+    def test_table(self):
+        '''Test that descriptors are numbered in order and bounded.'''
+
+        table = DescriptorTable(2)
+        pipes = [os.pipe() for i in range(2)]
+        table.add(pipes[0])
+        fd = table.take(1)
+        self.assertEqual(pipes[0][1], fd)
+        os.close(fd)
+        with self.assertRaises(conveyor.error.UnknownDescriptorError):
+            table.take(1)
+        table.add(pipes[1])
+        with self.assertRaises(conveyor.error.UnknownDescriptorError):
+            table.take(3)
+        self.assertEqual(pipes[1][0], table.take(2))
+        os.close(pipes[1][0])
+        table.close()
+        self.assertEqual({}, table._fds)
+
+    def test_file(self):
+        '''Test that a descriptor file reads the file it was opened from, even
+        when the file can no longer be opened by its own path.'''
+
+        with tempfile.NamedTemporaryFile(suffix='.gcode') as fp:
+            fp.write(b'G1 X1\n')
+            fp.flush()
+            os.chmod(fp.name, 0)
+            descriptor_file = DescriptorFile(os.dup(fp.fileno()), fp.name)
+            try:
+                self.assertEqual(
+                    '.gcode', os.path.splitext(descriptor_file.path)[1])
+                for i in range(2):
+                    with open(descriptor_file.path) as f:
+                        self.assertEqual('G1 X1\n', f.read())
+            finally:
+                descriptor_file.close()
+            self.assertFalse(os.path.lexists(descriptor_file.path))
+
+    def test_output(self):
+        '''Test that an output descriptor file is written to the descriptor
+        when it is closed.'''
+
+        with tempfile.NamedTemporaryFile(suffix='.gcode') as fp:
+            fp.write(b'stale contents\n')
+            fp.flush()
+            descriptor_file = DescriptorFile(
+                os.dup(fp.fileno()), fp.name, output=True)
+            with open(descriptor_file.path, 'wb') as f:
+                f.write(b'G1 X1\n')
+            descriptor_file.close()
+            fp.seek(0)
+            self.assertEqual(b'G1 X1\n', fp.read())
+            self.assertFalse(os.path.lexists(descriptor_file.path))
@@ -19,7 +19,10 @@
 
 from __future__ import (absolute_import, print_function, unicode_literals)
 
+import time
+
 import conveyor.enum
+import conveyor.json
 
 
 JobType = conveyor.enum.enum(
@@ -31,7 +34,7 @@ class JobInfo(object):
 
     def __init__(
             self, type_, id_, name, state, progress, conclusion, failure,
-            machine_name, port_name, driver_name, profile_name):
+            machine_name, port_name, driver_name, profile_name, stages=None):
         self.type = type_
         self.id = id_
         self.name = name
@@ -43,6 +46,7 @@ class JobInfo(object):
         self.port_name = port_name
         self.driver_name = driver_name
         self.profile_name = profile_name
+        self.stages = stages
 
     def to_dict(self):
         dct = {
@@ -57,6 +61,7 @@ class JobInfo(object):
             'port_name': self.port_name,
             'driver_name': self.driver_name,
             'profile_name': self.profile_name,
+            'stages': self.stages,
         }
         return dct
 
@@ -66,16 +71,22 @@ class JobInfo(object):
             dct['type'], dct['id'], dct['name'], dct['state'],
             dct['progress'], dct['conclusion'], dct['failure'],
             dct['machine_name'], dct['port_name'], dct['driver_name'],
-            dct['profile_name'])
+            dct['profile_name'], dct.get('stages'))
         return info
 
 
+conveyor.json.register(JobInfo)
+
+
 class Job(object):
     def __init__(self, type_, id_, name):
         self.type = type_
         self.id = id_
         self.name = name
         self.task = None
+        # NOTE: the process that runs the job adds the task of each stage as
+        # it starts.
+        self.stages = []
 
     def _get_machine_name(self):
         return None
@@ -125,6 +136,10 @@ class Job(object):
             conclusion = self.task.conclusion
         return conclusion
 
+    def _get_stages(self):
+        stages = [task.get_timing() for task in self.stages]
+        return stages
+
     def get_info(self):
         state = self._get_state()
         progress = self._get_progress()
@@ -134,11 +149,27 @@ class Job(object):
         port_name = self._get_port_name()
         driver_name = self._get_driver_name()
         profile_name = self._get_profile_name()
+        stages = self._get_stages()
         info = JobInfo(
             self.type, self.id, self.name, state, progress, conclusion,
-            failure, machine_name, port_name, driver_name, profile_name)
+            failure, machine_name, port_name, driver_name, profile_name,
+            stages)
         return info
 
+    def log_job_stages(self, log):
+        now = time.time()
+        for task in self.stages:
+            if None is not task.running_time:
+                waited = task.running_time - task.pending_time
+                ran = 'ran %.3fs' % (
+                    (task.stopped_time or now) - task.running_time,)
+            else:
+                waited = (task.stopped_time or now) - task.pending_time
+                ran = 'never ran'
+            log.info(
+                'job %d stage %s: waited %.3fs, %s, %.3fs callback cpu',
+                self.id, task.name, waited, ran, task.callback_cpu_time)
+
     def log_job_started(self, log):
         raise NotImplementedError
 
@@ -220,6 +251,9 @@ class PrintToFileJob(Job):
         self.profile = profile
         self.input_file = input_file
         self.output_file = output_file
+        # NOTE: when it is set, the output is streamed to the client and
+        # `output_file` only names the job.
+        self.output_stream = None
         self.extruder_name = extruder_name
         self.file_type = file_type
         self.gcode_processor_name = gcode_processor_name
@@ -22,18 +22,223 @@ from __future__ import (absolute_import, print_function, unicode_literals)
 import StringIO
 import decimal
 import json
+import re
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
 
 
 # Float is an abomination.
 # http://stackoverflow.com/questions/1960516/python-json-serialize-a-decimal-object
 class DecimalEncoder(json.JSONEncoder):
-    def iterencode(self, o, *args, **kwargs):
+    '''
+    A JSON encoder that writes `Decimal` values anywhere in the tree as JSON
+    numbers. It uses the pure-Python encoder since the C encoder only accepts
+    built-in types.
+
+    '''
+
+    def default(self, o):
+        if type(o) in _REGISTERED:
+            result = o.to_dict()
+        else:
+            result = json.JSONEncoder.default(self, o)
+        return result
+
+    def iterencode(self, o, _one_shot=False):
+        if isinstance(o, decimal.Decimal):
+            return (self._decimalstr(o),)
+        if self.check_circular:
+            markers = {}
+        else:
+            markers = None
+        if self.ensure_ascii:
+            _encoder = json.encoder.encode_basestring_ascii
+        else:
+            _encoder = json.encoder.encode_basestring
+        if self.encoding != 'utf-8':
+            def _encoder(o, _orig_encoder=_encoder, _encoding=self.encoding):
+                if isinstance(o, str):
+                    o = o.decode(_encoding)
+                return _orig_encoder(o)
+        def floatstr(o, allow_nan=self.allow_nan,
+                _repr=json.encoder.FLOAT_REPR, _inf=json.encoder.INFINITY,
+                _neginf=-json.encoder.INFINITY):
+            if isinstance(o, decimal.Decimal):
+                return self._decimalstr(o)
+            elif o != o:
+                text = 'NaN'
+            elif o == _inf:
+                text = 'Infinity'
+            elif o == _neginf:
+                text = '-Infinity'
+            else:
+                return _repr(o)
+            if not allow_nan:
+                raise ValueError(
+                    'Out of range float values are not JSON compliant: ' +
+                    repr(o))
+            return text
+        # NOTE: `_make_iterencode` takes the float type as a keyword argument.
+        # Passing `Decimal` alongside it routes decimals to `floatstr`.
+        _iterencode = json.encoder._make_iterencode(
+            markers, self.default, _encoder, self.indent, floatstr,
+            self.key_separator, self.item_separator, self.sort_keys,
+            self.skipkeys, _one_shot, float=(float, decimal.Decimal))
+        return _iterencode(o, 0)
+
+    def _decimalstr(self, o):
+        if not o.is_finite() and not self.allow_nan:
+            raise ValueError(
+                'Out of range decimal values are not JSON compliant: %r' % (o,))
+        elif o.is_nan():
+            text = 'NaN'
+        elif o.is_infinite():
+            text = '-Infinity' if o.is_signed() else 'Infinity'
+        else:
+            text = unicode(o)
+        return text
+
+
+class _HasDecimal(Exception):
+    pass
+
+
+def _default(o):
+    if type(o) in _REGISTERED:
+        result = o.to_dict()
+    else:
+        raise TypeError(repr(o) + ' is not JSON serializable')
+    return result
+
+
+class _PythonBackend(object):
+    '''The pure-Python fallback.'''
+
+    name = 'python'
+
+    def __init__(self):
+        self._encoder = DecimalEncoder()
+
+    def dumps(self, obj):
+        return self._encoder.encode(obj)
+
+
+class _SimplejsonBackend(object):
+    '''The `simplejson` codec. Its C encoder handles `Decimal` natively.'''
+
+    name = 'simplejson'
+
+    def __init__(self, simplejson):
+        self._encoder = simplejson.JSONEncoder(
+            use_decimal=True, default=_default)
+
+    def dumps(self, obj):
+        return self._encoder.encode(obj)
+
+
+class _JsonBackend(object):
+    '''
+    The standard library's C encoder. `json.JSONEncoder.encode` builds a new C
+    encoder for every call, which costs about as much as encoding a small
+    notification, so this backend builds one up front and reuses it.
+
+    The C encoder only accepts built-in types. A tree that contains a
+    `Decimal` is re-encoded with `decimalbackend`.
+
+    '''
+
+    name = 'json'
+
+    def __init__(self, decimalbackend):
+        # NOTE: the markers dict used to detect circular references is left
+        # out. It is not safe to share between threads and the payloads are
+        # never circular. Infinite recursion still raises a `RuntimeError`.
+        self._iterencode = json.encoder.c_make_encoder(
+            None, self._default, json.encoder.encode_basestring_ascii, None,
+            ': ', ', ', False, False, True)
+        self._decimalbackend = decimalbackend
+
+    def _default(self, o):
         if isinstance(o, decimal.Decimal):
-            result = (str(o),)
+            raise _HasDecimal
         else:
-            result = json.JSONEncoder.iterencode(self, o, *args, **kwargs)
+            result = _default(o)
         return result
 
+    def dumps(self, obj):
+        try:
+            result = ''.join(self._iterencode(obj, 0))
+        except _HasDecimal:
+            result = self._decimalbackend.dumps(obj)
+        return result
+
+
+def _getbackends():
+    '''Return the available codec backends, fastest first.'''
+
+    python = _PythonBackend()
+    try:
+        import simplejson
+        import simplejson.encoder
+    except ImportError:
+        simplejson = None
+    # NOTE: without its C speedups simplejson is slower than the pure-Python
+    # encoder in the standard library.
+    if None is simplejson or None is simplejson.encoder.c_make_encoder:
+        backends = []
+        decimalbackend = python
+    else:
+        backends = [_SimplejsonBackend(simplejson)]
+        decimalbackend = backends[0]
+    if None is not json.encoder.c_make_encoder:
+        backends.insert(0, _JsonBackend(decimalbackend))
+    backends.append(python)
+    return backends
+
+
+_BACKENDS = _getbackends()
+
+_backend = _BACKENDS[0]
+
+
+def getbackends():
+    return [backend.name for backend in _BACKENDS]
+
+
+def getbackend():
+    return _backend.name
+
+
+def setbackend(name):
+    '''Select the codec backend used by `dumps`. See `getbackends`.'''
+
+    global _backend
+    for backend in _BACKENDS:
+        if name == backend.name:
+            _backend = backend
+            break
+    else:
+        raise ValueError(name)
+
+
+# The payload types that are sent most often. See `register`.
+_REGISTERED = set()
+
+
+def register(cls):
+    '''
+    Register a type that `dumps` encodes from its `to_dict` method. Passing an
+    instance to `dumps` directly, instead of the result of `to_dict`, encodes
+    the dictionary at the top level with the backend's C encoder. Instances
+    nested in other values are converted through the encoder's `default` hook.
+
+    '''
+
+    _REGISTERED.add(cls)
+
 
 def dump(obj, fp, *args, **kwargs):
     kwargs[str('cls')] = DecimalEncoder
@@ -42,8 +247,13 @@ def dump(obj, fp, *args, **kwargs):
 
 
 def dumps(obj, *args, **kwargs):
-    kwargs[str('cls')] = DecimalEncoder
-    result = json.dumps(obj, *args, **kwargs)
+    if 0 != len(args) or 0 != len(kwargs):
+        kwargs[str('cls')] = DecimalEncoder
+        result = json.dumps(obj, *args, **kwargs)
+    else:
+        if type(obj) in _REGISTERED:
+            obj = obj.to_dict()
+        result = _backend.dumps(obj)
     return result
 
 
@@ -120,6 +330,39 @@ def load(fp, *args, **kwargs):
 # validation performed by S0 and S1: S0 only accepts whitespace while S1 will
 # accept anything. This is a subtle effect. Changing the validation will merely
 # have other subtle effects. Tread carefully.
+#
+# `feed` does not call `_consume` for every character. In the states that
+# consume long runs of uninteresting characters (S0, S1, S2, S5, S6, S9, and
+# S10) it matches the longest run of characters that cannot change the state,
+# the stack, or trigger a send and writes that run to the buffer as a single
+# slice. The character that ends the run is then passed to `_consume` as usual.
+# This is exactly equivalent to consuming the run one character at a time. In
+# S1 a run includes complete JSON strings (S1 -> S2 -> ... -> S1 round trips);
+# an incomplete string ends the run at its opening quote so that `_consume`
+# enters S2. Keep the patterns below in sync with `_consume`.
+
+# Matches whitespace in S0.
+_S0_PATTERN = re.compile(r'[ \t\n\r]*')
+
+# Matches JSON text and complete strings in S1.
+_S1_PATTERN = re.compile(
+    r'(?:[^"{}\[\]]+|"[^"\\]*(?:\\[\s\S][^"\\]*)*")*')
+
+# Like `_S1_PATTERN`, but stops at the start of a comment.
+_S1_COMMENTS_PATTERN = re.compile(
+    r'(?:[^"{}\[\]/]+|"[^"\\]*(?:\\[\s\S][^"\\]*)*")*')
+
+# Matches the unescaped characters of a string in S2.
+_S2_PATTERN = re.compile(r'[^"\\]*')
+
+# Matches the body of a `//` comment in S5 and S9.
+_LINE_COMMENT_PATTERN = re.compile(r'[^\n\r]*')
+
+# Matches the body of a `/*` comment in S6 and S10.
+_BLOCK_COMMENT_PATTERN = re.compile(r'[^*]*')
+
+# Matches the characters of a `//` comment that are replaced by spaces.
+_LINE_COMMENT_BLANK_PATTERN = re.compile(r'[^\t]')
 
 class JsonReader(object):
     '''
@@ -150,8 +393,16 @@ class JsonReader(object):
     def __init__(self, callback, strip_comments):
         self._callback = callback
         self._strip_comments = strip_comments
+        self._suspended = False
         self._reset()
 
+    def getpendinglength(self):
+        '''Return the number of characters buffered for the incomplete
+        value.'''
+
+        result = self._buffer.tell()
+        return result
+
     def _reset(self):
         '''Reset the reader.'''
 
@@ -313,11 +564,80 @@ class JsonReader(object):
         if 0 != len(data.strip(' \t\n\r')):
             self._callback(data)
 
+    def _getpattern(self):
+        '''
+        Return the pattern that matches a run of characters that do not change
+        the current state, or `None` if the state must consume every character
+        individually.
+
+        '''
+
+        if 1 == self._state:
+            if self._strip_comments:
+                pattern = _S1_COMMENTS_PATTERN
+            else:
+                pattern = _S1_PATTERN
+        elif 2 == self._state:
+            pattern = _S2_PATTERN
+        elif 0 == self._state:
+            pattern = _S0_PATTERN
+        elif self._state in (5, 9):
+            pattern = _LINE_COMMENT_PATTERN
+        elif self._state in (6, 10):
+            pattern = _BLOCK_COMMENT_PATTERN
+        else:
+            pattern = None
+        return pattern
+
+    def _consumerun(self, run):
+        '''
+        Update the buffer with a run of characters that do not change the
+        state of the machine.
+
+        '''
+
+        if self._state in (5, 9):
+            self._buffer.write(_LINE_COMMENT_BLANK_PATTERN.sub(' ', run))
+        elif self._state in (6, 10):
+            self._buffer.write(' ' * len(run))
+        else:
+            self._buffer.write(run)
+
+    def suspend(self):
+        '''
+        Stop consuming the data passed to the current call to `feed`. This is
+        meant to be called from `callback` when the data that follows a JSON
+        object or array is not JSON text (i.e., after a change of framing).
+
+        '''
+
+        self._suspended = True
+
     def feed(self, data):
-        '''Feed data to the reader.'''
+        '''
+        Feed data to the reader. Returns `None`, or the unconsumed remainder of
+        `data` if `callback` invoked `suspend`.
+
+        '''
 
-        for ch in data:
-            self._consume(ch)
+        self._suspended = False
+        i = 0
+        length = len(data)
+        while i < length:
+            pattern = self._getpattern()
+            if None is pattern:
+                j = i
+            else:
+                j = pattern.match(data, i).end()
+                if j > i:
+                    self._consumerun(data[i:j])
+            if j < length:
+                self._consume(data[j])
+            i = j + 1
+            if self._suspended:
+                self._suspended = False
+                return data[i:]
+        return None
 
     def feedeof(self):
         '''
@@ -327,3 +647,149 @@ class JsonReader(object):
         '''
 
         self._send()
+
+
+class _JsonReaderTestCase(unittest.TestCase):
+    def _read(self, data, strip_comments, chunksize, bychar=False):
+        '''
+        Feed `data` to a reader in chunks of `chunksize` characters and return
+        the list of values passed to the callback.
+
+        '''
+
+        result = []
+        reader = JsonReader(result.append, strip_comments)
+        for i in range(0, len(data), chunksize):
+            chunk = data[i:i + chunksize]
+            if bychar:
+                for ch in chunk:
+                    reader._consume(ch)
+            else:
+                reader.feed(chunk)
+        reader.feedeof()
+        return result
+
+    def _assertequivalent(self, data):
+        '''
+        Assert that the scanning `feed` produces exactly the same callbacks as
+        the character-at-a-time state machine for every chunk size.
+
+        '''
+
+        for strip_comments in (False, True):
+            expected = self._read(data, strip_comments, 1, True)
+            for chunksize in (1, 2, 3, 7, len(data) or 1):
+                actual = self._read(data, strip_comments, chunksize)
+                self.assertEqual(expected, actual)
+
+    def test_objects(self):
+        '''Test a stream of objects and arrays.'''
+
+        data = '{"a": [1, 2, {"b": "}]"}]} [3, "x\\"y"]\n{}'
+        self.assertEqual(
+            ['{"a": [1, 2, {"b": "}]"}]}', ' [3, "x\\"y"]', '\n{}'],
+            self._read(data, False, len(data)))
+        self._assertequivalent(data)
+
+    def test_comments(self):
+        '''Test that comments are stripped like the state machine does.'''
+
+        data = (
+            '// leading\t comment\r\n/* block\n comment */ {"a": 1, // c\n'
+            ' /* x * / ** */ "b": "/* not a comment */"}\n')
+        result = self._read(data, True, len(data))
+        self.assertEqual(1, len(result))
+        self.assertEqual(
+            {'a': 1, 'b': '/* not a comment */'}, json.loads(result[0]))
+        self.assertEqual(len(data.rstrip('\n')), len(result[0]))
+        self._assertequivalent(data)
+
+    def test_invalid(self):
+        '''Test that invalid input is sent to the callback unchanged.'''
+
+        for data in ('x', '{]', '}', '/x', '{"a": 1 /x}', 'abc {}', '[1, 2'):
+            self._assertequivalent(data)
+
+    def test_callback_exception(self):
+        '''
+        Test that the reader is reset and stops scanning when the callback
+        raises an exception.
+
+        '''
+
+        result = []
+        def callback(data):
+            result.append(data)
+            if 1 == len(result):
+                raise ValueError(data)
+        reader = JsonReader(callback, False)
+        with self.assertRaises(ValueError):
+            reader.feed('{"a": 1} {"b": 2}')
+        self.assertEqual(['{"a": 1}'], result)
+        self.assertEqual(0, reader._state)
+        self.assertEqual('', reader._buffer.getvalue())
+
+    def test_suspend(self):
+        '''Test that `feed` returns the remainder after `suspend`.'''
+
+        result = []
+        def callback(data):
+            result.append(data)
+            reader.suspend()
+        reader = JsonReader(callback, False)
+        self.assertIsNone(reader.feed('{"a": '))
+        self.assertEqual('\nxyz', reader.feed('1}\nxyz'))
+        self.assertEqual(['{"a": 1}'], result)
+        self.assertEqual('', reader.feed('[]'))
+
+    def test_loads(self):
+        '''Test `loads` with comments.'''
+
+        self.assertEqual(
+            {'a': [1, 2]}, loads('/* c */ {"a": [1, // c\n 2]}\n'))
+
+
+class _EncoderTestCase(unittest.TestCase):
+    def test_decimal(self):
+        '''Test that every backend encodes nested `Decimal` values exactly.'''
+
+        obj = {'a': [decimal.Decimal('0.10'), {'b': decimal.Decimal('-2')}]}
+        for backend in _BACKENDS:
+            text = backend.dumps(obj)
+            self.assertIn('0.10', text)
+            self.assertEqual(
+                {'a': [decimal.Decimal('0.10'), {'b': -2}]},
+                json.loads(text, parse_float=decimal.Decimal))
+        self.assertEqual('1.50', dumps(decimal.Decimal('1.50')))
+        self.assertIn(
+            '0.10', dumps([decimal.Decimal('0.10')], sort_keys=True))
+
+    def test_registered(self):
+        '''
+        Test that registered types are encoded from `to_dict`, both at the top
+        level and nested.
+
+        '''
+
+        import conveyor.job
+        import conveyor.machine
+        import conveyor.machine.port
+        job_info = conveyor.job.JobInfo(
+            'PRINT_JOB', 1, 'é "name"', 'RUNNING',
+            {'name': 'print', 'progress': 5}, None, None, 'machine', 'port', 'driver', 'profile')
+        machine_info = conveyor.machine.MachineInfo(
+            'machine', 'port', 'driver', 'profile', 'IDLE')
+        machine_info.temperature = {'tools': {'0': decimal.Decimal('230.5')}}
+        machine_info.can_print = True
+        port_info = conveyor.machine.port.PortInfo(
+            'SERIAL', '/dev/ttyACM0', {'s3g': ['Replicator2']})
+        for backend in _BACKENDS:
+            setbackend(backend.name)
+            try:
+                for info in (job_info, machine_info, port_info):
+                    self.assertIn(type(info), _REGISTERED)
+                    expected = json.loads(dumps(info.to_dict()))
+                    self.assertEqual(expected, json.loads(dumps(info)))
+                    self.assertEqual([expected], json.loads(dumps([info])))
+            finally:
+                setbackend(_BACKENDS[0].name)
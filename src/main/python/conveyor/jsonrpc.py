@@ -21,20 +21,33 @@ from __future__ import (absolute_import, print_function, unicode_literals)
 
 import StringIO
 import codecs
+import collections
 import errno
 import json
 import logging
 import inspect
 import io
+import operator
 import os
+import struct
 import sys
 import threading
+import time
+import zlib
 
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import conveyor.connection
 import conveyor.event
+import conveyor.executor
 import conveyor.json
 import conveyor.log
 import conveyor.stoppable
 import conveyor.task
+import conveyor.timer
 
 
 def install(jsonrpc, obj):
@@ -43,7 +56,378 @@ def install(jsonrpc, obj):
             exported_name = getattr(value, '_jsonrpc_name', None)
             if None is exported_name:
                 exported_name = name
-            jsonrpc.addmethod(exported_name, value)
+            ordered = getattr(value, '_jsonrpc_ordered', True)
+            rate_class = getattr(value, '_jsonrpc_rate_class', None)
+            jsonrpc.addmethod(exported_name, value, ordered, rate_class)
+
+
+# Message framing modes. `FRAMING_JSONREADER` is the original framing where
+# messages are delimited by matching the braces of each top-level JSON object
+# or array. It is used until a peer negotiates one of the other modes with the
+# `hello` method. See `JsonRpc.negotiateframing` and `JsonRpc.hello`.
+FRAMING_JSONREADER = None
+FRAMING_NEWLINE = 'newline'
+FRAMING_LENGTH = 'length'
+
+# The default maximum length in bytes of an incoming message with the newline
+# or length framing. See `JsonRpc.setmaxframelength`.
+_MAXFRAMELENGTH = 4 * 1024 * 1024
+
+
+class _FrameTooLargeException(Exception):
+    def __init__(self, length, maxlength):
+        Exception.__init__(self, length, maxlength)
+        self.length = length
+        self.maxlength = maxlength
+
+
+class _JsonReaderFraming(object):
+    '''
+    The original framing. Incoming bytes are decoded and scanned by a
+    `JsonReader` to find the end of each message. A message is only limited to
+    `maxlength` characters when it is set.
+
+    '''
+
+    name = FRAMING_JSONREADER
+
+    def __init__(self, callback, maxlength=None):
+        self._decoder = codecs.getincrementaldecoder('UTF-8')()
+        self._jsonreader = conveyor.json.JsonReader(callback, False)
+        self._maxlength = maxlength
+
+    def encode(self, data):
+        return data.encode('UTF-8')
+
+    def feed(self, data):
+        '''
+        Feed bytes to the framing. Returns `None`, or the unconsumed remainder
+        if the framing was suspended by `suspend`.
+
+        '''
+
+        buffered, flag = self._decoder.getstate()
+        try:
+            text = self._decoder.decode(data)
+        except UnicodeDecodeError as e:
+            # NOTE: the message that switches to another framing or to
+            # compression may be followed by binary data in the same chunk.
+            # Feed the text before the first invalid byte. If it switches the
+            # framing, the rest of the chunk is returned as the remainder.
+            start = e.start - len(buffered)
+            if start < 0:
+                raise
+            text = self._decoder.decode(data[:start])
+            remainder = self._jsonreader.feed(text)
+            if None is remainder:
+                raise
+            buffered, flag = self._decoder.getstate()
+            remainder = b''.join((
+                remainder.encode('UTF-8'), buffered, data[start:]))
+        else:
+            remainder = self._jsonreader.feed(text)
+            if None is not remainder:
+                buffered, flag = self._decoder.getstate()
+                remainder = remainder.encode('UTF-8') + buffered
+        if None is not self._maxlength:
+            length = self._jsonreader.getpendinglength()
+            if length > self._maxlength:
+                raise _FrameTooLargeException(length, self._maxlength)
+        return remainder
+
+    def suspend(self):
+        self._jsonreader.suspend()
+
+    def feedeof(self):
+        self._jsonreader.feedeof()
+
+
+class _NewlineFraming(object):
+    '''
+    Newline-delimited JSON. `conveyor.json.dumps` never produces a raw newline
+    so each message is simply followed by one.
+
+    '''
+
+    name = FRAMING_NEWLINE
+
+    def __init__(self, callback, maxlength=_MAXFRAMELENGTH):
+        self._callback = callback
+        self._maxlength = maxlength
+        self._pending = []
+        self._pendinglength = 0
+
+    def encode(self, data):
+        return b''.join((data.encode('UTF-8'), b'\n'))
+
+    def feed(self, data):
+        i = 0
+        while True:
+            j = data.find(b'\n', i)
+            if -1 == j:
+                if i < len(data):
+                    self._pending.append(data[i:])
+                    self._pendinglength += len(data) - i
+                    if self._pendinglength > self._maxlength:
+                        raise _FrameTooLargeException(
+                            self._pendinglength, self._maxlength)
+                break
+            else:
+                self._pending.append(data[i:j])
+                frame = b''.join(self._pending)
+                self._pending = []
+                self._pendinglength = 0
+                i = j + 1
+                if len(frame) > self._maxlength:
+                    raise _FrameTooLargeException(len(frame), self._maxlength)
+                if 0 != len(frame.strip()):
+                    self._callback(frame)
+        return None
+
+    def suspend(self):
+        pass
+
+    def feedeof(self):
+        frame = b''.join(self._pending)
+        self._pending = []
+        self._pendinglength = 0
+        if 0 != len(frame.strip()):
+            self._callback(frame)
+
+
+class _LengthFraming(object):
+    '''
+    Length-prefixed JSON. Each message is preceded by its length in bytes as a
+    4-byte, big-endian, unsigned integer. A message longer than `maxlength`
+    is refused before any of it is buffered.
+
+    '''
+
+    name = FRAMING_LENGTH
+
+    _HEADER = struct.Struct(str('>I'))
+
+    def __init__(self, callback, maxlength=_MAXFRAMELENGTH):
+        self._callback = callback
+        self._maxlength = maxlength
+        self._pending = []
+        self._pendinglength = 0
+        self._length = None
+
+    def encode(self, data):
+        data = data.encode('UTF-8')
+        return b''.join((self._HEADER.pack(len(data)), data))
+
+    def feed(self, data):
+        self._pending.append(data)
+        self._pendinglength += len(data)
+        while True:
+            if None is self._length:
+                if self._pendinglength < self._HEADER.size:
+                    break
+                else:
+                    buffer = b''.join(self._pending)
+                    length, = self._HEADER.unpack_from(buffer)
+                    if length > self._maxlength:
+                        raise _FrameTooLargeException(length, self._maxlength)
+                    self._length = length
+                    self._pending = [buffer[self._HEADER.size:]]
+                    self._pendinglength -= self._HEADER.size
+            if self._pendinglength < self._length:
+                break
+            else:
+                buffer = b''.join(self._pending)
+                frame = buffer[:self._length]
+                self._pending = [buffer[self._length:]]
+                self._pendinglength -= self._length
+                self._length = None
+                self._callback(frame)
+        return None
+
+    def suspend(self):
+        pass
+
+    def feedeof(self):
+        if None is not self._length:
+            # A truncated message. Let the decoder report the parse error.
+            frame = b''.join(self._pending)
+            self._pending = []
+            self._pendinglength = 0
+            self._length = None
+            self._callback(frame)
+
+
+_FRAMINGS = {
+    FRAMING_NEWLINE: _NewlineFraming,
+    FRAMING_LENGTH: _LengthFraming,
+}
+
+
+def _createframing(framing, callback, maxlength=_MAXFRAMELENGTH):
+    if FRAMING_JSONREADER == framing:
+        result = _JsonReaderFraming(callback, maxlength)
+    else:
+        result = _FRAMINGS[framing](callback, maxlength)
+    return result
+
+
+# Compression modes. `COMPRESSION_NONE` is used until a peer negotiates
+# compression with the `hello` method. See `JsonRpc.negotiatecompression` and
+# `JsonRpc.hello`.
+COMPRESSION_NONE = None
+COMPRESSION_ZLIB = 'zlib'
+
+# The zlib compression level. Messages are small and compressed one at a time
+# so the higher levels cost more CPU for almost no gain.
+_ZLIB_LEVEL = 1
+
+
+class _ZlibCompressor(object):
+    '''
+    Compresses each framed message with a zlib stream that spans the whole
+    connection, so that later messages are compressed against the keys and
+    values of the earlier ones. Each message is flushed so that the peer can
+    decompress it as soon as it arrives.
+
+    '''
+
+    name = COMPRESSION_ZLIB
+
+    def __init__(self):
+        self._compressobj = zlib.compressobj(_ZLIB_LEVEL)
+
+    def compress(self, data):
+        return b''.join((
+            self._compressobj.compress(data),
+            self._compressobj.flush(zlib.Z_SYNC_FLUSH)))
+
+
+class _ZlibDecompressor(object):
+    '''
+    Decompresses the zlib stream of a connection at most `maxlength` + 1 bytes
+    at a time. The input that is not decompressed yet is kept for the next
+    call, so a small message that inflates to gigabytes is never inflated at
+    once; the framing refuses it once it is longer than `maxlength`.
+
+    '''
+
+    name = COMPRESSION_ZLIB
+
+    def __init__(self, maxlength=_MAXFRAMELENGTH):
+        self._decompressobj = zlib.decompressobj()
+        self._maxlength = maxlength
+        self._tail = b''
+        self._full = False
+
+    def decompress(self, data):
+        '''
+        Decompress the input kept by the last call followed by `data`. Returns
+        at most `maxlength` + 1 bytes.
+
+        '''
+
+        data = b''.join((self._tail, data))
+        result = self._decompressobj.decompress(data, self._maxlength + 1)
+        self._tail = self._decompressobj.unconsumed_tail
+        self._full = len(result) > self._maxlength
+        return result
+
+    def haspending(self):
+        '''Return whether more output may be decompressed without any more
+        input.'''
+
+        # NOTE: a call that fills its output may leave output in the
+        # decompressor even though all of its input was consumed.
+        result = 0 != len(self._tail) or self._full
+        return result
+
+
+_COMPRESSIONS = {
+    COMPRESSION_ZLIB: (_ZlibCompressor, _ZlibDecompressor),
+}
+
+
+# Outgoing queue overflow policies. See `JsonRpc.setoutputlimit`.
+OVERFLOW_DROP = 'drop'
+OVERFLOW_DISCONNECT = 'disconnect'
+
+
+# The most bytes that `JsonRpc.writeoutput` passes to a single `trysend`.
+_WRITEOUTPUT_SIZE = 65536
+
+
+class Notification(object):
+    '''
+    A notification that is serialized once and then sent to any number of
+    connections with `JsonRpc.sendnotification`. The encoded bytes are cached
+    for each framing.
+
+    A notification with a `key` supersedes any earlier notification with the
+    same key that is still queued for a connection. Superseded notifications
+    may be dropped when the queue overflows, and are coalesced when the
+    connection limits its notification rate. See
+    `JsonRpc.setnotificationinterval`.
+
+    A `terminal` notification, like the end of a job, is never dropped or
+    delayed. `merge(older, newer)`, if it is set, returns the notification
+    that replaces a pending notification and the newer one with the same key.
+    Otherwise the newer one simply replaces it.
+
+    '''
+
+    def __init__(self, method, params, key=None, terminal=False, merge=None):
+        self.method = method
+        self.params = params
+        self.key = key
+        self.terminal = terminal
+        self.merge = merge
+        notification = {'jsonrpc': '2.0', 'method': method, 'params': params}
+        self.data = conveyor.json.dumps(notification)
+        self._encoded = {}
+
+    def encode(self, framing):
+        try:
+            outdata = self._encoded[framing.name]
+        except KeyError:
+            outdata = framing.encode(self.data)
+            self._encoded[framing.name] = outdata
+        return outdata
+
+
+class Serialized(object):
+    '''
+    A result that is already serialized. A method returns one to send the
+    same result many times without encoding it again. `data` is the JSON text
+    of the result.
+
+    '''
+
+    def __init__(self, data):
+        self.data = data
+
+
+class _SerializedResponse(object):
+    def __init__(self, id, result):
+        self.data = ''.join((
+            '{"jsonrpc": "2.0", "result": ', result.data, ', "id": ',
+            conveyor.json.dumps(id), '}'))
+
+
+def _dumpresponse(response):
+    # NOTE: the responses to a batch are joined the same way the encoder
+    # joins the items of a list.
+    if isinstance(response, _SerializedResponse):
+        outdata = response.data
+    elif isinstance(response, list):
+        outdata = ''.join(
+            ('[', ', '.join(_dumpresponse(r) for r in response), ']'))
+    else:
+        outdata = conveyor.json.dumps(response)
+    return outdata
+
+
+# The default number of requests that may wait for their responses at once.
+_MAXPENDING = 1024
 
 
 class JsonRpcException(Exception):
@@ -54,31 +438,260 @@ class JsonRpcException(Exception):
         self.data = data
 
 
+class _MethodInfo(object):
+    '''
+    How to call a method with the params of a request. The signature of the
+    method is read once, when it is added, and compiled into `invoke`, which
+    binds the params of a request and calls the method without reflection. A
+    bad call is reported before the method runs, naming the parameter at
+    fault, and a `TypeError` raised inside the method is not mistaken for one.
+
+    '''
+
+    def __init__(self, func):
+        self.func = func
+        try:
+            spec = inspect.getargspec(func)
+        except TypeError:
+            # NOTE: a builtin or a callable object. Its params are checked by
+            # calling it.
+            self.compiled = False
+        else:
+            self.compiled = True
+            names = spec.args
+            if inspect.ismethod(func) and None is not func.__self__:
+                names = names[1:]
+            self._names = tuple(names)
+            self._nameset = frozenset(names)
+            self._defaults = tuple(spec.defaults or ())
+            self._required = len(names) - len(self._defaults)
+            self._varargs = None is not spec.varargs
+            self._varkw = None is not spec.keywords
+        self.invoke = self._compile()
+
+    def bind(self, args, kwargs):
+        '''
+        Return the positional and keyword arguments for a call with the
+        positional params `args` or the named params `kwargs`. Raises a
+        `JsonRpcException` with an 'invalid params' error if they do not
+        match the signature.
+
+        '''
+
+        if 0 != len(args):
+            result = self._bindargs(args)
+        else:
+            result = self._bindkwargs(kwargs)
+        return result
+
+    def _compile(self):
+        func = self.func
+        bind = self.bind
+        if not self.compiled:
+            def invoke(args, kwargs):
+                args, kwargs = bind(args, kwargs)
+                return func(*args, **kwargs)
+        else:
+            # NOTE: the common calls take the fast paths: the params given by
+            # position, or by name with either every param or only the
+            # required ones. A `KeyError` from a getter means an unexpected
+            # name. Any other call goes through `bind`, which finds the
+            # parameter at fault.
+            count = len(self._names)
+            required = self._required
+            minargs = required
+            if self._varargs:
+                maxargs = sys.maxsize
+            else:
+                maxargs = count
+            defaults = self._defaults
+            getall = _itemsgetter(self._names)
+            getrequired = _itemsgetter(self._names[:required])
+            def invoke(args, kwargs):
+                if 0 != len(args):
+                    if minargs <= len(args) <= maxargs:
+                        return func(*args)
+                elif 0 == len(kwargs):
+                    if 0 == required:
+                        return func()
+                elif count == len(kwargs):
+                    try:
+                        args = getall(kwargs)
+                    except KeyError:
+                        pass
+                    else:
+                        return func(*args)
+                elif required == len(kwargs):
+                    try:
+                        args = getrequired(kwargs)
+                    except KeyError:
+                        pass
+                    else:
+                        return func(*(args + defaults))
+                args, kwargs = bind(args, kwargs)
+                return func(*args, **kwargs)
+        return invoke
+
+    def _bindargs(self, args):
+        if not self.compiled:
+            return args, {}
+        elif len(args) < self._required:
+            raise self._invalid(
+                'missing parameter: %s' % (self._names[len(args)],))
+        elif len(args) > len(self._names) and not self._varargs:
+            raise self._invalid(
+                'too many parameters: expected at most %d, got %d'
+                    % (len(self._names), len(args)))
+        else:
+            return args, {}
+
+    def _bindkwargs(self, kwargs):
+        # NOTE: named params are passed positionally so that the keys, which
+        # are unicode, need not be converted.
+        if not self.compiled:
+            return (), _strkeys(kwargs)
+        args = []
+        matched = 0
+        for i, name in enumerate(self._names):
+            if name in kwargs:
+                args.append(kwargs[name])
+                matched += 1
+            elif i >= self._required:
+                args.append(self._defaults[i - self._required])
+            else:
+                raise self._invalid('missing parameter: %s' % (name,))
+        if matched == len(kwargs):
+            extra = {}
+        elif self._varkw:
+            extra = _strkeys(dict(
+                (k, v) for k, v in kwargs.items() if k not in self._nameset))
+        else:
+            unexpected = sorted(k for k in kwargs if k not in self._nameset)
+            raise self._invalid('unexpected parameter: %s' % (unexpected[0],))
+        return args, extra
+
+    def _invalid(self, data):
+        exception = JsonRpcException(-32602, 'invalid params', data)
+        return exception
+
+
+def _itemsgetter(names):
+    # NOTE: `operator.itemgetter` returns a single item, not a tuple, for a
+    # single name.
+    if 0 == len(names):
+        result = lambda kwargs: ()
+    elif 1 == len(names):
+        name, = names
+        result = lambda kwargs: (kwargs[name],)
+    else:
+        result = operator.itemgetter(*names)
+    return result
+
+
+def _strkeys(kwargs):
+    kwargs1 = {}
+    for k, v in kwargs.items():
+        k = str(k)
+        kwargs1[k] = v
+    return kwargs1
+
+
+class _TokenBucket(object):
+    '''
+    Admits up to `burst` requests at once and `rate` requests per second on
+    average. The caller must hold the lock of the `JsonRpc` that owns it.
+
+    '''
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = None
+
+    def take(self, now):
+        '''
+        Take a token. Returns 0 if one was available, otherwise the number of
+        seconds until one is.
+
+        '''
+
+        if None is not self._last:
+            elapsed = max(0.0, now - self._last)
+            self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+        self._last = now
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            result = 0
+        else:
+            result = (1.0 - self._tokens) / self.rate
+        return result
+
+
 class JsonRpc(conveyor.stoppable.StoppableInterface):
     """ JsonRpc handles a json stream, to gaurentee the output file pointer 
     gets entire valid JSON blocks of data to process, by buffering up data 
     into complete blocks and only passing on entirer JSON blocks 
     """
-    def __init__(self, infp, outfp):
+    def __init__(self, infp, outfp, executor=None):
         """
         @param infp input file pointer must have .read() and .stop()
         @param outfp output file pointer. must have .write()
+        @param executor optional conveyor.executor.Executor. When it is set,
+            requests for methods that are not ordered run concurrently on the
+            executor and their responses are sent as they complete.
         """
         self._condition = threading.Condition()
         self._idcounter = 0
         self._infp = infp # contract: .read(), .stop(), .close()
-        self._jsonreader = conveyor.json.JsonReader(
-            self._jsonreadercallback, False)
         self._log = conveyor.log.getlogger(self)
         self._methods = {}
-        self._methodsinfo={}
+        self._methodsinfo = {} # of method -> _MethodInfo
         self._outfp = outfp # contract: .write(str), .close()
         self._stopped = False
         self._tasks = {}
-        reader_class = codecs.getreader('UTF-8')
-        self._infp_reader = reader_class(self._infp)
-        writer_class = codecs.getwriter('UTF-8')
-        self._outfp_writer = writer_class(self._outfp)
+        self._readframing = _JsonReaderFraming(self._jsonreadercallback)
+        self._writeframing = self._readframing
+        self._writelock = threading.Lock()
+        self._written = threading.Condition(self._writelock)
+        self._outready = threading.Condition(self._writelock)
+        self._writer = None # created by the first `_flush`
+        self._writerstopped = False
+        self._outqueue = collections.deque() # of (key, data)
+        self._outoffset = 0 # bytes of the first message already sent
+        self._outbytes = 0
+        self._outpeak = 0
+        self._outdropped = 0
+        self._outlimit = None
+        self._overflow = OVERFLOW_DISCONNECT
+        self._outputcallback = None
+        self._outputrequested = False
+        self._disconnecting = False
+        self._disconnected = False
+        self._flushing = False
+        self._pendingframing = None
+        self._pendingcompression = None
+        self._compressor = None
+        self._decompressor = None
+        self._helloids = set()
+        self._executor = executor
+        self._unordered = set()
+        self._inflight = 0
+        self._deadlines = {} # of id -> conveyor.timer.TimerHandle
+        self._notificationinterval = None
+        self._coalesced = collections.OrderedDict() # of key -> Notification
+        self._coalescedcount = 0
+        self._lastsent = {} # of key -> time
+        self._coalescetimer = None
+        self._requesttimeout = None
+        self._maxpending = _MAXPENDING
+        self._maxframelength = _MAXFRAMELENGTH
+        self._closed = False
+        self._served = {} # of request id -> conveyor.task.Task
+        self._rateclasses = {} # of method -> rate class
+        self._buckets = {} # of rate class -> _TokenBucket
+        self._throttled = collections.defaultdict(int) # of rate class -> count
+        self.addmethod('cancel', self._cancel, False)
 
     #
     # Common part
@@ -92,23 +705,33 @@ class JsonRpc(conveyor.stoppable.StoppableInterface):
             response = self._parseerror()
         else:
             if isinstance(parsed, dict):
-                response = self._handleobject(parsed)
+                response = self._handleobject(parsed, True)
             elif isinstance(parsed, list):
                 response = self._handlearray(parsed)
             else:
                 response = self._invalidrequest(None)
         self._log.debug('response=%r', response)
+        with self._condition:
+            framing = self._pendingframing
+            self._pendingframing = None
+            compression = self._pendingcompression
+            self._pendingcompression = None
+        switch = None is not framing or None is not compression
         if None is not response:
-            outdata = conveyor.json.dumps(response)
-            self._send(outdata)
+            outdata = _dumpresponse(response)
+            self._send(outdata, framing, compression)
+        elif switch:
+            self._setwriteframing(framing, compression)
+        if switch:
+            self._setreadframing(framing, compression)
 
-    def _handleobject(self, parsed):
+    def _handleobject(self, parsed, concurrent=False):
         if not isinstance(parsed, dict):
             response = self._invalidrequest(None)
         else:
             id = parsed.get('id')
             if self._isrequest(parsed):
-                response = self._handlerequest(parsed, id)
+                response = self._handlerequest(parsed, id, concurrent)
             elif self._isresponse(parsed):
                 response = None
                 self._handleresponse(parsed, id)
@@ -155,7 +778,10 @@ class JsonRpc(conveyor.stoppable.StoppableInterface):
         return result
 
     def _successresponse(self, id, result):
-        response = {'jsonrpc': '2.0', 'result': result, 'id': id}
+        if isinstance(result, Serialized):
+            response = _SerializedResponse(id, result)
+        else:
+            response = {'jsonrpc': '2.0', 'result': result, 'id': id}
         return response
 
     def _errorresponse(self, id, code, message, data=None):
@@ -181,9 +807,393 @@ class JsonRpc(conveyor.stoppable.StoppableInterface):
         response = self._errorresponse(id, -32602, 'invalid params')
         return response
 
-    def _send(self, data):
+    def _ratelimited(self, id, retryafter):
+        data = {'retry_after': retryafter}
+        response = self._errorresponse(id, -32005, 'rate limited', data)
+        return response
+
+    def _uncaughtexception(self, id):
+        e = sys.exc_info()[1]
+        data = {'name': e.__class__.__name__, 'args': e.args}
+        response = self._errorresponse(id, -32000, 'uncaught exception', data)
+        return response
+
+    def _send(self, data, framing=None, compression=None):
+        '''
+        Send a message. If `framing` or `compression` is not `None` then this
+        is the last message sent with the current framing or compression and
+        all subsequent messages are sent with the new one.
+
+        '''
+
         self._log.debug('data=%r', data)
-        self._outfp_writer.write(data)
+        with self._writelock:
+            self._enqueue(None, self._writeframing.encode(data))
+            self._setwritemode(framing, compression)
+        self._flush()
+
+    def _enqueue(self, key, data):
+        # NOTE: the caller must hold `_writelock`.
+        if self._disconnecting:
+            self._outdropped += 1
+            return
+        if None is not self._compressor:
+            data = self._compressor.compress(data)
+        self._outqueue.append((key, data))
+        self._outbytes += len(data)
+        if None is not self._outlimit and self._outbytes > self._outlimit:
+            # NOTE: compressed messages cannot be dropped since each one is
+            # compressed against the ones before it.
+            if (OVERFLOW_DROP == self._overflow
+                    and None is self._compressor):
+                self._dropsuperseded()
+            if self._outbytes > self._outlimit and not self._disconnecting:
+                self._log.warning(
+                    'disconnecting slow client: %d bytes queued',
+                    self._outbytes)
+                self._disconnecting = True
+                self._clearoutput()
+        self._outpeak = max(self._outpeak, self._outbytes)
+
+    def _dropsuperseded(self):
+        # NOTE: the caller must hold `_writelock`. The first message cannot be
+        # dropped once part of it has been sent.
+        seen = set()
+        kept = collections.deque()
+        while 0 != len(self._outqueue):
+            key, data = self._outqueue.pop()
+            if (None is key or key not in seen
+                    or (0 == len(self._outqueue) and 0 != self._outoffset)):
+                seen.add(key)
+                kept.appendleft((key, data))
+            else:
+                self._outbytes -= len(data)
+                self._outdropped += 1
+        self._outqueue = kept
+
+    def _clearoutput(self):
+        # NOTE: the caller must hold `_writelock`.
+        self._outdropped += len(self._outqueue)
+        self._outqueue.clear()
+        self._outoffset = 0
+        self._outbytes = 0
+
+    def _flush(self):
+        '''
+        Write the queued messages. They are written by the connection's writer
+        thread, never by the thread that sent them, so a peer that stops
+        reading cannot block the sender. The writer is started by the first
+        flush and waits for more output until the connection is closed.
+        Messages queued while it is writing are coalesced into its next write
+        instead of each being written separately.
+
+        When an output callback is set the messages are written by the I/O
+        layer instead. See `setoutputcallback`.
+
+        '''
+
+        with self._writelock:
+            disconnect = False
+            callback = None
+            writer = None
+            if self._disconnecting:
+                disconnect = not self._disconnected
+                self._disconnected = True
+            elif None is not self._outputcallback:
+                if not self._outputrequested and 0 != len(self._outqueue):
+                    callback = self._outputcallback
+                    self._outputrequested = True
+            elif not self._flushing:
+                self._flushing = True
+                if None is self._writer:
+                    writer = self._writer = threading.Thread(
+                        target=self._writertarget, name='jsonrpc-writer')
+                    writer.daemon = True
+                else:
+                    self._outready.notify()
+        if disconnect:
+            self._disconnect()
+        elif None is not callback:
+            callback()
+        elif None is not writer:
+            writer.start()
+
+    def _writertarget(self):
+        while True:
+            with self._writelock:
+                while not self._flushing and not self._writerstopped:
+                    self._outready.wait()
+                if not self._flushing:
+                    # NOTE: a response that is sent after the connection is
+                    # closed starts a new writer, which ends once it is
+                    # written.
+                    self._writer = None
+                    break
+            self._writequeued()
+
+    def _stopwriter(self):
+        with self._writelock:
+            self._writerstopped = True
+            self._outready.notify()
+
+    def _writequeued(self):
+        disconnect = False
+        while True:
+            with self._writelock:
+                if 0 == len(self._outqueue) or self._disconnecting:
+                    self._flushing = False
+                    self._written.notify_all()
+                    break
+                else:
+                    outdata = b''.join(data for key, data in self._outqueue)
+                    self._outqueue.clear()
+                    self._outbytes = 0
+            try:
+                self._outfp.write(outdata)
+            except:
+                self._log.debug('handled exception', exc_info=True)
+                with self._writelock:
+                    self._disconnecting = True
+                    self._clearoutput()
+                    disconnect = not self._disconnected
+                    self._disconnected = True
+        if disconnect:
+            self._disconnect()
+
+    def waitoutput(self):
+        '''
+        Wait until the writer thread has written the queued messages. This
+        returns at once when an output callback is set.
+
+        '''
+
+        with self._writelock:
+            while self._flushing:
+                self._written.wait()
+
+    def _disconnect(self):
+        try:
+            self._outfp.disconnect()
+        except:
+            self._log.debug('handled exception', exc_info=True)
+
+    def setoutputlimit(self, limit, overflow):
+        '''
+        Bound the outgoing queue to `limit` bytes. When it overflows with the
+        `OVERFLOW_DROP` policy, superseded notifications are dropped; if that
+        is not enough, or with the `OVERFLOW_DISCONNECT` policy, the connection
+        is disconnected. Notifications are never dropped from a compressed
+        connection.
+
+        '''
+
+        with self._writelock:
+            self._outlimit = limit
+            self._overflow = overflow
+
+    def setoutputcallback(self, callback):
+        '''
+        Have the I/O layer write the queued messages instead of the thread that
+        sends them. `callback` is invoked when messages are queued and must
+        arrange for `writeoutput` to be invoked once the output file can be
+        written without blocking.
+
+        '''
+
+        with self._writelock:
+            self._outputcallback = callback
+
+    def writeoutput(self):
+        '''
+        Write as much of the queue as the output file accepts without blocking.
+        Returns `True` if messages remain in the queue.
+
+        '''
+
+        with self._writelock:
+            if self._disconnecting:
+                more = False
+            else:
+                size = 0
+                chunks = []
+                for key, data in self._outqueue:
+                    chunks.append(data)
+                    size += len(data)
+                    if size >= _WRITEOUTPUT_SIZE:
+                        break
+                outdata = b''.join(chunks)[self._outoffset:]
+                try:
+                    count = self._outfp.trysend(outdata)
+                except conveyor.connection.ConnectionWriteException:
+                    self._log.debug('handled exception', exc_info=True)
+                    self._disconnecting = True
+                    self._clearoutput()
+                else:
+                    self._outbytes -= count
+                    count += self._outoffset
+                    while 0 != len(self._outqueue):
+                        length = len(self._outqueue[0][1])
+                        if count < length:
+                            break
+                        else:
+                            self._outqueue.popleft()
+                            count -= length
+                    self._outoffset = count
+                more = 0 != len(self._outqueue)
+            if not more:
+                self._outputrequested = False
+            disconnect = self._disconnecting and not self._disconnected
+            if disconnect:
+                self._disconnected = True
+        if disconnect:
+            self._disconnect()
+        return more
+
+    def getoutputstats(self):
+        '''Return the depth of the outgoing queue.'''
+
+        with self._writelock:
+            stats = {
+                'queued_bytes': self._outbytes,
+                'queued_messages': len(self._outqueue),
+                'peak_queued_bytes': self._outpeak,
+                'dropped_messages': self._outdropped,
+                'coalesced_messages': self._coalescedcount,
+            }
+        return stats
+
+    def _setwritemode(self, framing, compression):
+        # NOTE: the caller must hold `_writelock`.
+        if None is not framing:
+            self._writeframing = _FRAMINGS[framing](self._jsonreadercallback)
+        if None is not compression:
+            compressor, decompressor = _COMPRESSIONS[compression]
+            self._compressor = compressor()
+
+    def _setwriteframing(self, framing, compression=None):
+        with self._writelock:
+            self._setwritemode(framing, compression)
+
+    def _setreadframing(self, framing, compression=None):
+        '''
+        Switch the incoming framing and compression. `None` keeps the current
+        one. This must be invoked on the thread that runs `run`, while it is
+        processing the last message that uses the current framing.
+
+        '''
+
+        self._readframing.suspend()
+        if None is framing:
+            framing = self._readframing.name
+        if None is not compression:
+            compressor, decompressor = _COMPRESSIONS[compression]
+            self._decompressor = decompressor(self._maxframelength)
+        maxlength = self._maxframelength
+        if FRAMING_JSONREADER == framing and None is self._decompressor:
+            # NOTE: the original framing is only limited when it is
+            # compressed, so that older clients keep working.
+            maxlength = None
+        self._readframing = _createframing(
+            framing, self._jsonreadercallback, maxlength)
+
+    def getframing(self):
+        '''Return the name of the current outgoing framing.'''
+
+        with self._writelock:
+            return self._writeframing.name
+
+    def getcompression(self):
+        '''Return the name of the current outgoing compression.'''
+
+        with self._writelock:
+            if None is self._compressor:
+                compression = COMPRESSION_NONE
+            else:
+                compression = self._compressor.name
+        return compression
+
+    def _feed(self, data):
+        # NOTE: a framing only returns a remainder when the framing or the
+        # compression was switched by the message it just processed. The
+        # remainder has not been decompressed yet.
+        while None is not data:
+            decompressor = self._decompressor
+            if None is decompressor:
+                chunk, data = data, None
+            else:
+                try:
+                    chunk = decompressor.decompress(data)
+                except zlib.error:
+                    self._log.warning(
+                        'failed to decompress input; disconnecting',
+                        exc_info=True)
+                    self._protocolerror()
+                    break
+                # NOTE: the input is inflated one bounded chunk at a time so
+                # that an oversized message is refused by the framing before
+                # all of it is inflated.
+                if decompressor.haspending():
+                    data = b''
+                else:
+                    data = None
+            if 0 == len(chunk):
+                continue
+            try:
+                remainder = self._readframing.feed(chunk)
+                if None is not remainder:
+                    data = remainder
+            except _FrameTooLargeException as e:
+                self._log.warning(
+                    'incoming message of %d bytes is longer than %d bytes; '
+                    'disconnecting', e.length, e.maxlength)
+                self._protocolerror()
+                break
+
+    def _protocolerror(self):
+        # NOTE: the input can no longer be parsed, so the connection is
+        # dropped along with any output that is still queued.
+        with self._writelock:
+            self._disconnecting = True
+            self._clearoutput()
+        self._flush()
+
+    def setmaxframelength(self, maxlength):
+        '''
+        Disconnect the peer when it sends a message longer than `maxlength`
+        bytes with the newline or length framing, or with any framing once
+        compression is negotiated. Compressed input is never inflated more
+        than `maxlength` + 1 bytes at a time. This must be invoked before the
+        framing is negotiated.
+
+        '''
+
+        self._maxframelength = maxlength
+
+    def feed(self, data):
+        '''
+        Process incoming bytes that were read by the caller instead of by
+        `run`, for example by a `conveyor.reactor.Reactor`. Calls to `feed` and
+        `feedeof` must not overlap.
+
+        '''
+
+        self._feed(data)
+
+    def feedeof(self):
+        self._readframing.feedeof()
+        # NOTE: the responses to the last requests are written before the
+        # output file is closed.
+        self.waitoutput()
+        self._stopwriter()
+        self.close()
+        self._failpending()
+        self._cancelserved()
+        with self._writelock:
+            timer = self._coalescetimer
+            self._coalescetimer = None
+            self._coalesced.clear()
+        if None is not timer:
+            timer.cancel()
 
     def run(self):
         """ This loop will run until self._stopped is set true."""
@@ -194,14 +1204,13 @@ class JsonRpc(conveyor.stoppable.StoppableInterface):
             if self._stopped:
                 break
             else:
-                data = self._infp_reader.read()
+                data = self._infp.read()
                 if 0 == len(data):
                     break
                 else:
-                    self._jsonreader.feed(data)
-        self._jsonreader.feedeof()
+                    self._feed(data)
         self._log.debug('ending')
-        self.close()
+        self.feedeof()
 
     def stop(self):
         """ required as a stoppable object. """
@@ -211,11 +1220,11 @@ class JsonRpc(conveyor.stoppable.StoppableInterface):
 
     def close(self):
         try:
-            self._infp_reader.close()
+            self._infp.close()
         except:
             self._log.debug('handled exception', exc_info=True)
         try:
-            self._outfp_writer.close()
+            self._outfp.close()
         except:
             self._log.debug('handled exception', exc_info=True)
 
@@ -225,7 +1234,10 @@ class JsonRpc(conveyor.stoppable.StoppableInterface):
 
     def _handleresponse(self, response, id):
         self._log.debug('response=%r, id=%r', response, id)
-        task = self._tasks.pop(id, None)
+        task = self._poptask(id)
+        if id in self._helloids:
+            self._helloids.discard(id)
+            self._handlehelloresponse(response)
         if None is task:
             self._log.debug('ignoring response for unknown id: %r', id)
         elif self._iserrorresponse(response):
@@ -238,96 +1250,504 @@ class JsonRpc(conveyor.stoppable.StoppableInterface):
             raise ValueError(response)
 
     def notify(self, method, params):
-        self._log.debug('method=%r, params=%r', method, params)
-        request = {'jsonrpc': '2.0', 'method': method, 'params': params}
-        data = conveyor.json.dumps(request)
-        self._send(data)
+        self.sendnotification(Notification(method, params))
+
+    def sendnotification(self, notification):
+        '''
+        Send a `Notification`. A notification that is broadcast should be
+        created once and passed to each connection so that it is only
+        serialized once.
+
+        '''
+
+        self._log.debug(
+            'method=%r, params=%r', notification.method, notification.params)
+        with self._writelock:
+            key = notification.key
+            if None is key or None is self._notificationinterval:
+                self._enqueuenotification(notification)
+            else:
+                now = time.time()
+                pending = self._coalesced.pop(key, None)
+                if None is not pending:
+                    self._coalescedcount += 1
+                    if None is not notification.merge:
+                        notification = notification.merge(
+                            pending, notification)
+                due = self._lastsent.get(key, 0) + self._notificationinterval
+                if notification.terminal or due <= now:
+                    self._lastsent[key] = now
+                    self._enqueuenotification(notification)
+                else:
+                    self._coalesced[key] = notification
+                    self._schedulecoalesced(due)
+        self._flush()
 
-    def request(self, method, params):
+    def _enqueuenotification(self, notification):
+        # NOTE: the caller must hold `_writelock`. Terminal notifications are
+        # queued without their key so that they are never dropped.
+        if notification.terminal:
+            key = None
+        else:
+            key = notification.key
+        self._enqueue(key, notification.encode(self._writeframing))
+
+    def _schedulecoalesced(self, due):
+        # NOTE: the caller must hold `_writelock`.
+        timer = self._coalescetimer
+        if None is timer or due < timer.deadline:
+            if None is not timer:
+                timer.cancel()
+            self._coalescetimer = conveyor.timer.gettimer().schedule(
+                max(0, due - time.time()), self._flushcoalesced)
+
+    def _flushcoalesced(self):
+        with self._writelock:
+            self._coalescetimer = None
+            now = time.time()
+            interval = self._notificationinterval
+            nextdue = None
+            for key, notification in list(self._coalesced.items()):
+                due = self._lastsent.get(key, 0) + interval
+                if due <= now:
+                    del self._coalesced[key]
+                    self._lastsent[key] = now
+                    self._enqueuenotification(notification)
+                elif None is nextdue or due < nextdue:
+                    nextdue = due
+            for key, sent in list(self._lastsent.items()):
+                if sent + interval <= now and key not in self._coalesced:
+                    del self._lastsent[key]
+            if None is not nextdue:
+                self._schedulecoalesced(nextdue)
+        self._flush()
+
+    def setnotificationinterval(self, interval):
+        '''
+        Send notifications with the same key at most once every `interval`
+        seconds. While a notification waits, a newer one with the same key
+        replaces it, so that a slow client receives the latest state instead of
+        a backlog. Terminal notifications are sent at once. `None` sends every
+        notification at once.
+
+        '''
+
+        with self._writelock:
+            self._notificationinterval = interval
+            if None is interval:
+                for notification in self._coalesced.values():
+                    self._enqueuenotification(notification)
+                self._coalesced.clear()
+                self._lastsent.clear()
+                if None is not self._coalescetimer:
+                    self._coalescetimer.cancel()
+                    self._coalescetimer = None
+        self._flush()
+
+    def request(self, method, params, timeout=None):
         """ Builds a jsonrpc request task.
         @param method: json rpc method to run as a task
         @param params: params for method
+        @param timeout: seconds to wait for the response once the request is
+            sent, or None for the default set by `setrequesttimeout`
         @return a Task object with methods setup properly
         """
+        id, task = self._request(method, params, timeout)
+        return task
+
+    def _request(self, method, params, timeout=None):
         with self._condition:
             id = self._idcounter
             self._idcounter += 1
+            if None is timeout:
+                timeout = self._requesttimeout
         self._log.debug('method=%r, params=%r, id=%r', method, params, id)
         def runningevent(task):
-            request = {
-                'jsonrpc': '2.0', 'method': method, 'params': params, 'id': id}
-            data = conveyor.json.dumps(request)
-            self._send(data)
+            if self._addpending(id, task, method, timeout):
+                request = {
+                    'jsonrpc': '2.0', 'method': method, 'params': params,
+                    'id': id}
+                data = conveyor.json.dumps(request)
+                self._send(data)
+        def cancelevent(task):
+            # NOTE: the request is still pending until `stoppedevent` runs.
+            with self._condition:
+                pending = id in self._tasks
+            if pending:
+                self._sendcancel(id)
         def stoppedevent(task):
-            if id in self._tasks.keys():
-                del self._tasks[id]
-            else:
-                self._log.debug('stoppeevent fail for id=%r', id)
+            self._poptask(id)
         task = conveyor.task.Task()
         task.runningevent.attach(runningevent)
+        task.cancelevent.attach(cancelevent)
         task.stoppedevent.attach(stoppedevent)
-        self._tasks[id] = task
+        return id, task
+
+    def setrequesttimeout(self, timeout):
+        '''
+        Set the default number of seconds to wait for the response to a
+        request. A request that is not answered in time fails with a 'request
+        timed out' error. `None` waits forever.
+
+        '''
+
+        with self._condition:
+            self._requesttimeout = timeout
+
+    def setmaxpending(self, maxpending):
+        '''
+        Set the number of requests that may wait for their responses at once.
+        Another request fails at once with a 'too many pending requests' error
+        instead of waiting, so that a slow peer cannot block the event queue
+        thread that starts it. The caller may retry it later or drop it.
+
+        '''
+
+        with self._condition:
+            self._maxpending = maxpending
+
+    def getpending(self):
+        '''Return the number of requests waiting for their responses.'''
+
+        with self._condition:
+            return len(self._tasks)
+
+    def _addpending(self, id, task, method, timeout):
+        error = None
+        with self._condition:
+            if self._closed:
+                added = False
+                error = self._closederror(id)
+            elif task.isstopped():
+                # NOTE: the task was canceled before it was sent.
+                added = False
+            elif len(self._tasks) >= self._maxpending:
+                added = False
+                error = {
+                    'code': -32006, 'message': 'too many pending requests',
+                    'data': {
+                        'method': method, 'id': id,
+                        'maxpending': self._maxpending}}
+            else:
+                added = True
+                self._tasks[id] = task
+                if None is not timeout:
+                    def expire():
+                        self._expire(id, method, timeout)
+                    timer = conveyor.timer.gettimer()
+                    self._deadlines[id] = timer.schedule(timeout, expire)
+        if None is not error:
+            self._failtask(task, error)
+        return added
+
+    def _poptask(self, id):
+        with self._condition:
+            task = self._tasks.pop(id, None)
+            handle = self._deadlines.pop(id, None)
+            if None is not task:
+                self._condition.notify_all()
+        if None is not handle:
+            handle.cancel()
         return task
 
+    def _expire(self, id, method, timeout):
+        task = self._poptask(id)
+        if None is not task:
+            self._log.warning(
+                'request timed out: method=%r, id=%r, timeout=%r', method, id,
+                timeout)
+            error = {
+                'code': -32003, 'message': 'request timed out',
+                'data': {'method': method, 'id': id, 'timeout': timeout}}
+            self._failtask(task, error)
+            # NOTE: nobody is waiting for the result any more.
+            self._sendcancel(id)
+
+    def _sendcancel(self, id):
+        with self._condition:
+            closed = self._closed
+        if not closed:
+            self.notify('cancel', {'id': id})
+
+    def _closederror(self, id):
+        error = {
+            'code': -32004, 'message': 'connection closed',
+            'data': {'id': id}}
+        return error
+
+    def _failpending(self):
+        # NOTE: no response can arrive once the connection is closed. Fail the
+        # requests that are waiting for one instead of leaving them running.
+        with self._condition:
+            self._closed = True
+            tasks = self._tasks.items()
+            self._tasks.clear()
+            handles = self._deadlines.values()
+            self._deadlines.clear()
+            self._condition.notify_all()
+        for handle in handles:
+            handle.cancel()
+        for id, task in tasks:
+            self._failtask(task, self._closederror(id))
+
+    def _failtask(self, task, error):
+        try:
+            task.fail(error)
+        except conveyor.task.IllegalTransitionException:
+            # NOTE: the task was canceled concurrently.
+            self._log.debug('handled exception', exc_info=True)
+
+    def hello(self, framings, compressions=(), delta=None):
+        '''
+        Builds a `hello` request task that asks the peer to switch to the first
+        framing in `framings` and the first compression in `compressions` that
+        it supports. They change as soon as the response arrives. The caller
+        must not send any other message until the task stops. If `delta` is
+        `True` the conveyor service sends delta job and machine notifications.
+
+        A peer that does not support framing negotiation fails the task with an
+        'invalid params' error. The caller should send a plain `hello` instead.
+
+        '''
+
+        params = {'framing': list(framings)}
+        if 0 != len(compressions):
+            params['compression'] = list(compressions)
+        if None is not delta:
+            params['delta'] = delta
+        id, task = self._request('hello', params)
+        self._helloids.add(id)
+        return task
+
+    def _handlehelloresponse(self, response):
+        if self._issuccessresponse(response):
+            result = response['result']
+            if isinstance(result, dict):
+                framing = result.get('framing')
+                if framing not in _FRAMINGS:
+                    framing = None
+                compression = result.get('compression')
+                if compression not in _COMPRESSIONS:
+                    compression = None
+                if None is not framing or None is not compression:
+                    self._setwriteframing(framing, compression)
+                    self._setreadframing(framing, compression)
+
     #
     # Server part
     #
 
-    def _handlerequest(self, request, id):
+    def negotiateframing(self, framings):
+        '''
+        Choose the first framing in `framings` that is supported. The response
+        to the current request is sent with the current framing and every
+        message after it uses the chosen framing. Returns the name of the
+        chosen framing or `FRAMING_JSONREADER` if none are supported.
+
+        This must be invoked by a method handler while the request is being
+        processed on the thread that runs `run`.
+
+        '''
+
+        if not isinstance(framings, list):
+            raise JsonRpcException(-32602, 'invalid params', framings)
+        elif FRAMING_JSONREADER != self._readframing.name:
+            # Framing can only be negotiated once.
+            return self._readframing.name
+        else:
+            for framing in framings:
+                if framing in _FRAMINGS:
+                    with self._condition:
+                        self._pendingframing = framing
+                    return framing
+            return FRAMING_JSONREADER
+
+    def negotiatecompression(self, compressions):
+        '''
+        Choose the first compression in `compressions` that is supported. Like
+        the framing, it applies to every message after the response to the
+        current request, in both directions. Returns the name of the chosen
+        compression or `COMPRESSION_NONE` if none are supported.
+
+        Compression can only be negotiated by the first request on a
+        connection. This must be invoked by a method handler while the request
+        is being processed on the thread that runs `run`.
+
+        '''
+
+        if not isinstance(compressions, list):
+            raise JsonRpcException(-32602, 'invalid params', compressions)
+        elif (FRAMING_JSONREADER != self._readframing.name
+                or None is not self._decompressor):
+            # Compression can only be negotiated once.
+            if None is self._decompressor:
+                return COMPRESSION_NONE
+            else:
+                return self._decompressor.name
+        else:
+            for compression in compressions:
+                if compression in _COMPRESSIONS:
+                    with self._condition:
+                        self._pendingcompression = compression
+                    return compression
+            return COMPRESSION_NONE
+
+    def _handlerequest(self, request, id, concurrent=False):
         self._log.debug('request=%r, id=%r', request, id)
         method = request['method']
-        if method in self._methods:
-            func = self._methods[method]
-            if 'params' not in request:
-                response = self._invokemethod(id, func, (), {})
+        if method in self._methodsinfo:
+            info = self._methodsinfo[method]
+            params = request.get('params', {})
+            if isinstance(params, dict):
+                args, kwargs = (), params
+            elif isinstance(params, list):
+                args, kwargs = params, {}
             else:
-                params = request['params']
-                if isinstance(params, dict):
-                    response = self._invokemethod(id, func, (), params)
-                elif isinstance(params, list):
-                    response = self._invokemethod(id, func, params, {})
+                args, kwargs = None, None
+            retryafter = self._throttle(method)
+            if None is args:
+                response = self._invalidparams(id)
+            elif 0 != retryafter:
+                self._log.debug('throttled method=%r, id=%r', method, id)
+                if None is id:
+                    response = None
                 else:
-                    response = self._invalidparams(id)
+                    response = self._ratelimited(id, retryafter)
+            elif None is self._executor:
+                response = self._invokemethod(id, info, args, kwargs)
+            elif concurrent and method in self._unordered:
+                response = self._submitmethod(id, info, args, kwargs)
+            else:
+                self._waitinflight()
+                response = self._invokemethod(id, info, args, kwargs)
         else:
             response = self._methodnotfound(id)
         return response
 
-    def _fixkwargs(self, kwargs):
-        kwargs1 = {}
-        for k, v in kwargs.items():
-            k = str(k)
-            kwargs1[k] = v
-        return kwargs1
+    def _throttle(self, method):
+        '''
+        Take a token from the bucket of the method's rate class. Returns 0 if
+        the request may run, otherwise the number of seconds the peer should
+        wait before it retries.
+
+        '''
+
+        result = 0
+        with self._condition:
+            rateclass = self._rateclasses.get(method)
+            bucket = self._buckets.get(rateclass)
+            if None is not bucket:
+                result = bucket.take(time.time())
+                if 0 != result:
+                    self._throttled[rateclass] += 1
+        return result
+
+    def setratelimit(self, rateclass, rate, burst):
+        '''
+        Limit the requests this peer makes for the methods of `rateclass` to
+        `rate` per second on average and `burst` at once. Requests beyond the
+        limit are rejected with a 'rate limited' error whose data tells the
+        peer how long to wait. `None` removes the limit.
+
+        '''
+
+        with self._condition:
+            if None is rate:
+                self._buckets.pop(rateclass, None)
+            else:
+                self._buckets[rateclass] = _TokenBucket(rate, burst)
+
+    def getrequeststats(self):
+        '''Return the number of requests rejected for each rate class.'''
+
+        with self._condition:
+            throttled = dict(self._throttled)
+        stats = {
+            'throttled_requests': sum(throttled.values()),
+            'throttled_by_class': throttled,
+        }
+        return stats
+
+    def _submitmethod(self, id, info, args, kwargs):
+        '''
+        Run the method on the executor. The response is sent by the worker
+        thread once the method returns; the peer matches it to the request by
+        its `id`. Batches are never split across the executor.
+
+        '''
+
+        with self._condition:
+            self._inflight += 1
+        def target():
+            try:
+                response = self._invokemethod(id, info, args, kwargs)
+                if None is not response:
+                    outdata = _dumpresponse(response)
+                    self._send(outdata)
+            finally:
+                self._doneinflight()
+        if self._executor.submit(target):
+            response = None
+        else:
+            self._doneinflight()
+            response = self._invokemethod(id, info, args, kwargs)
+        return response
+
+    def _doneinflight(self):
+        with self._condition:
+            self._inflight -= 1
+            self._condition.notify_all()
+
+    def _waitinflight(self):
+        # An ordered method is a barrier: every concurrent request received
+        # before it finishes first, and no request after it is read until it
+        # returns.
+        with self._condition:
+            while 0 != self._inflight:
+                self._condition.wait()
 
-    def _invokemethod(self, id, func, args, kwargs):
+    def _invokemethod(self, id, info, args, kwargs):
         self._log.debug(
-            'id=%r, func=%r, args=%r, kwargs=%r', id, func, args, kwargs)
+            'id=%r, func=%r, args=%r, kwargs=%r', id, info.func, args, kwargs)
         response = None
-        kwargs = self._fixkwargs(kwargs)
         try:
-            result = func(*args, **kwargs)
-        except TypeError as e:
-            self._log.warning('handled exception', exc_info=True)
-            if None is not id:
-                response = self._invalidparams(id)
+            result = info.invoke(args, kwargs)
         except JsonRpcException as e:
             self._log.warning('handled exception', exc_info=True)
             if None is not id:
                 response = self._errorresponse(id, e.code, e.message, e.data)
+        except TypeError as e:
+            if not info.compiled:
+                self._log.warning('handled exception', exc_info=True)
+                if None is not id:
+                    response = self._invalidparams(id)
+            else:
+                self._log.warning('uncaught exception', exc_info=True)
+                if None is not id:
+                    response = self._uncaughtexception(id)
         except Exception as e:
             self._log.warning('uncaught exception', exc_info=True)
             if None is not id:
-                e = sys.exc_info()[1]
-                data = {'name': e.__class__.__name__, 'args': e.args}
-                response = self._errorresponse(
-                    id, -32000, 'uncaught exception', data)
+                response = self._uncaughtexception(id)
         else:
             if not isinstance(result, conveyor.task.Task):
                 if None is not id:
                     response = self._successresponse(id, result)
             else:
                 task = result
+                # NOTE: a task started by a notification cannot be canceled
+                # by id but it is still canceled when the connection closes.
+                if None is id:
+                    key = task
+                else:
+                    key = id
                 def stoppedcallback(task):
+                    with self._condition:
+                        if task is self._served.get(key):
+                            del self._served[key]
+                        closed = self._closed
+                    if closed:
+                        return
                     if conveyor.task.TaskConclusion.ENDED == task.conclusion:
                         response = self._successresponse(id, task.result)
                     elif conveyor.task.TaskConclusion.FAILED == task.conclusion:
@@ -339,13 +1759,1056 @@ class JsonRpc(conveyor.stoppable.StoppableInterface):
                     outdata = conveyor.json.dumps(response)
                     self._send(outdata)
                 task.stoppedevent.attach(stoppedcallback)
-                task.start()
+                with self._condition:
+                    closed = self._closed
+                    if not closed:
+                        self._served[key] = task
+                if closed:
+                    task.cancel()
+                else:
+                    task.start()
             self._log.debug('response=%r', response)
         return response
 
-    def addmethod(self, method, func):
-        self._log.debug('method=%r, func=%r', method, func)
+    def _cancel(self, id):
+        '''
+        Cancel the task that is running for the peer's request `id`. The peer
+        still receives a 'task canceled' response to that request. Returns
+        whether the task was canceled.
+
+        '''
+
+        with self._condition:
+            task = self._served.get(id)
+        if None is task:
+            result = False
+        else:
+            result = self._canceltask(task)
+        return result
+
+    def _cancelserved(self):
+        # NOTE: nobody is left to receive the results of the tasks that were
+        # started for the peer. Cancel them so that they stop using the
+        # machines and the work queue.
+        with self._condition:
+            tasks = self._served.values()
+            self._served.clear()
+        for task in tasks:
+            self._canceltask(task)
+
+    def _canceltask(self, task):
+        try:
+            task.cancel()
+        except conveyor.task.IllegalTransitionException:
+            # NOTE: the task stopped concurrently.
+            self._log.debug('handled exception', exc_info=True)
+            result = False
+        else:
+            result = True
+        return result
+
+    def addmethod(self, method, func, ordered=True, rateclass=None):
+        self._log.debug(
+            'method=%r, func=%r, ordered=%r, rateclass=%r', method, func,
+            ordered, rateclass)
         self._methods[method] = func
+        self._methodsinfo[method] = _MethodInfo(func)
+        if ordered:
+            self._unordered.discard(method)
+        else:
+            self._unordered.add(method)
+        with self._condition:
+            if None is rateclass:
+                self._rateclasses.pop(method, None)
+            else:
+                self._rateclasses[method] = rateclass
 
     def getmethods(self):
         return self._methods
+
+
+class _ChunkReader(object):
+    '''A fake input file that returns a fixed list of chunks from `read`.'''
+
+    def __init__(self, chunks):
+        self._chunks = list(chunks)
+
+    def read(self):
+        if 0 == len(self._chunks):
+            data = b''
+        else:
+            data = self._chunks.pop(0)
+        return data
+
+    def stop(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _FramingTestCase(unittest.TestCase):
+    def setUp(self):
+        eventqueue = conveyor.event.geteventqueue()
+        eventqueue.clear()
+
+    def _runeventqueue(self):
+        eventqueue = conveyor.event.geteventqueue()
+        while eventqueue.runiteration(False):
+            pass
+
+    def _request(self, method, params, id):
+        request = {
+            'jsonrpc': '2.0', 'method': method, 'params': params, 'id': id}
+        return conveyor.json.dumps(request).encode('UTF-8')
+
+    def _server(self, chunks):
+        outfp = StringIO.StringIO()
+        outfp.close = lambda: None
+        jsonrpc = JsonRpc(_ChunkReader(chunks), outfp)
+        def hello(framing=None, compression=None):
+            if None is framing and None is compression:
+                return 'world'
+            else:
+                result = {'hello': 'world'}
+                if None is not framing:
+                    result['framing'] = jsonrpc.negotiateframing(framing)
+                if None is not compression:
+                    result['compression'] = jsonrpc.negotiatecompression(
+                        compression)
+                return result
+        jsonrpc.addmethod('hello', hello)
+        jsonrpc.addmethod('echo', lambda value: value)
+        return jsonrpc, outfp
+
+    def _responses(self, data, framing):
+        responses = []
+        framing = _FRAMINGS[framing](
+            lambda frame: responses.append(json.loads(frame)))
+        framing.feed(data)
+        return responses
+
+    def test_legacy(self):
+        '''Test that a plain `hello` keeps the original framing.'''
+
+        jsonrpc, outfp = self._server([
+            self._request('hello', {}, 0), self._request('echo', [1], 1)])
+        jsonrpc.run()
+        self.assertEqual(FRAMING_JSONREADER, jsonrpc.getframing())
+        responses = []
+        reader = conveyor.json.JsonReader(
+            lambda data: responses.append(json.loads(data)), False)
+        reader.feed(outfp.getvalue().decode('UTF-8'))
+        self.assertEqual(['world', 1], [r['result'] for r in responses])
+
+    def test_negotiate(self):
+        '''
+        Test that the server switches framing after the `hello` response, even
+        when the next message arrives in the same chunk as the `hello`.
+
+        '''
+
+        for framing in (FRAMING_NEWLINE, FRAMING_LENGTH):
+            encode = _FRAMINGS[framing](None).encode
+            chunk = b''.join((
+                self._request('hello', {'framing': ['bogus', framing]}, 0),
+                encode(self._request('echo', ['é'], 1).decode('UTF-8'))))
+            jsonrpc, outfp = self._server([chunk[:-3], chunk[-3:]])
+            jsonrpc.run()
+            self.assertEqual(framing, jsonrpc.getframing())
+            data = outfp.getvalue()
+            hello = {'jsonrpc': '2.0', 'id': 0,
+                'result': {'hello': 'world', 'framing': framing}}
+            hellodata = conveyor.json.dumps(hello).encode('UTF-8')
+            self.assertEqual(hello, json.loads(data[:len(hellodata)]))
+            responses = self._responses(data[len(hellodata):], framing)
+            self.assertEqual(['é'], [r['result'] for r in responses])
+
+    def test_unsupported(self):
+        '''Test that the original framing is kept when nothing matches.'''
+
+        jsonrpc, outfp = self._server([
+            self._request('hello', {'framing': ['bogus']}, 0)])
+        jsonrpc.run()
+        self.assertEqual(FRAMING_JSONREADER, jsonrpc.getframing())
+        self.assertEqual(
+            {'hello': 'world', 'framing': None},
+            json.loads(outfp.getvalue())['result'])
+
+    def test_client(self):
+        '''
+        Test that the client switches framing when it receives the `hello`
+        response, even when the next message is in the same chunk.
+
+        '''
+
+        encode = _FRAMINGS[FRAMING_LENGTH](None).encode
+        response = {'jsonrpc': '2.0', 'id': 0,
+            'result': {'hello': 'world', 'framing': FRAMING_LENGTH}}
+        notification = {
+            'jsonrpc': '2.0', 'method': 'jobchanged', 'params': {'id': 1}}
+        chunk = b''.join((
+            conveyor.json.dumps(response).encode('UTF-8'),
+            encode(conveyor.json.dumps(notification))))
+        outfp = StringIO.StringIO()
+        jsonrpc = JsonRpc(_ChunkReader([chunk]), outfp)
+        notified = []
+        jsonrpc.addmethod('jobchanged', lambda id: notified.append(id))
+        task = jsonrpc.hello([FRAMING_LENGTH])
+        task.start()
+        self._runeventqueue()
+        jsonrpc._feed(jsonrpc._infp.read())
+        self._runeventqueue()
+        self.assertTrue(task.isended())
+        self.assertEqual(FRAMING_LENGTH, jsonrpc.getframing())
+        self.assertEqual([1], notified)
+        jsonrpc.waitoutput()
+        self.assertEqual(
+            {'framing': [FRAMING_LENGTH]},
+            json.loads(outfp.getvalue())['params'])
+
+    def test_compression(self):
+        '''
+        Test that the server compresses every message after the `hello`
+        response and decompresses every message after the `hello` request.
+
+        '''
+
+        encode = _FRAMINGS[FRAMING_LENGTH](None).encode
+        compressor = _ZlibCompressor()
+        params = {'framing': [FRAMING_LENGTH], 'compression': ['bogus', 'zlib']}
+        chunk = b''.join((
+            self._request('hello', params, 0),
+            compressor.compress(b''.join(
+                encode(self._request('echo', [[i] * 10], i).decode('UTF-8'))
+                for i in range(1, 4)))))
+        jsonrpc, outfp = self._server([chunk[:-5], chunk[-5:]])
+        jsonrpc.run()
+        self.assertEqual(COMPRESSION_ZLIB, jsonrpc.getcompression())
+        data = outfp.getvalue()
+        hello = {'jsonrpc': '2.0', 'id': 0, 'result': {
+            'hello': 'world', 'framing': FRAMING_LENGTH,
+            'compression': COMPRESSION_ZLIB}}
+        hellodata = conveyor.json.dumps(hello).encode('UTF-8')
+        self.assertEqual(hello, json.loads(data[:len(hellodata)]))
+        decompressed = _ZlibDecompressor().decompress(data[len(hellodata):])
+        responses = self._responses(decompressed, FRAMING_LENGTH)
+        self.assertEqual(
+            [[i] * 10 for i in range(1, 4)], [r['result'] for r in responses])
+
+    def test_client_compression(self):
+        '''
+        Test that the client compresses its requests once the `hello` response
+        chooses compression.
+
+        '''
+
+        response = {'jsonrpc': '2.0', 'id': 0, 'result': {
+            'hello': 'world', 'framing': None, 'compression': 'zlib'}}
+        notification = {
+            'jsonrpc': '2.0', 'method': 'jobchanged', 'params': {'id': 1}}
+        chunk = b''.join((
+            conveyor.json.dumps(response).encode('UTF-8'),
+            _ZlibCompressor().compress(
+                conveyor.json.dumps(notification).encode('UTF-8'))))
+        outfp = StringIO.StringIO()
+        jsonrpc = JsonRpc(_ChunkReader([chunk]), outfp)
+        notified = []
+        jsonrpc.addmethod('jobchanged', lambda id: notified.append(id))
+        task = jsonrpc.hello([], [COMPRESSION_ZLIB])
+        task.start()
+        self._runeventqueue()
+        jsonrpc.waitoutput()
+        hellodata = outfp.getvalue()
+        jsonrpc._feed(jsonrpc._infp.read())
+        self._runeventqueue()
+        self.assertTrue(task.isended())
+        self.assertEqual(FRAMING_JSONREADER, jsonrpc.getframing())
+        self.assertEqual(COMPRESSION_ZLIB, jsonrpc.getcompression())
+        self.assertEqual([1], notified)
+        jsonrpc.request('getjob', {'id': 1}).start()
+        self._runeventqueue()
+        jsonrpc.waitoutput()
+        data = _ZlibDecompressor().decompress(
+            outfp.getvalue()[len(hellodata):])
+        self.assertEqual('getjob', json.loads(data)['method'])
+
+    def test_maxframelength(self):
+        '''
+        Test that the server disconnects a peer that sends a message longer
+        than the maximum frame length, before the message has arrived.
+
+        '''
+
+        for framing in (FRAMING_NEWLINE, FRAMING_LENGTH):
+            encode = _FRAMINGS[framing](None).encode
+            chunk = b''.join((
+                self._request('hello', {'framing': [framing]}, 0),
+                encode(self._request('echo', ['x' * 64], 1).decode('UTF-8'))))
+            jsonrpc, outfp = self._server([chunk[:-8]])
+            disconnected = []
+            outfp.disconnect = lambda: disconnected.append(True)
+            jsonrpc.setmaxframelength(32)
+            jsonrpc.run()
+            self.assertEqual([True], disconnected)
+            self.assertEqual(framing, jsonrpc.getframing())
+
+    def test_decompressionbomb(self):
+        '''
+        Test that the server disconnects a peer that sends a small compressed
+        message that inflates to more than the maximum frame length, without
+        inflating more than the limit at a time.
+
+        '''
+
+        maxlength = 1024
+        compressobj = zlib.compressobj(9)
+        bomb = [compressobj.compress(
+            b'{"jsonrpc": "2.0", "method": "echo", "params": ["')]
+        for i in range(16):
+            bomb.append(compressobj.compress(b'x' * (1024 * 1024)))
+        bomb.append(compressobj.flush(zlib.Z_SYNC_FLUSH))
+        bomb = b''.join(bomb)
+        self.assertLess(len(bomb), 64 * 1024)
+        for framing in (None, FRAMING_NEWLINE, FRAMING_LENGTH):
+            params = {'compression': [COMPRESSION_ZLIB]}
+            if None is not framing:
+                params['framing'] = [framing]
+            hello = self._request('hello', params, 0)
+            jsonrpc, outfp = self._server([hello + bomb])
+            disconnected = []
+            outfp.disconnect = lambda: disconnected.append(True)
+            jsonrpc.setmaxframelength(maxlength)
+            chunks = []
+            original = _ZlibDecompressor.decompress
+            def decompress(decompressor, data):
+                result = original(decompressor, data)
+                chunks.append(len(result))
+                return result
+            _ZlibDecompressor.decompress = decompress
+            try:
+                jsonrpc.run()
+            finally:
+                _ZlibDecompressor.decompress = original
+            self.assertEqual([True], disconnected)
+            self.assertEqual(COMPRESSION_ZLIB, jsonrpc.getcompression())
+            self.assertLessEqual(max(chunks), maxlength + 1)
+            self.assertLessEqual(sum(chunks), 4 * maxlength)
+
+    def test_decompresschunks(self):
+        '''Test that compressed messages longer than one decompressed chunk
+        in total are all received.'''
+
+        encode = _FRAMINGS[FRAMING_NEWLINE](None).encode
+        compressor = _ZlibCompressor()
+        params = {'framing': [FRAMING_NEWLINE], 'compression': ['zlib']}
+        chunk = b''.join((
+            self._request('hello', params, 0),
+            compressor.compress(b''.join(
+                encode(self._request('echo', ['x' * 40], i).decode('UTF-8'))
+                for i in range(1, 101)))))
+        jsonrpc, outfp = self._server([chunk])
+        jsonrpc.setmaxframelength(128)
+        jsonrpc.run()
+        data = outfp.getvalue()
+        hello = {'jsonrpc': '2.0', 'id': 0, 'result': {
+            'hello': 'world', 'framing': FRAMING_NEWLINE,
+            'compression': COMPRESSION_ZLIB}}
+        hellodata = conveyor.json.dumps(hello).encode('UTF-8')
+        self.assertEqual(hello, json.loads(data[:len(hellodata)]))
+        decompressed = _ZlibDecompressor(1 << 20).decompress(
+            data[len(hellodata):])
+        responses = self._responses(decompressed, FRAMING_NEWLINE)
+        self.assertEqual(range(1, 101), [r['id'] for r in responses])
+
+
+class _PendingTestCase(unittest.TestCase):
+    def setUp(self):
+        eventqueue = conveyor.event.geteventqueue()
+        eventqueue.clear()
+        self._outfp = StringIO.StringIO()
+        self._outfp.close = lambda: None
+        self._jsonrpc = JsonRpc(_ChunkReader([]), self._outfp)
+
+    def _runeventqueue(self):
+        eventqueue = conveyor.event.geteventqueue()
+        while eventqueue.runiteration(False):
+            pass
+
+    def _requests(self):
+        self._jsonrpc.waitoutput()
+        requests = []
+        reader = conveyor.json.JsonReader(
+            lambda data: requests.append(json.loads(data)), False)
+        reader.feed(self._outfp.getvalue().decode('UTF-8'))
+        return requests
+
+    def _respond(self, id, result):
+        response = {'jsonrpc': '2.0', 'id': id, 'result': result}
+        self._jsonrpc._feed(conveyor.json.dumps(response).encode('UTF-8'))
+
+    def _start(self, count):
+        tasks = [self._jsonrpc.request('getjob', {'id': i})
+            for i in range(count)]
+        for task in tasks:
+            task.start()
+        return tasks
+
+    def test_pipelined(self):
+        '''
+        Test that requests are sent without waiting for earlier responses and
+        that responses are matched to them in any order.
+
+        '''
+
+        tasks = self._start(300)
+        self._runeventqueue()
+        requests = self._requests()
+        self.assertEqual(300, len(requests))
+        self.assertEqual(300, self._jsonrpc.getpending())
+        for request in reversed(requests):
+            self._respond(request['id'], request['params']['id'])
+        self._runeventqueue()
+        self.assertEqual(range(300), [task.result for task in tasks])
+        self.assertEqual(0, self._jsonrpc.getpending())
+
+    def test_timeout(self):
+        '''
+        Test that a request that is not answered by its deadline fails and
+        that a late response is ignored.
+
+        '''
+
+        self._jsonrpc.setrequesttimeout(60.0)
+        slow, = self._start(1)
+        fast = self._jsonrpc.request('getjob', {'id': 1}, 0.01)
+        fast.start()
+        self._runeventqueue()
+        for i in range(100):
+            if fast.isstopped():
+                break
+            else:
+                time.sleep(0.01)
+        self.assertTrue(fast.isfailed())
+        self.assertEqual(-32003, fast.failure['code'])
+        self.assertEqual(1, self._jsonrpc.getpending())
+        self._respond(1, 'late')
+        self._respond(0, 'slow')
+        self.assertTrue(slow.isended())
+        self.assertEqual(0, conveyor.timer.gettimer().getpending())
+
+    def test_maxpending(self):
+        '''
+        Test that a request fails at once, without being sent, while the
+        pending table is full.
+
+        '''
+
+        self._jsonrpc.setmaxpending(2)
+        tasks = self._start(3)
+        self._runeventqueue()
+        self.assertEqual(2, len(self._requests()))
+        self.assertEqual(2, self._jsonrpc.getpending())
+        self.assertTrue(tasks[2].isfailed())
+        self.assertEqual(-32006, tasks[2].failure['code'])
+        self._respond(0, 0)
+        self._runeventqueue()
+        self.assertTrue(tasks[0].isended())
+        tasks = self._start(1)
+        self._runeventqueue()
+        self.assertEqual(3, len(self._requests()))
+        self.assertEqual(2, self._jsonrpc.getpending())
+
+    def test_close(self):
+        '''
+        Test that pending requests fail when the connection closes, as do
+        requests started after it.
+
+        '''
+
+        before, = self._start(1)
+        self._runeventqueue()
+        self._jsonrpc.feedeof()
+        after, = self._start(1)
+        self._runeventqueue()
+        for task in (before, after):
+            self.assertTrue(task.isfailed())
+            self.assertEqual(-32004, task.failure['code'])
+        self.assertEqual(1, len(self._requests()))
+
+
+class _ConcurrentTestCase(unittest.TestCase):
+    def setUp(self):
+        self._executor = conveyor.executor.Executor('test', 2, 4)
+        self._executor.start()
+        self._released = threading.Event()
+        self._calls = []
+
+    def tearDown(self):
+        self._executor.stop()
+        self._executor.join(1)
+
+    def _request(self, method, id):
+        request = {'jsonrpc': '2.0', 'method': method, 'params': [], 'id': id}
+        return conveyor.json.dumps(request).encode('UTF-8')
+
+    def _server(self, chunks):
+        outfp = StringIO.StringIO()
+        outfp.close = lambda: None
+        jsonrpc = JsonRpc(_ChunkReader(chunks), outfp, self._executor)
+        def slow():
+            self._released.wait(5.0)
+            self._calls.append('slow')
+            return 'slow'
+        def fast():
+            self._released.set()
+            self._calls.append('fast')
+            return 'fast'
+        def ordered():
+            self._calls.append('ordered')
+            return 'ordered'
+        jsonrpc.addmethod('slow', slow, False)
+        jsonrpc.addmethod('fast', fast, False)
+        jsonrpc.addmethod('ordered', ordered)
+        return jsonrpc, outfp
+
+    def _run(self, jsonrpc, outfp):
+        jsonrpc.run()
+        jsonrpc._waitinflight()
+        # NOTE: the responses of the concurrent requests are written by the
+        # writer thread after they return.
+        jsonrpc.waitoutput()
+        responses = []
+        reader = conveyor.json.JsonReader(
+            lambda data: responses.append(json.loads(data)), False)
+        reader.feed(outfp.getvalue().decode('UTF-8'))
+        return dict((r['id'], r['result']) for r in responses)
+
+    def test_concurrent(self):
+        '''
+        Test that a request for a method that is not ordered does not wait for
+        the requests before it and that responses are matched by id.
+
+        '''
+
+        jsonrpc, outfp = self._server([
+            self._request('slow', 0), self._request('fast', 1)])
+        results = self._run(jsonrpc, outfp)
+        self.assertEqual(['fast', 'slow'], self._calls)
+        self.assertEqual({0: 'slow', 1: 'fast'}, results)
+
+    def test_ordered(self):
+        '''
+        Test that an ordered method waits for the concurrent requests received
+        before it.
+
+        '''
+
+        self._released.set()
+        jsonrpc, outfp = self._server([
+            self._request('slow', 0), self._request('ordered', 1),
+            self._request('fast', 2)])
+        results = self._run(jsonrpc, outfp)
+        self.assertEqual(['slow', 'ordered'], self._calls[:2])
+        self.assertEqual({0: 'slow', 1: 'ordered', 2: 'fast'}, results)
+
+    def test_batch(self):
+        '''Test that the requests in a batch are not run concurrently.'''
+
+        self._released.set()
+        batch = b''.join((b'[', self._request('slow', 0), b',',
+            self._request('fast', 1), b']'))
+        jsonrpc, outfp = self._server([batch])
+        jsonrpc.run()
+        responses = json.loads(outfp.getvalue())
+        self.assertEqual(['slow', 'fast'], self._calls)
+        self.assertEqual(
+            ['slow', 'fast'], [r['result'] for r in responses])
+
+
+class _BlockingWriter(object):
+    '''A fake output file whose first `write` blocks until it is released.'''
+
+    def __init__(self):
+        self.writes = []
+        self.entered = threading.Event()
+        self.released = threading.Event()
+
+    def write(self, data):
+        self.entered.set()
+        self.released.wait(5.0)
+        self.writes.append(data)
+
+    def close(self):
+        pass
+
+
+class _BroadcastTestCase(unittest.TestCase):
+    def test_notification(self):
+        '''
+        Test that a notification is encoded once for each framing and that
+        every connection receives the same bytes.
+
+        '''
+
+        notification = Notification('jobchanged', {'id': 1})
+        outfps = []
+        for framing in (FRAMING_JSONREADER, FRAMING_LENGTH, FRAMING_LENGTH):
+            outfp = StringIO.StringIO()
+            jsonrpc = JsonRpc(_ChunkReader([]), outfp)
+            if None is not framing:
+                jsonrpc._setwriteframing(framing)
+            jsonrpc.sendnotification(notification)
+            jsonrpc.waitoutput()
+            outfps.append(outfp)
+        self.assertEqual(2, len(notification._encoded))
+        self.assertEqual(outfps[1].getvalue(), outfps[2].getvalue())
+        self.assertEqual(
+            {'jsonrpc': '2.0', 'method': 'jobchanged', 'params': {'id': 1}},
+            json.loads(outfps[0].getvalue()))
+
+    def test_coalesce(self):
+        '''
+        Test that messages are written by the writer thread, so the sender does
+        not block while a write is stuck, and that messages sent while it is
+        writing are coalesced into a single write.
+
+        '''
+
+        outfp = _BlockingWriter()
+        jsonrpc = JsonRpc(_ChunkReader([]), outfp)
+        jsonrpc.notify('a', [])
+        outfp.entered.wait(5.0)
+        jsonrpc.notify('b', [])
+        jsonrpc.notify('c', [])
+        self.assertEqual([], outfp.writes)
+        outfp.released.set()
+        jsonrpc.waitoutput()
+        self.assertEqual(2, len(outfp.writes))
+        responses = []
+        reader = conveyor.json.JsonReader(
+            lambda data: responses.append(json.loads(data)['method']), False)
+        reader.feed(outfp.writes[1].decode('UTF-8'))
+        self.assertEqual(['b', 'c'], responses)
+
+    def test_writer(self):
+        '''
+        Test that every burst of messages to a connection is written by the
+        same writer thread, so broadcasts do not start a thread each, and that
+        the writer ends when the connection is closed.
+
+        '''
+
+        threads = threading.active_count()
+        outfps = [StringIO.StringIO() for i in range(8)]
+        jsonrpcs = [JsonRpc(_ChunkReader([]), outfp) for outfp in outfps]
+        writers = set()
+        for i in range(10):
+            notification = Notification('jobchanged', {'id': i})
+            for jsonrpc in jsonrpcs:
+                jsonrpc.sendnotification(notification)
+            for jsonrpc in jsonrpcs:
+                jsonrpc.waitoutput()
+                writers.add(jsonrpc._writer)
+            self.assertEqual(
+                threads + len(jsonrpcs), threading.active_count())
+        self.assertEqual(len(jsonrpcs), len(writers))
+        for outfp in outfps:
+            self.assertEqual(10, outfp.getvalue().count('jobchanged'))
+        for jsonrpc in jsonrpcs:
+            jsonrpc.feedeof()
+        for writer in writers:
+            writer.join(5.0)
+            self.assertFalse(writer.is_alive())
+
+
+class _NonBlockingWriter(object):
+    '''A fake connection that accepts `capacity` bytes from `trysend`.'''
+
+    def __init__(self):
+        self.capacity = 0
+        self.data = b''
+        self.disconnects = 0
+
+    def trysend(self, data):
+        count = min(self.capacity, len(data))
+        self.data += data[:count]
+        self.capacity -= count
+        return count
+
+    def disconnect(self):
+        self.disconnects += 1
+
+    def close(self):
+        pass
+
+
+class _OutputTestCase(unittest.TestCase):
+    def _jsonrpc(self, limit, overflow):
+        outfp = _NonBlockingWriter()
+        jsonrpc = JsonRpc(_ChunkReader([]), outfp)
+        jsonrpc.setoutputlimit(limit, overflow)
+        requests = []
+        jsonrpc.setoutputcallback(lambda: requests.append(True))
+        return jsonrpc, outfp, requests
+
+    def _methods(self, data):
+        methods = []
+        reader = conveyor.json.JsonReader(
+            lambda data: methods.append(json.loads(data)['method']), False)
+        reader.feed(data.decode('UTF-8'))
+        return methods
+
+    def test_writeoutput(self):
+        '''
+        Test that queued messages are written by `writeoutput` instead of the
+        sending thread, including partial writes.
+
+        '''
+
+        jsonrpc, outfp, requests = self._jsonrpc(None, OVERFLOW_DROP)
+        for method in ('a', 'b', 'c'):
+            jsonrpc.notify(method, [])
+        self.assertEqual(1, len(requests))
+        self.assertEqual(b'', outfp.data)
+        self.assertEqual(3, jsonrpc.getoutputstats()['queued_messages'])
+        outfp.capacity = 60
+        self.assertTrue(jsonrpc.writeoutput())
+        self.assertEqual(2, jsonrpc.getoutputstats()['queued_messages'])
+        outfp.capacity = 1024
+        self.assertFalse(jsonrpc.writeoutput())
+        self.assertEqual(['a', 'b', 'c'], self._methods(outfp.data))
+        stats = jsonrpc.getoutputstats()
+        self.assertEqual(0, stats['queued_bytes'])
+        self.assertEqual(0, stats['dropped_messages'])
+        jsonrpc.notify('d', [])
+        self.assertEqual(2, len(requests))
+
+    def test_drop(self):
+        '''
+        Test that superseded notifications are dropped when the queue
+        overflows, and that the client is disconnected when that is not
+        enough.
+
+        '''
+
+        jsonrpc, outfp, requests = self._jsonrpc(200, OVERFLOW_DROP)
+        for i in range(10):
+            jsonrpc.sendnotification(Notification('a', [i], 'a'))
+        jsonrpc.notify('b', [])
+        self.assertEqual(0, outfp.disconnects)
+        stats = jsonrpc.getoutputstats()
+        self.assertTrue(stats['dropped_messages'] > 0)
+        self.assertTrue(stats['queued_bytes'] <= 200)
+        outfp.capacity = 1024
+        jsonrpc.writeoutput()
+        self.assertEqual('b', self._methods(outfp.data)[-1])
+        for i in range(10):
+            jsonrpc.notify('c', [i])
+        self.assertEqual(1, outfp.disconnects)
+
+    def test_disconnect(self):
+        '''Test that the client is disconnected when the queue overflows.'''
+
+        jsonrpc, outfp, requests = self._jsonrpc(200, OVERFLOW_DISCONNECT)
+        for i in range(10):
+            jsonrpc.sendnotification(Notification('a', [i], 'a'))
+        self.assertEqual(1, outfp.disconnects)
+        stats = jsonrpc.getoutputstats()
+        self.assertEqual(0, stats['queued_bytes'])
+        self.assertEqual(10, stats['dropped_messages'])
+
+
+class _CoalesceTestCase(unittest.TestCase):
+    def _jsonrpc(self, interval):
+        outfp = _NonBlockingWriter()
+        outfp.capacity = 1 << 20
+        jsonrpc = JsonRpc(_ChunkReader([]), outfp)
+        jsonrpc.setoutputlimit(None, OVERFLOW_DROP)
+        jsonrpc.setoutputcallback(lambda: None)
+        jsonrpc.setnotificationinterval(interval)
+        return jsonrpc, outfp
+
+    def _params(self, jsonrpc, outfp):
+        jsonrpc.writeoutput()
+        params = []
+        reader = conveyor.json.JsonReader(
+            lambda data: params.append(json.loads(data)['params']), False)
+        reader.feed(outfp.data.decode('UTF-8'))
+        return params
+
+    def test_coalesce(self):
+        '''
+        Test that a burst of notifications with the same key is sent as the
+        first and the last one.
+
+        '''
+
+        jsonrpc, outfp = self._jsonrpc(0.05)
+        for i in range(5):
+            jsonrpc.sendnotification(Notification('a', [i], 'a'))
+        jsonrpc.sendnotification(Notification('b', [0], 'b'))
+        self.assertEqual([[0], [0]], self._params(jsonrpc, outfp))
+        self.assertEqual(3, jsonrpc.getoutputstats()['coalesced_messages'])
+        deadline = time.time() + 1.0
+        while time.time() < deadline:
+            params = self._params(jsonrpc, outfp)
+            if 3 == len(params):
+                break
+            time.sleep(0.01)
+        self.assertEqual([[0], [0], [4]], params)
+
+    def test_terminal(self):
+        '''Test that a terminal notification is not delayed.'''
+
+        jsonrpc, outfp = self._jsonrpc(60.0)
+        jsonrpc.sendnotification(Notification('a', [0], 'a'))
+        jsonrpc.sendnotification(Notification('a', [1], 'a'))
+        jsonrpc.sendnotification(Notification('a', [2], 'a', terminal=True))
+        self.assertEqual([[0], [2]], self._params(jsonrpc, outfp))
+        jsonrpc.feedeof()
+        self.assertIsNone(jsonrpc._coalescetimer)
+
+    def test_merge(self):
+        '''Test that a pending notification is merged with a newer one.'''
+
+        def merge(older, newer):
+            return Notification(
+                newer.method, older.params + newer.params, newer.key,
+                merge=merge)
+        jsonrpc, outfp = self._jsonrpc(60.0)
+        for i in range(4):
+            jsonrpc.sendnotification(Notification('a', [i], 'a', merge=merge))
+        self.assertEqual([[0]], self._params(jsonrpc, outfp))
+        jsonrpc.setnotificationinterval(None)
+        self.assertEqual([[0], [1, 2, 3]], self._params(jsonrpc, outfp))
+
+
+class _CancelTestCase(unittest.TestCase):
+    def setUp(self):
+        eventqueue = conveyor.event.geteventqueue()
+        eventqueue.clear()
+        self._outfp = StringIO.StringIO()
+        self._outfp.close = lambda: None
+        self._jsonrpc = JsonRpc(_ChunkReader([]), self._outfp)
+        self._tasks = []
+        def slow():
+            task = conveyor.task.Task()
+            self._tasks.append(task)
+            return task
+        self._jsonrpc.addmethod('slow', slow)
+
+    def _runeventqueue(self):
+        eventqueue = conveyor.event.geteventqueue()
+        while eventqueue.runiteration(False):
+            pass
+
+    def _messages(self):
+        self._jsonrpc.waitoutput()
+        messages = []
+        reader = conveyor.json.JsonReader(
+            lambda data: messages.append(json.loads(data)), False)
+        reader.feed(self._outfp.getvalue().decode('UTF-8'))
+        return messages
+
+    def _feed(self, method, params, id=None):
+        request = {'jsonrpc': '2.0', 'method': method, 'params': params}
+        if None is not id:
+            request['id'] = id
+        self._jsonrpc._feed(conveyor.json.dumps(request).encode('UTF-8'))
+        self._runeventqueue()
+
+    def test_cancel(self):
+        '''Test that a cancel notification cancels the task of a request.'''
+
+        self._feed('slow', {}, 7)
+        self._feed('slow', {}, 8)
+        self._feed('cancel', {'id': 7})
+        self._feed('cancel', {'id': 9})
+        first, second = self._tasks
+        self.assertTrue(first.iscanceled())
+        self.assertTrue(second.isrunning())
+        response, = self._messages()
+        self.assertEqual(7, response['id'])
+        self.assertEqual(-32002, response['error']['code'])
+        self.assertEqual([8], self._jsonrpc._served.keys())
+
+    def test_disconnect(self):
+        '''
+        Test that the tasks of a connection are canceled when it closes and
+        that no responses are sent for them.
+
+        '''
+
+        self._feed('slow', {}, 7)
+        self._feed('slow', {})
+        self._jsonrpc.feedeof()
+        self._runeventqueue()
+        self._feed('slow', {}, 8)
+        self.assertEqual(3, len(self._tasks))
+        for task in self._tasks:
+            self.assertTrue(task.iscanceled())
+        self.assertEqual([], self._messages())
+        self.assertEqual({}, self._jsonrpc._served)
+
+    def test_request(self):
+        '''Test that canceling a request tells the peer to cancel it.'''
+
+        task = self._jsonrpc.request('slow', {})
+        task.start()
+        self._runeventqueue()
+        task.cancel()
+        self._runeventqueue()
+        request, notification = self._messages()
+        self.assertEqual('cancel', notification['method'])
+        self.assertEqual({'id': request['id']}, notification['params'])
+        self.assertNotIn('id', notification)
+        self.assertEqual(0, self._jsonrpc.getpending())
+
+
+class _MethodInfoTestCase(unittest.TestCase):
+    def _getjob(self, id, verbose=False):
+        return id, verbose
+
+    def _update(self, name, **kwargs):
+        return name, kwargs
+
+    def _bind(self, func, args, kwargs):
+        info = _MethodInfo(func)
+        result = info.invoke(args, kwargs)
+        args1, kwargs1 = info.bind(args, kwargs)
+        self.assertEqual(result, func(*args1, **kwargs1))
+        return result
+
+    def _assertinvalid(self, data, func, args, kwargs):
+        with self.assertRaises(JsonRpcException) as context:
+            self._bind(func, args, kwargs)
+        self.assertEqual(-32602, context.exception.code)
+        self.assertEqual(data, context.exception.data)
+
+    def test_bind(self):
+        '''Test that positional and named params are bound to arguments.'''
+
+        self.assertEqual((1, False), self._bind(self._getjob, [1], {}))
+        self.assertEqual((1, True), self._bind(self._getjob, [1, True], {}))
+        self.assertEqual((2, False), self._bind(self._getjob, (), {'id': 2}))
+        self.assertEqual(
+            (2, True),
+            self._bind(self._getjob, (), {'verbose': True, 'id': 2}))
+        self.assertEqual(
+            ('a', {'b': 1}), self._bind(self._update, (), {'name': 'a', 'b': 1}))
+        self.assertEqual(3, self._bind(len, ([1, 2, 3],), {}))
+
+    def test_invalid(self):
+        '''Test that a bad call names the parameter at fault.'''
+
+        self._assertinvalid(
+            'missing parameter: id', self._getjob, (), {'verbose': True})
+        self._assertinvalid(
+            'unexpected parameter: x', self._getjob, (), {'id': 1, 'x': 2})
+        self._assertinvalid(
+            'too many parameters: expected at most 2, got 3',
+            self._getjob, [1, 2, 3], {})
+
+    def test_typeerror(self):
+        '''
+        Test that a `TypeError` raised by a method is reported as an uncaught
+        exception and not as invalid params.
+
+        '''
+
+        outfp = StringIO.StringIO()
+        jsonrpc = JsonRpc(_ChunkReader([]), outfp)
+        def fail(id):
+            raise TypeError('inside')
+        jsonrpc.addmethod('fail', fail)
+        request = {'jsonrpc': '2.0', 'method': 'fail', 'params': [1], 'id': 1}
+        jsonrpc._feed(conveyor.json.dumps(request).encode('UTF-8'))
+        jsonrpc.waitoutput()
+        response = json.loads(outfp.getvalue())
+        self.assertEqual(-32000, response['error']['code'])
+        self.assertEqual('TypeError', response['error']['data']['name'])
+
+
+class _RateLimitTestCase(unittest.TestCase):
+    def setUp(self):
+        self._outfp = StringIO.StringIO()
+        self._jsonrpc = JsonRpc(_ChunkReader([]), self._outfp)
+        self._jsonrpc.addmethod('getjobs', lambda: {}, rateclass='query')
+        self._jsonrpc.addmethod('pause', lambda: None)
+
+    def _responses(self, method, count):
+        for id in range(count):
+            request = {'jsonrpc': '2.0', 'method': method, 'id': id}
+            self._jsonrpc._feed(conveyor.json.dumps(request).encode('UTF-8'))
+        self._jsonrpc.waitoutput()
+        responses = []
+        reader = conveyor.json.JsonReader(
+            lambda data: responses.append(json.loads(data)), False)
+        reader.feed(self._outfp.getvalue().decode('UTF-8'))
+        self._outfp.truncate(0)
+        return responses
+
+    def test_bucket(self):
+        '''Test that a bucket admits a burst and then refills at its rate.'''
+
+        bucket = _TokenBucket(2.0, 2)
+        self.assertEqual(0, bucket.take(10.0))
+        self.assertEqual(0, bucket.take(10.0))
+        self.assertAlmostEqual(0.5, bucket.take(10.0))
+        self.assertEqual(0, bucket.take(10.5))
+        self.assertAlmostEqual(0.25, bucket.take(10.5 + 0.25))
+
+    def test_throttle(self):
+        '''
+        Test that requests beyond the limit of their rate class are rejected
+        and counted, and that other methods are not limited.
+
+        '''
+
+        self._jsonrpc.setratelimit('query', 0.001, 3)
+        responses = self._responses('getjobs', 5)
+        self.assertEqual([{}] * 3, [r.get('result') for r in responses[:3]])
+        for response in responses[3:]:
+            self.assertEqual(-32005, response['error']['code'])
+            self.assertGreater(response['error']['data']['retry_after'], 0)
+        responses = self._responses('pause', 5)
+        self.assertTrue(all('result' in r for r in responses))
+        stats = self._jsonrpc.getrequeststats()
+        self.assertEqual(2, stats['throttled_requests'])
+        self.assertEqual({'query': 2}, stats['throttled_by_class'])
+        self._jsonrpc.setratelimit('query', None, None)
+        responses = self._responses('getjobs', 5)
+        self.assertTrue(all('result' in r for r in responses))
+
+
+class _SerializedTestCase(unittest.TestCase):
+    def test_serialized(self):
+        '''
+        Test that a serialized result is sent as is, alone and in a batch.
+
+        '''
+
+        outfp = StringIO.StringIO()
+        jsonrpc = JsonRpc(_ChunkReader([]), outfp)
+        data = conveyor.json.dumps({'version': 3, 'jobs': []})
+        jsonrpc.addmethod('snapshot', lambda: Serialized(data))
+        jsonrpc.addmethod('version', lambda: 3)
+        request = {'jsonrpc': '2.0', 'method': 'snapshot', 'id': 1}
+        jsonrpc._feed(conveyor.json.dumps(request).encode('UTF-8'))
+        jsonrpc.waitoutput()
+        response = json.loads(outfp.getvalue())
+        self.assertEqual(
+            {'jsonrpc': '2.0', 'result': {'version': 3, 'jobs': []}, 'id': 1},
+            response)
+        outfp.truncate(0)
+        batch = [
+            {'jsonrpc': '2.0', 'method': 'version', 'id': 'a'},
+            {'jsonrpc': '2.0', 'method': 'snapshot', 'id': 'b'},
+        ]
+        jsonrpc._feed(conveyor.json.dumps(batch).encode('UTF-8'))
+        jsonrpc.waitoutput()
+        responses = json.loads(outfp.getvalue())
+        self.assertEqual([3, {'version': 3, 'jobs': []}],
+            [r['result'] for r in responses])
+        self.assertEqual(['a', 'b'], [r['id'] for r in responses])
@@ -88,6 +88,33 @@ class _AbstractSocketListener(Listener):
                     self._log_connection(addr)
                     connection = conveyor.connection.SocketConnection(sock, addr)
                     return connection
+
+    def fileno(self):
+        return self._socket.fileno()
+
+    def tryaccept(self):
+        '''
+        Accept a pending connection without blocking. Returns `None` if there
+        is no pending connection. This is used by `conveyor.reactor.Reactor`
+        once the listening socket is readable.
+
+        '''
+
+        self._socket.settimeout(0.0)
+        try:
+            sock, addr = self._socket.accept()
+            sock.settimeout(None)
+        except socket.timeout:
+            return None
+        except IOError as e:
+            if e.args[0] in (errno.EINTR, errno.EAGAIN, errno.EWOULDBLOCK):
+                return None
+            else:
+                raise
+        else:
+            self._log_connection(addr)
+            connection = conveyor.connection.SocketConnection(sock, addr)
+            return connection
     def _log_connection(self, addr):
         raise NotImplementedError
 
@@ -25,6 +25,7 @@ import threading
 import conveyor.enum
 import conveyor.error
 import conveyor.event
+import conveyor.json
 import conveyor.log
 import conveyor.stoppable
 
@@ -274,6 +275,9 @@ class MachineInfo(object):
         return dct
 
 
+conveyor.json.register(MachineInfo)
+
+
 class Machine(object):
     def __init__(self, name, driver, profile):
         self.name = name
@@ -283,12 +287,25 @@ class Machine(object):
         self._port = None
         self._state = MachineState.DISCONNECTED
         self._state_condition = threading.Condition()
-        self.state_changed = conveyor.event.Event('state_changed')
-        self.temperature_changed = conveyor.event.Event('temperature_changed')
+        self.state_changed = conveyor.event.Event(
+            'state_changed', key=self,
+            priority=conveyor.event.EventPriority.CONTROL)
+        self.temperature_changed = conveyor.event.Event(
+            'temperature_changed', key=self)
+        self._status_board = None
 
     def get_info(self):
         raise NotImplementedError
 
+    def set_status_board(self, status_board):
+        '''
+        Publish the state and temperatures of this machine to a
+        `conveyor.statusboard.StatusBoard` whenever they change.
+
+        '''
+
+        self._status_board = status_board
+
     def get_port(self):
         return self._port
 
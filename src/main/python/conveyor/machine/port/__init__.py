@@ -24,6 +24,7 @@ import logging
 import conveyor.enum
 import conveyor.error
 import conveyor.event
+import conveyor.json
 import conveyor.log
 
 
@@ -45,9 +46,11 @@ class PortManager(object):
         self._driver_manager = driver_manager
         self._factories = []
         self._ports = {}
-        self.port_attached = conveyor.event.Event('port_attached')
+        self.port_attached = conveyor.event.Event('port_attached', key=self)
         self.port_attached.attach(self._handle_port_attached)
-        self.port_detached = conveyor.event.Event('port_detached')
+        self.port_detached = conveyor.event.Event(
+            'port_detached', key=self,
+            priority=conveyor.event.EventPriority.CONTROL)
         self.port_detached.attach(self._handle_port_detached)
 
     def get_ports(self):
@@ -79,9 +82,11 @@ class PortFactory(object):
     def __init__(self, driver_manager):
         self._driver_manager = driver_manager
         self._log = conveyor.log.getlogger(self)
-        self.port_attached = conveyor.event.Event('port_attached')
+        self.port_attached = conveyor.event.Event('port_attached', key=self)
         self.port_attached.attach(self._port_attached_callback)
-        self.port_detached = conveyor.event.Event('port_detached')
+        self.port_detached = conveyor.event.Event(
+            'port_detached', key=self,
+            priority=conveyor.event.EventPriority.CONTROL)
         self.port_detached.attach(self._port_detached_callback)
 
     def _start(self):
@@ -112,6 +117,9 @@ class PortInfo(object):
         return dct
 
 
+conveyor.json.register(PortInfo)
+
+
 class Port(object):
     def __init__(self, type, name):
         self.type = type
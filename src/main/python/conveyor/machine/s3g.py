@@ -106,7 +106,11 @@ class S3gDriver(conveyor.machine.Driver):
             extruders, extruder_temperature, platform_temperature,
             material_name, build_name, task):
         try:
-            with open(output_path, 'wb') as output_fp:
+            if isinstance(output_path, basestring):
+                output = open(output_path, 'wb')
+            else:
+                output = output_path
+            with output as output_fp:
                 condition = threading.Condition()
                 writer = makerbot_driver.Writer.FileWriter(
                     output_fp, condition)
@@ -150,7 +154,10 @@ class S3gDriver(conveyor.machine.Driver):
         except Exception as e:
             self._log.exception('unhandled exception; print-to-file failed')
             failure = conveyor.util.exception_to_failure(e)
-            task.fail(failure)
+            # NOTE: the task is already stopped when it was canceled while
+            # waiting for a client to consume its output stream.
+            if conveyor.task.TaskState.RUNNING == task.state:
+                task.fail(failure)
 
     def _execute_lines(self, task, parser, iterable):
         for line in iterable:
@@ -455,8 +462,17 @@ class _S3gMachine(conveyor.stoppable.StoppableInterface, conveyor.machine.Machin
             if new_state != self._state:
                 self._state = new_state
                 self._state_condition.notify_all()
+                self._publish_status()
                 self.state_changed(self)
 
+    def _publish_status(self):
+        # NOTE: the status board is updated where the machine changes instead
+        # of when the event queue gets to the change.
+        if None is not self._status_board:
+            self._status_board.publish_machine(
+                self.name, self._state, self._toolhead_temperature,
+                self._platform_temperature)
+
     def _poll_thread_target(self):
         try:
             while not self._stop:
@@ -553,6 +569,7 @@ class _S3gMachine(conveyor.stoppable.StoppableInterface, conveyor.machine.Machin
                             and None is self._operation and self._is_finished):
                         self._change_state(conveyor.machine.MachineState.IDLE)
                     if temperature_changed:
+                        self._publish_status()
                         self.temperature_changed(self)
                     self._log.debug(
                         'motherboard_status=%r, build_stats=%r, platform_temperature=%r, is_platform_ready=%r, tool_status=%r, toolhead_temperature=%r, is_tool_ready=%r',
@@ -55,4 +55,7 @@ DEFAULT_CONFIG_SKEINFORGE_PROFILE_DIR = '/usr/share/makerbot/skeinforge/'
 DEFAULT_CONFIG_SERVER_LOGGING_FILE = '/var/log/conveyor/conveyord.log'
 
 
+DEFAULT_CONFIG_SERVER_STATUS_BOARD_FILE = '/var/run/conveyor/conveyord.status'
+
+
 DEFAULT_CONFIG_SERVER_UNIFIED_MESH_HACK_EXE = '/usr/bin/unified_mesh_hack'
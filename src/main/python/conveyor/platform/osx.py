@@ -55,4 +55,7 @@ DEFAULT_CONFIG_SKEINFORGE_PROFILE_DIR = '/Library/MakerBot/skeinforge/'
 DEFAULT_CONFIG_SERVER_LOGGING_FILE = '/var/log/conveyor/conveyord.log'
 
 
+DEFAULT_CONFIG_SERVER_STATUS_BOARD_FILE = '/var/tmp/conveyord.status'
+
+
 DEFAULT_CONFIG_SERVER_UNIFIED_MESH_HACK_EXE = '/Library/MakerBot/unified_mesh_hack'
@@ -64,4 +64,7 @@ DEFAULT_CONFIG_SKEINFORGE_PROFILE_DIR = 'skeinforge'
 DEFAULT_CONFIG_SERVER_LOGGING_FILE = 'conveyord.log'
 
 
+DEFAULT_CONFIG_SERVER_STATUS_BOARD_FILE = 'conveyord.status'
+
+
 DEFAULT_CONFIG_SERVER_UNIFIED_MESH_HACK_EXE = 'unified_mesh_hack.exe'
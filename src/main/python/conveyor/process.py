@@ -21,6 +21,8 @@
 
 from __future__ import (absolute_import, print_function, unicode_literals)
 
+import threading
+
 try:
     import unittest2 as unittest
 except ImportError:
@@ -42,12 +44,31 @@ def tasksequence(job, tasklist):
     processhandler = _ProcessHandler(job, machine, task)
     return task
 
+def taskparallel(tasklist, job=None, name='parallel'):
+    """
+    Fork and join a list of tasks. The returned task starts every task when
+    it starts and ends, with the list of their results, once all of them have
+    ended. When one of them fails the others are canceled and the returned
+    task fails with the same failure. Canceling the returned task cancels
+    them, as does canceling one of them.
+    @param tasklist list of Task objects to run at the same time
+    @param job the job whose stages include the tasks, if any
+    @param name the name of the returned task
+    """
+    task = conveyor.task.Task(name=name)
+    parallelhandler = _ParallelHandler(job, tasklist, task)
+    return task
+
 class _ProcessHandler(object):
     def __init__(self, job, machine, task):
         self._child = None
         self._job = job
         self._machine = machine
         self._task = task
+        # NOTE: the job shares the list of stage tasks so that its timing
+        # breakdown is current whenever the job is read.
+        self._stages = []
+        job.stages = self._stages
         self._task.startevent.attach(self._taskstartcallback)
         self._task.cancelevent.attach(self._taskcancelcallback)
 
@@ -59,6 +80,7 @@ class _ProcessHandler(object):
         else:
             assert self._machine.is_yielded()
             self._child = self._machine.get_yield_value()
+            self._stages.append(self._child)
             self._child.heartbeatevent.attach(self._childheartbeatcallback)
             self._child.endevent.attach(self._childendcallback)
             self._child.failevent.attach(self._childfailcallback)
@@ -91,6 +113,77 @@ class _ProcessHandler(object):
         if conveyor.task.TaskState.STOPPED != self._task.state:
             self._task.cancel()
 
+class _ParallelHandler(object):
+    def __init__(self, job, children, task):
+        # NOTE: each child is its own event key, so the callbacks of
+        # different children may run at the same time.
+        self._lock = threading.Lock()
+        self._job = job
+        self._children = list(children)
+        self._task = task
+        self._remaining = len(self._children)
+        self._task.startevent.attach(self._taskstartcallback)
+        self._task.cancelevent.attach(self._taskcancelcallback)
+
+    def _cancelchildren(self):
+        for child in self._children:
+            if conveyor.task.TaskState.STOPPED != child.state:
+                child.cancel()
+
+    def _taskstartcallback(self, unused):
+        if None is not self._job:
+            self._job.stages.extend(self._children)
+        if 0 == len(self._children):
+            self._task.end([])
+        else:
+            for child in self._children:
+                child.heartbeatevent.attach(self._childheartbeatcallback)
+                child.endevent.attach(self._childendcallback)
+                child.failevent.attach(self._childfailcallback)
+                child.cancelevent.attach(self._childcancelcallback)
+            for child in self._children:
+                child.start()
+
+    def _taskcancelcallback(self, unused):
+        with self._lock:
+            self._cancelchildren()
+
+    def _childheartbeatcallback(self, child):
+        with self._lock:
+            if conveyor.task.TaskState.RUNNING == self._task.state:
+                # NOTE: the progress of the task is the mean progress of its
+                # children, named after the child that reported last.
+                total = 0
+                for c in self._children:
+                    if conveyor.task.TaskConclusion.ENDED == c.conclusion:
+                        total += 100
+                    elif None is not c.progress:
+                        total += c.progress.get('progress', 0)
+                progress = {
+                    'name': child.progress.get('name'),
+                    'progress': total // len(self._children),
+                }
+                self._task.lazy_heartbeat(progress, self._task.progress)
+
+    def _childendcallback(self, unused):
+        with self._lock:
+            self._remaining -= 1
+            if (0 == self._remaining
+                and conveyor.task.TaskState.RUNNING == self._task.state):
+                    result = [child.result for child in self._children]
+                    self._task.end(result)
+
+    def _childfailcallback(self, child):
+        with self._lock:
+            if conveyor.task.TaskState.RUNNING == self._task.state:
+                self._task.fail(child.failure)
+                self._cancelchildren()
+
+    def _childcancelcallback(self, unused):
+        with self._lock:
+            if conveyor.task.TaskState.STOPPED != self._task.state:
+                self._task.cancel()
+
 class _Term(object):
     '''\
     An abstract term.
@@ -549,6 +642,108 @@ class _ProcessTaskTestCase(unittest.TestCase):
             conveyor.task.TaskConclusion.CANCELED, process.conclusion)
         self.assertFalse(callback.delivered)
 
+class _ParallelTaskTestCase(unittest.TestCase):
+    def _runeventqueue(self, eventqueue):
+        while eventqueue.runiteration(False):
+            pass
+
+    def _task(self, name, func):
+        task = conveyor.task.Task(name=name)
+        task.runningevent.attach(func)
+        return task
+
+    def test_end(self):
+        '''Test that a parallel task starts all of its tasks and ends with
+        their results.'''
+
+        eventqueue = conveyor.event.geteventqueue()
+        eventqueue.clear()
+        task1 = self._task('task1', lambda task: None)
+        task2 = self._task('task2', lambda task: None)
+        parallel = taskparallel([task1, task2])
+        parallel.start()
+        self._runeventqueue(eventqueue)
+        self.assertTrue(task1.isrunning())
+        self.assertTrue(task2.isrunning())
+        task2.heartbeat({'name': 'slice', 'progress': 50})
+        self._runeventqueue(eventqueue)
+        self.assertEqual({'name': 'slice', 'progress': 25}, parallel.progress)
+        task2.end(2)
+        self._runeventqueue(eventqueue)
+        self.assertTrue(parallel.isrunning())
+        task1.end(1)
+        self._runeventqueue(eventqueue)
+        self.assertTrue(parallel.isended())
+        self.assertEqual([1, 2], parallel.result)
+
+    def test_fail(self):
+        '''Test that a failed task cancels the others and fails the parallel
+        task.'''
+
+        eventqueue = conveyor.event.geteventqueue()
+        eventqueue.clear()
+        task1 = self._task('task1', lambda task: task.fail('failure'))
+        task2 = self._task('task2', lambda task: None)
+        parallel = taskparallel([task1, task2])
+        parallel.start()
+        self._runeventqueue(eventqueue)
+        self.assertTrue(parallel.isfailed())
+        self.assertEqual('failure', parallel.failure)
+        self.assertTrue(task2.iscanceled())
+
+    def test_cancel(self):
+        '''Test that canceling a parallel task cancels its tasks.'''
+
+        eventqueue = conveyor.event.geteventqueue()
+        eventqueue.clear()
+        task1 = self._task('task1', lambda task: None)
+        task2 = self._task('task2', lambda task: None)
+        parallel = taskparallel([task1, task2])
+        parallel.start()
+        self._runeventqueue(eventqueue)
+        parallel.cancel()
+        self._runeventqueue(eventqueue)
+        self.assertTrue(task1.iscanceled())
+        self.assertTrue(task2.iscanceled())
+
+    def test_cancel_child(self):
+        '''Test that canceling one task cancels the parallel task and the
+        other tasks.'''
+
+        eventqueue = conveyor.event.geteventqueue()
+        eventqueue.clear()
+        task1 = self._task('task1', lambda task: None)
+        task2 = self._task('task2', lambda task: None)
+        parallel = taskparallel([task1, task2])
+        parallel.start()
+        self._runeventqueue(eventqueue)
+        task1.cancel()
+        self._runeventqueue(eventqueue)
+        self.assertTrue(parallel.iscanceled())
+        self.assertTrue(task2.iscanceled())
+
+    def test_sequence(self):
+        '''Test a parallel task in a sequence, with the stages of the job.'''
+
+        class Job(object):
+            stages = None
+
+        eventqueue = conveyor.event.geteventqueue()
+        eventqueue.clear()
+        job = Job()
+        task1 = self._task('task1', lambda task: task.end(1))
+        task2 = self._task('task2', lambda task: task.end(2))
+        task3 = self._task('task3', lambda task: task.end(3))
+        parallel = taskparallel([task1, task2], job, 'both')
+        process = tasksequence(job, [parallel, task3])
+        process.start()
+        self._runeventqueue(eventqueue)
+        self.assertTrue(process.isended())
+        self.assertEqual(3, process.result)
+        self.assertEqual(
+            ['both', 'task1', 'task2', 'task3'],
+            [stage.name for stage in job.stages])
+
 class _MachineTestCase(unittest.TestCase):
     def test_abort(self):
         '''Test the abort term.'''
@@ -0,0 +1,511 @@
+# vim:ai:et:ff=unix:fileencoding=utf-8:sw=4:ts=4:
+# conveyor/src/main/python/conveyor/reactor.py
+#
+# conveyor - Printing dispatch engine for 3D objects and their friends.
+# Copyright © 2012 Matthew W. Samsonoff <matthew.samsonoff@makerbot.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import (absolute_import, print_function, unicode_literals)
+
+import collections
+import errno
+import os
+import select
+import socket
+import tempfile
+import threading
+import time
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import conveyor.error
+import conveyor.executor
+import conveyor.listener
+import conveyor.log
+import conveyor.stoppable
+
+if 'nt' != os.name:
+    import fcntl
+
+
+class _EpollPoller(object):
+    def __init__(self):
+        self._epoll = select.epoll()
+
+    def _getmask(self, readable, writable):
+        mask = 0
+        if readable:
+            mask |= select.EPOLLIN
+        if writable:
+            mask |= select.EPOLLOUT
+        return mask
+
+    def register(self, fd, readable, writable):
+        self._epoll.register(fd, self._getmask(readable, writable))
+
+    def modify(self, fd, readable, writable):
+        self._epoll.modify(fd, self._getmask(readable, writable))
+
+    def unregister(self, fd):
+        self._epoll.unregister(fd)
+
+    def poll(self):
+        events = []
+        for fd, mask in self._epoll.poll():
+            error = mask & (select.EPOLLERR | select.EPOLLHUP)
+            readable = bool(error or mask & select.EPOLLIN)
+            writable = bool(error or mask & select.EPOLLOUT)
+            events.append((fd, readable, writable))
+        return events
+
+    def close(self):
+        self._epoll.close()
+
+
+class _PollPoller(object):
+    def __init__(self):
+        self._poll = select.poll()
+
+    def _getmask(self, readable, writable):
+        mask = 0
+        if readable:
+            mask |= select.POLLIN
+        if writable:
+            mask |= select.POLLOUT
+        return mask
+
+    def register(self, fd, readable, writable):
+        self._poll.register(fd, self._getmask(readable, writable))
+
+    def modify(self, fd, readable, writable):
+        self._poll.modify(fd, self._getmask(readable, writable))
+
+    def unregister(self, fd):
+        self._poll.unregister(fd)
+
+    def poll(self):
+        events = []
+        for fd, mask in self._poll.poll():
+            error = mask & (select.POLLERR | select.POLLHUP | select.POLLNVAL)
+            readable = bool(error or mask & select.POLLIN)
+            writable = bool(error or mask & select.POLLOUT)
+            events.append((fd, readable, writable))
+        return events
+
+    def close(self):
+        pass
+
+
+def _createpoller():
+    if hasattr(select, 'epoll'):
+        poller = _EpollPoller()
+    else:
+        poller = _PollPoller()
+    return poller
+
+
+class _ReactorConnection(object):
+    def __init__(self, fd, connection, executor):
+        self.fd = fd
+        self.connection = connection
+        self.queue = conveyor.executor.SerialQueue(executor)
+        self.handler = None
+        self.reading = True
+        self.writing = False
+        self.registered = False
+
+
+class Reactor(conveyor.stoppable.StoppableInterface):
+    '''
+    Multiplexes the I/O of a listener and all of its connections on a single
+    thread.
+
+    `acceptcallback(connection, outputcallback)` is invoked on the reactor
+    thread with each new connection and returns its handler. The handler's
+    `feed(data)` and `feedeof()` are invoked in order on the connection's own
+    `SerialQueue`, which runs on the shared `Executor`. The number of threads
+    therefore does not grow with the number of clients, and a slow handler
+    holds at most one worker. A connection is not polled for input while its
+    data is being processed, so it is not read ahead of its requests.
+
+    The handler invokes `outputcallback` from any thread when it has queued
+    output. The reactor then invokes the handler's `writeoutput()` whenever the
+    connection is writable until it returns `False`. Output is never written by
+    the thread that queued it, so a client that stops reading cannot block it.
+
+    Only sockets can be polled, so this is not available for Windows named
+    pipes.
+
+    '''
+
+    def __init__(self, listener, executor, acceptcallback):
+        conveyor.stoppable.StoppableInterface.__init__(self)
+        self._listener = listener
+        self._executor = executor
+        self._acceptcallback = acceptcallback
+        self._log = conveyor.log.getlogger(self)
+        self._condition = threading.Condition()
+        self._stop = False
+        self._resumed = collections.deque()
+        self._outputs = collections.deque()
+        self._connections = {}
+        self._poller = _createpoller()
+        self._wakeread, self._wakewrite = os.pipe()
+        for fd in (self._wakeread, self._wakewrite):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    def stop(self):
+        with self._condition:
+            self._stop = True
+        self._wake()
+
+    def run(self):
+        listenerfd = self._listener.fileno()
+        self._poller.register(self._wakeread, True, False)
+        self._poller.register(listenerfd, True, False)
+        try:
+            while True:
+                with self._condition:
+                    stop = self._stop
+                if stop:
+                    break
+                else:
+                    for fd, readable, writable in self._poll():
+                        if self._wakeread == fd:
+                            self._drainwake()
+                        elif listenerfd == fd:
+                            self._accept()
+                        else:
+                            self._handle(fd, readable, writable)
+        finally:
+            for reactorconnection in self._connections.values():
+                reactorconnection.queue.submit(
+                    reactorconnection.handler.feedeof)
+            self._connections.clear()
+            self._poller.close()
+            os.close(self._wakeread)
+            os.close(self._wakewrite)
+
+    def _poll(self):
+        try:
+            events = self._poller.poll()
+        except (IOError, select.error) as e:
+            if errno.EINTR == e.args[0]:
+                events = []
+            else:
+                raise
+        return events
+
+    def _wake(self):
+        try:
+            os.write(self._wakewrite, b'\0')
+        except OSError as e:
+            # NOTE: the pipe is full when the reactor already has a wake-up
+            # pending, or closed when it has stopped.
+            if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EBADF):
+                raise
+
+    def _drainwake(self):
+        try:
+            while 0 != len(os.read(self._wakeread, 4096)):
+                pass
+        except OSError as e:
+            if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+        with self._condition:
+            resumed = list(self._resumed)
+            self._resumed.clear()
+            outputs = list(self._outputs)
+            self._outputs.clear()
+        for reactorconnection in resumed:
+            if self._isconnected(reactorconnection):
+                reactorconnection.reading = True
+                self._update(reactorconnection)
+        for reactorconnection in outputs:
+            if self._isconnected(reactorconnection):
+                reactorconnection.writing = True
+                self._update(reactorconnection)
+
+    def _isconnected(self, reactorconnection):
+        fd = reactorconnection.fd
+        result = reactorconnection is self._connections.get(fd)
+        return result
+
+    def _update(self, reactorconnection):
+        # NOTE: a connection that is neither read nor written is removed from
+        # the poller. Otherwise a hang-up would be reported over and over while
+        # its data is being processed.
+        fd = reactorconnection.fd
+        reading = reactorconnection.reading
+        writing = reactorconnection.writing
+        try:
+            if not reading and not writing:
+                if reactorconnection.registered:
+                    reactorconnection.registered = False
+                    self._poller.unregister(fd)
+            elif reactorconnection.registered:
+                self._poller.modify(fd, reading, writing)
+            else:
+                reactorconnection.registered = True
+                self._poller.register(fd, reading, writing)
+        except (IOError, KeyError):
+            # NOTE: the socket is already closed.
+            self._log.debug('handled exception', exc_info=True)
+
+    def _accept(self):
+        while True:
+            connection = self._listener.tryaccept()
+            if None is connection:
+                break
+            else:
+                def func():
+                    fd = connection.fileno()
+                    reactorconnection = _ReactorConnection(
+                        fd, connection, self._executor)
+                    def outputcallback():
+                        self._requestoutput(reactorconnection)
+                    reactorconnection.handler = self._acceptcallback(
+                        connection, outputcallback)
+                    self._connections[fd] = reactorconnection
+                    self._update(reactorconnection)
+                conveyor.error.guard(self._log, func)
+
+    def _handle(self, fd, readable, writable):
+        reactorconnection = self._connections.get(fd)
+        if None is not reactorconnection:
+            if writable and reactorconnection.writing:
+                self._write(reactorconnection)
+            if readable and reactorconnection.reading:
+                self._read(reactorconnection)
+
+    def _write(self, reactorconnection):
+        try:
+            more = reactorconnection.handler.writeoutput()
+        except:
+            self._log.warning('uncaught exception', exc_info=True)
+            more = False
+        if not more:
+            reactorconnection.writing = False
+            self._update(reactorconnection)
+
+    def _read(self, reactorconnection):
+        handler = reactorconnection.handler
+        try:
+            data = reactorconnection.connection.read()
+        except IOError:
+            self._log.debug('handled exception', exc_info=True)
+            data = b''
+        reactorconnection.reading = False
+        if 0 == len(data):
+            reactorconnection.writing = False
+            self._update(reactorconnection)
+            del self._connections[reactorconnection.fd]
+            reactorconnection.queue.submit(handler.feedeof)
+        else:
+            self._update(reactorconnection)
+            def func():
+                try:
+                    handler.feed(data)
+                finally:
+                    self._resume(reactorconnection)
+            reactorconnection.queue.submit(func)
+
+    def _resume(self, reactorconnection):
+        with self._condition:
+            self._resumed.append(reactorconnection)
+        self._wake()
+
+    def _requestoutput(self, reactorconnection):
+        with self._condition:
+            self._outputs.append(reactorconnection)
+        self._wake()
+
+
+class _RecordingHandler(object):
+    '''A handler that records its input and echoes it back.'''
+
+    def __init__(self, condition, events, connection, outputcallback):
+        self._condition = condition
+        self._events = events
+        self._connection = connection
+        self._outputcallback = outputcallback
+        self._output = b''
+
+    def feed(self, data):
+        with self._condition:
+            self._events.append(data)
+            self._output += data
+            self._condition.notify_all()
+        self._outputcallback()
+
+    def writeoutput(self):
+        with self._condition:
+            count = self._connection.trysend(self._output)
+            self._output = self._output[count:]
+            return 0 != len(self._output)
+
+    def feedeof(self):
+        with self._condition:
+            self._events.append(None)
+            self._condition.notify_all()
+
+
+class _ReactorTestCase(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._path = os.path.join(self._directory, 'conveyord.socket')
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.bind(self._path)
+        s.listen(socket.SOMAXCONN)
+        self._listener = conveyor.listener.PipeListener(self._path, s)
+        self._executor = conveyor.executor.Executor('test', 2, 64)
+        self._executor.start()
+        self._condition = threading.Condition()
+        self._events = collections.defaultdict(list)
+        self._accepted = []
+        def acceptcallback(connection, outputcallback):
+            self._accepted.append(connection)
+            events = self._events[len(self._accepted) - 1]
+            return _RecordingHandler(
+                self._condition, events, connection, outputcallback)
+        self._reactor = Reactor(
+            self._listener, self._executor, acceptcallback)
+        self._thread = threading.Thread(target=self._reactor.run)
+        self._thread.start()
+
+    def tearDown(self):
+        self._reactor.stop()
+        self._thread.join(5.0)
+        self._executor.stop()
+        self._executor.join(1)
+        self._listener.cleanup()
+        os.rmdir(self._directory)
+
+    def _connect(self):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.connect(self._path)
+        return s
+
+    def _wait(self, i, count):
+        with self._condition:
+            for _ in range(50):
+                if len(self._events[i]) >= count:
+                    break
+                else:
+                    self._condition.wait(0.1)
+            return list(self._events[i])
+
+    def test_connections(self):
+        '''
+        Test that several connections are served by the reactor thread and
+        that each handler receives its data followed by end-of-file.
+
+        '''
+
+        clients = [self._connect() for i in range(8)]
+        for i, client in enumerate(clients):
+            client.sendall(('client %d' % (i,)).encode('UTF-8'))
+        for i, client in enumerate(clients):
+            self.assertEqual(
+                'client %d' % (i,), b''.join(self._wait(i, 1)).decode('UTF-8'))
+        for client in clients:
+            client.close()
+        for i in range(len(clients)):
+            self.assertEqual(None, self._wait(i, 2)[-1])
+
+    def test_stop(self):
+        '''Test that stopping the reactor feeds end-of-file to each handler.'''
+
+        client = self._connect()
+        client.sendall(b'data')
+        self._wait(0, 1)
+        self._reactor.stop()
+        self._thread.join(5.0)
+        self.assertEqual([b'data', None], self._wait(0, 2))
+        client.close()
+
+    def test_threads(self):
+        '''Test that the number of threads does not grow with the number of
+        clients.'''
+
+        threads = threading.active_count()
+        counts = []
+        original = _RecordingHandler.feed
+        def feed(handler, data):
+            counts.append(threading.active_count())
+            original(handler, data)
+        _RecordingHandler.feed = feed
+        try:
+            clients = [self._connect() for i in range(64)]
+            for round_ in range(4):
+                for i, client in enumerate(clients):
+                    client.sendall(b'x')
+                for i, client in enumerate(clients):
+                    self._wait(i, round_ + 1)
+                    self.assertEqual(b'x', client.recv(1))
+        finally:
+            _RecordingHandler.feed = original
+        self.assertEqual(threads, max(counts))
+        for client in clients:
+            client.close()
+        for i in range(len(clients)):
+            self.assertEqual(None, self._wait(i, 5)[-1])
+        self.assertEqual(threads, threading.active_count())
+
+    def test_slow(self):
+        '''Test that a handler that blocks holds only one worker and does not
+        hold up the other connections.'''
+
+        blocked = threading.Event()
+        original = _RecordingHandler.feed
+        def feed(handler, data):
+            if b'block' == data:
+                blocked.wait(5.0)
+            original(handler, data)
+        _RecordingHandler.feed = feed
+        try:
+            # NOTE: the executor has two workers, so one blocked client
+            # leaves one for the others.
+            clients = [self._connect() for i in range(1)]
+            for client in clients:
+                client.sendall(b'block')
+            # NOTE: wait for the reactor to accept the blocked connections
+            # before the last one so that its events are recorded last.
+            for i in range(50):
+                if len(self._accepted) >= len(clients):
+                    break
+                else:
+                    time.sleep(0.1)
+            client = self._connect()
+            client.sendall(b'ping')
+            self.assertEqual(b'ping', client.recv(4))
+            client.close()
+        finally:
+            blocked.set()
+            _RecordingHandler.feed = original
+        for client in clients:
+            client.close()
+
+    def test_output(self):
+        '''Test that the reactor writes a handler's queued output.'''
+
+        client = self._connect()
+        client.sendall(b'ping')
+        self.assertEqual(b'ping', client.recv(4))
+        client.close()
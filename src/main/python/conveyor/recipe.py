@@ -179,7 +179,7 @@ class Recipe(object):
                     task.fail(failure)
         else:
             raise ValueError(self._job.slicer_name)
-        task = conveyor.task.Task()
+        task = conveyor.task.Task(name='slice')
         task.runningevent.attach(running_callback)
         return task
 
@@ -203,7 +203,7 @@ class Recipe(object):
                 task.fail(failure)
             else:
                 task.end(None)
-        task = conveyor.task.Task()
+        task = conveyor.task.Task(name='gcodeprocessor')
         task.runningevent.attach(runningcallback)
         return task
 
@@ -227,7 +227,7 @@ class Recipe(object):
                 task.fail(failure)
             else:
                 task.end(None)
-        task = conveyor.task.Task()
+        task = conveyor.task.Task(name='dualstrusion')
         task.runningevent.attach(runningcallback)
         return task
 
@@ -242,7 +242,7 @@ class Recipe(object):
                 task.fail(failure)
             else:
                 task.end(None)
-        task = conveyor.task.Task()
+        task = conveyor.task.Task(name='postweave')
         task.runningevent.attach(runningcallback)
         return task
 
@@ -254,7 +254,7 @@ class Recipe(object):
                 self._job.slicer_settings.extruder_temperature,
                 self._job.slicer_settings.platform_temperature,
                 self._job.material_name, self._job.name, task,)
-        task = conveyor.task.Task()
+        task = conveyor.task.Task(name='print')
         task.runningevent.attach(runningcallback)
         return task
 
@@ -273,17 +273,30 @@ class Recipe(object):
                 self._log.exception('unhandled exception; failed to queue print-to-file')
                 failure = conveyor.util.exception_to_failure(e)
                 task.fail(failure)
-        task = conveyor.task.Task()
+        task = conveyor.task.Task(name='printtofile')
         task.runningevent.attach(runningcallback)
         return task
 
+    def _print_to_file_tasks(self, input_file):
+        if None is self._job.output_stream:
+            tasks = [
+                self._print_to_filetask(input_file, self._job.output_file),
+                self.verifys3gtask(self._job.output_file),
+            ]
+        else:
+            # NOTE: streamed output is not kept by the service, so it cannot
+            # be read back and verified here.
+            tasks = [
+                self._print_to_filetask(input_file, self._job.output_stream)]
+        return tasks
+
     @staticmethod
     def verifys3gtask(s3gpath):
         """
         This function is static so it can be accessed by server/__init__.py when 
         executing the verifys3g command.
         """
-        task = conveyor.task.Task()
+        task = conveyor.task.Task(name='verifys3g')
 
         def update(percent):
             percent = min(percent, 100)
@@ -311,7 +324,7 @@ class Recipe(object):
         return task
 
     def verifygcodetask(self, gcodepath, profile, slicer_settings, material_name, dualstrusion):
-        task = conveyor.task.Task()
+        task = conveyor.task.Task(name='verifygcode')
         def update(percent):
             percent = min(percent, 100) 
             progress = {
@@ -375,7 +388,7 @@ class Recipe(object):
                 task.fail(failure)
             else:
                 task.end(None)
-        task = conveyor.task.Task()
+        task = conveyor.task.Task(name='startend')
         task.runningevent.attach(running_callback)
         return task
 
@@ -437,10 +450,7 @@ class _GcodeRecipe(Recipe):
         tasks.append(verifytask)
 
         # Print
-        print_to_filetask = self._print_to_filetask(start_end_path, self._job.output_file)
-        tasks.append(print_to_filetask)
-
-        tasks.append(self.verifys3gtask(self._job.output_file))
+        tasks.extend(self._print_to_file_tasks(start_end_path))
 
         def process_endcallback(task):
             os.unlink(start_end_path)
@@ -538,10 +548,7 @@ class _StlRecipe(Recipe):
         tasks.append(verifytask)
 
         # Print
-        print_to_filetask = self._print_to_filetask(start_end_path, self._job.output_file)
-        tasks.append(print_to_filetask)
-
-        tasks.append(self.verifys3gtask(self._job.output_file))
+        tasks.extend(self._print_to_file_tasks(start_end_path))
 
         def process_endcallback(task):
             os.unlink(gcodepath)
@@ -638,13 +645,14 @@ class _DualThingRecipe(_ThingRecipe):
         settings_0.extruder = '0'
         slice_0_task = self._slicertask(
             self._job.profile, self._stl_0_path, gcode_0_path, False, True, settings_0)
-        tasks.append(slice_0_task)
 
         settings_1 = conveyor.domain.SlicerConfiguration.fromdict(self._job.slicer_settings.todict())
         settings_1.extruder = '1'
         slice_1_task = self._slicertask(
             self._job.profile, self._stl_1_path, gcode_1_path, False, True, settings_1)
-        tasks.append(slice_1_task)
+        # NOTE: the two slices are independent, so they run at the same time.
+        tasks.append(conveyor.process.taskparallel(
+            [slice_0_task, slice_1_task], self._job, 'dualslice'))
 
         #Combine for dualstrusion
         with tempfile.NamedTemporaryFile(suffix='.gcode', delete=True) as f:
@@ -683,10 +691,7 @@ class _DualThingRecipe(_ThingRecipe):
         tasks.append(verifytask)
 
         # Print To File
-        print_to_filetask = self._print_to_filetask(start_end_path, self._job.output_file)
-        tasks.append(print_to_filetask)
-
-        tasks.append(self.verifys3gtask(self._job.output_file))
+        tasks.extend(self._print_to_file_tasks(start_end_path))
 
         process = conveyor.process.tasksequence(self._job, tasks)
         def process_endcallback(task):
@@ -709,14 +714,15 @@ class _DualThingRecipe(_ThingRecipe):
         slice_0_task = self._slicertask(
             self._job.profile, self._stl_0_path, gcode_0_path, False, True,
             settings_0)
-        tasks.append(slice_0_task)
 
         settings_1 = conveyor.domain.SlicerConfiguration.fromdict(self._job.slicer_settings.todict())
         settings_1.extruder = '1'
         slice_1_task = self._slicertask(
             self._job.profile, self._stl_1_path, gcode_1_path, False, True,
             settings_1)
-        tasks.append(slice_1_task)
+        # NOTE: the two slices are independent, so they run at the same time.
+        tasks.append(conveyor.process.taskparallel(
+            [slice_0_task, slice_1_task], self._job, 'dualslice'))
 
         #Combine for dualstrusion
         with tempfile.NamedTemporaryFile(suffix='.gcode') as f:
@@ -766,14 +772,15 @@ class _DualThingRecipe(_ThingRecipe):
         slice_0_task = self._slicertask(
             profile, self._stl_0_path, gcode_0_path, False, True,
             settings_0)
-        tasks.append(slice_0_task)
 
         settings_1 = conveyor.domain.SlicerConfiguration.fromdict(self._job.slicer_settings.todict())
         settings_1.extruder = '1'
         slice_1_task = self._slicertask(
             profile, self._stl_1_path, gcode_1_path, False, True,
             settings_1)
-        tasks.append(slice_1_task)
+        # NOTE: the two slices are independent, so they run at the same time.
+        tasks.append(conveyor.process.taskparallel(
+            [slice_0_task, slice_1_task], self._job, 'dualslice'))
 
         #Combine for dualstrusion
         with tempfile.NamedTemporaryFile(suffix='.gcode') as f:
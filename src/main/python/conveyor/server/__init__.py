@@ -19,20 +19,40 @@
 
 from __future__ import (absolute_import, print_function, unicode_literals)
 
+import StringIO
+import base64
 import collections
+import json
 import logging
+import os
 import os.path
 import threading
 
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
 import conveyor.connection
+import conveyor.delta
+import conveyor.event
+import conveyor.executor
+import conveyor.fdpass
 import conveyor.job
+import conveyor.json
 import conveyor.jsonrpc
 import conveyor.log
+import conveyor.machine
+import conveyor.reactor
+import conveyor.server.subscription
 import conveyor.recipe
 import conveyor.slicer
 import conveyor.slicer.miraclegrue
 import conveyor.slicer.skeinforge
+import conveyor.statusboard
 import conveyor.stoppable
+import conveyor.stream
+import conveyor.task
 import conveyor.util
 
 from conveyor.decorator import jsonrpc
@@ -54,6 +74,7 @@ class Server(conveyor.stoppable.StoppableInterface):
         self._log = conveyor.log.getlogger(self)
         self._clients = set()
         self._clients_condition = threading.Condition()
+        self._client_id_counter = 0
         self._queue = collections.deque()
         self._queue_condition = threading.Condition()
         self._job_id_counter = 0
@@ -61,32 +82,131 @@ class Server(conveyor.stoppable.StoppableInterface):
         self._jobs_condition = threading.Condition()
         self._print_queued = set()
         self._print_queued_condition = threading.Condition()
+        self._connect_locks = {} # of machine name -> threading.Lock
+        self._connect_locks_condition = threading.Condition()
+        # NOTE: the lock only covers the store. The new version of an object
+        # is broadcast after it is released so that a client that is slow to
+        # take its messages cannot hold up the others. The versions of an
+        # object still reach every client in order because the events of a
+        # job or a machine are delivered one at a time, in order, by the lane
+        # of their key.
+        self._versions = conveyor.delta.VersionedStore()
+        self._versions_condition = threading.Condition()
+        # NOTE: the serialized status snapshot and the version of the store
+        # it was built at. See `get_status_snapshot`.
+        self._status = None
+        self._status_version = None
+        self._status_condition = threading.Condition()
+        self._subscriptions = conveyor.server.subscription.SubscriptionIndex()
+        status_board_file = self._config.get('server', 'status_board_file')
+        self._status_board = None
+        if 0 != len(status_board_file):
+            try:
+                self._status_board = conveyor.statusboard.StatusBoard(
+                    status_board_file,
+                    self._config.get('server', 'status_board_slots'),
+                    self._log)
+            except (IOError, OSError):
+                self._log.warning(
+                    'failed to create the status board', exc_info=True)
+        slow_event_handler_seconds = self._config.get(
+            'server', 'slow_event_handler_seconds')
+        if 0 < slow_event_handler_seconds:
+            conveyor.event.geteventqueue().setslowhandlerbudget(
+                slow_event_handler_seconds)
         self._port_manager.port_attached.attach(self._port_attached)
         self._port_manager.port_detached.attach(self._port_detached)
+        jsonrpc_threads = self._config.get('server', 'jsonrpc_threads')
+        if 0 == jsonrpc_threads:
+            self._executor = None
+        else:
+            self._executor = conveyor.executor.Executor(
+                'jsonrpc', jsonrpc_threads, 16 * jsonrpc_threads)
+        connection_threads = self._config.get('server', 'connection_threads')
+        if 0 == connection_threads or 'nt' == os.name:
+            self._connection_executor = None
+            self._reactor = None
+        else:
+            # NOTE: each connection has at most two work items queued, its
+            # input and its end-of-file.
+            self._connection_executor = conveyor.executor.Executor(
+                'connection', connection_threads, 1024)
+            self._reactor = conveyor.reactor.Reactor(
+                self._listener, self._connection_executor, self._accept)
 
     def stop(self):
         self._stop = True
+        if None is not self._executor:
+            self._executor.stop()
+        if None is not self._reactor:
+            self._reactor.stop()
+            self._connection_executor.stop()
         with self._queue_condition:
             self._queue_condition.notify_all()
 
     def run(self):
-        work_thread = threading.Thread(target=self._work_queue_target)
-        work_thread.start()
+        work_threads = []
+        for i in range(max(1, self._config.get('server', 'work_threads'))):
+            work_thread = threading.Thread(target=self._work_queue_target)
+            work_thread.start()
+            work_threads.append(work_thread)
+        if None is not self._executor:
+            self._executor.start()
         try:
-            while not self._stop:
-                connection = self._listener.accept()
-                if None is not connection:
-                    jsonrpc = conveyor.jsonrpc.JsonRpc(connection, connection)
-                    client = _Client(self._config, self, jsonrpc)
-                    client.start()
+            if None is not self._reactor:
+                self._connection_executor.start()
+                self._reactor.run()
+            else:
+                while not self._stop:
+                    connection = self._listener.accept()
+                    if None is not connection:
+                        jsonrpc = self._create_jsonrpc(connection)
+                        client = _Client(
+                            self._config, self, jsonrpc, connection)
+                        client.start()
         finally:
-            work_thread.join(1)
+            for work_thread in work_threads:
+                work_thread.join(1)
+            if None is not self._status_board:
+                self._status_board.close()
         return 0
 
+    def _create_jsonrpc(self, connection):
+        jsonrpc = conveyor.jsonrpc.JsonRpc(
+            connection, connection, self._executor)
+        limit = self._config.get('server', 'outbound_queue_bytes')
+        overflow = self._config.get('server', 'outbound_queue_overflow')
+        jsonrpc.setoutputlimit(limit, overflow)
+        jsonrpc.setmaxframelength(
+            self._config.get('server', 'max_message_bytes'))
+        interval = self._config.get('server', 'notification_interval')
+        if 0 != interval:
+            jsonrpc.setnotificationinterval(interval)
+        request_rates = self._config.get('server', 'request_rates')
+        for rate_class, limit in request_rates.items():
+            if 0 != limit['rate']:
+                jsonrpc.setratelimit(rate_class, limit['rate'], limit['burst'])
+        return jsonrpc
+
+    def _accept(self, connection, outputcallback):
+        '''
+        Create a client for a connection accepted by the reactor. The client is
+        the connection's handler and is fed on the connection's serial queue,
+        which runs on the connection executor, instead of running its own
+        thread. Its output is written by the reactor.
+
+        '''
+
+        jsonrpc = self._create_jsonrpc(connection)
+        jsonrpc.setoutputcallback(outputcallback)
+        client = _Client(self._config, self, jsonrpc, connection)
+        client.open()
+        return client
+
     def queue_work(self, work):
         with self._queue_condition:
             self._queue.appendleft(work)
-            self._queue_condition.notify_all()
+            self._queue_condition.notify()
 
     def _work_queue_target(self):
         while not self._stop:
@@ -103,34 +223,60 @@ class Server(conveyor.stoppable.StoppableInterface):
             conveyor.error.guard(self._log, func)
 
     def _port_attached(self, port):
-        with self._clients_condition:
-            clients = self._clients.copy()
         port_info = port.get_info()
-        _Client.port_attached(clients, port_info)
+        with self._versions_condition:
+            self._versions.update(('port', port_info.name), port_info.to_dict())
+        clients = self._subscriptions.get('port_attached')
+        if 0 != len(clients):
+            _Client.port_attached(clients, port_info)
 
     def _port_detached(self, port_name):
-        with self._clients_condition:
-            clients = self._clients.copy()
-        _Client.port_detached(clients, port_name)
+        with self._versions_condition:
+            self._versions.remove(('port', port_name))
+        clients = self._subscriptions.get('port_detached')
+        if 0 != len(clients):
+            _Client.port_detached(clients, port_name)
+
+    def _machine_added(self, machine):
+        if None is not self._status_board:
+            machine.set_status_board(self._status_board)
+        machine.state_changed.attach(self._machine_state_changed)
+        machine.temperature_changed.attach(self._machine_temperature_changed)
+        machine_info = machine.get_info()
+        with self._versions_condition:
+            self._versions.update(
+                ('machine', machine_info.name), machine_info.to_dict())
 
     def _machine_connected(self, machine):
         pass # TODO
 
     def _machine_state_changed(self, machine):
-        with self._clients_condition:
-            clients = self._clients.copy()
         machine_info = machine.get_info()
-        _Client.machine_state_changed(clients, machine_info)
+        with self._versions_condition:
+            version, changes = self._versions.update(
+                ('machine', machine_info.name), machine_info.to_dict())
+        clients = self._subscriptions.get(
+            'machine_state_changed', machine_name=machine_info.name)
+        _Client.machine_state_changed(clients, machine_info, version, changes)
 
     def _machine_temperature_changed(self, machine):
-        with self._clients_condition:
-            clients = self._clients.copy()
         machine_info = machine.get_info()
-        _Client.machine_temperature_changed(clients, machine_info)
+        with self._versions_condition:
+            version, changes = self._versions.update(
+                ('machine', machine_info.name), machine_info.to_dict())
+        clients = self._subscriptions.get(
+            'machine_temperature_changed', machine_name=machine_info.name)
+        _Client.machine_temperature_changed(
+            clients, machine_info, version, changes)
 
     def _add_client(self, client):
         with self._clients_condition:
+            client.id = self._client_id_counter
+            self._client_id_counter += 1
             self._clients.add(client)
+        # NOTE: clients receive every notification until they change their
+        # subscriptions.
+        self._subscriptions.subscribe(client, None, None, None)
 
     def _get_clients(self):
         with self._clients_condition:
@@ -140,20 +286,111 @@ class Server(conveyor.stoppable.StoppableInterface):
     def _remove_client(self, client):
         with self._clients_condition:
             self._clients.remove(client)
+        self._subscriptions.remove(client)
+        client.abort_output_streams()
+
+    def subscribe(self, client, events, machine_names, job_ids):
+        self._subscriptions.subscribe(client, events, machine_names, job_ids)
+        subscriptions = self._subscriptions.getsubscriptions(client)
+        return subscriptions
+
+    def unsubscribe(self, client, events, machine_names, job_ids):
+        self._subscriptions.unsubscribe(
+            client, events, machine_names, job_ids)
+        subscriptions = self._subscriptions.getsubscriptions(client)
+        return subscriptions
 
     def _add_job(self, job):
         with self._jobs_condition:
             self._jobs[job.id] = job
-        with self._clients_condition:
-            clients = self._clients.copy()
         job_info = job.get_info()
-        _Client.job_added(clients, job_info)
+        with self._versions_condition:
+            version, changes = self._versions.update(
+                ('job', job_info.id), job_info.to_dict())
+        clients = self._subscriptions.get(
+            'jobadded', machine_name=job_info.machine_name, job_id=job_info.id)
+        if 0 != len(clients):
+            _Client.job_added(clients, job_info, version)
 
     def _job_changed(self, job):
         job_info = job.get_info()
-        with self._clients_condition:
-            clients = self._clients.copy()
-        _Client.job_changed(clients, job_info)
+        with self._versions_condition:
+            version, changes = self._versions.update(
+                ('job', job_info.id), job_info.to_dict())
+        clients = self._subscriptions.get(
+            'jobchanged', machine_name=job_info.machine_name,
+            job_id=job_info.id)
+        _Client.job_changed(clients, job_info, version, changes)
+
+    def get_snapshots(self, job_ids, machine_names):
+        '''
+        Return the latest versioned snapshot of each job and machine. A client
+        that missed a delta notification uses them to resync.
+
+        '''
+
+        if None is job_ids:
+            with self._jobs_condition:
+                job_ids = list(self._jobs.keys())
+        machine_infos = {}
+        for machine in self._machine_manager.get_machines():
+            if None is machine_names or machine.name in machine_names:
+                machine_infos[machine.name] = machine.get_info()
+        jobs = []
+        machines = []
+        with self._versions_condition:
+            for job_id in job_ids:
+                version, snapshot = self._versions.get(('job', job_id))
+                if None is not snapshot:
+                    jobs.append(dict(snapshot, version=version))
+            for machine_name, machine_info in machine_infos.items():
+                key = 'machine', machine_name
+                version, snapshot = self._versions.get(key)
+                if None is snapshot:
+                    # NOTE: the machine has not changed since it was
+                    # connected, so no client holds a version of it yet.
+                    snapshot = machine_info.to_dict()
+                    version, changes = self._versions.update(key, snapshot)
+                machines.append(dict(snapshot, version=version))
+        result = {'jobs': jobs, 'machines': machines}
+        return result
+
+    def get_status_snapshot(self, since_version):
+        '''
+        Return the ports, machines and jobs along with the version of the
+        store, as a `conveyor.jsonrpc.Serialized` result. The snapshot is
+        serialized once for each version and shared by every client. When the
+        version is still `since_version` only the version is returned.
+
+        '''
+
+        with self._versions_condition:
+            version = self._versions.version
+        if since_version == version:
+            result = {'version': version, 'modified': False}
+        else:
+            with self._status_condition:
+                # NOTE: the objects are read after the version, so the
+                # snapshot is at least as new as the version it is cached at.
+                # A change made while it is built bumps the version and the
+                # next call builds it again.
+                if version != self._status_version:
+                    status = {
+                        'version': version,
+                        'modified': True,
+                        'ports': [
+                            port.get_info().to_dict()
+                            for port in self.get_ports()],
+                        'machines': self.get_printers(),
+                        'jobs': [
+                            job.get_info().to_dict()
+                            for job in self.get_jobs(None).values()],
+                    }
+                    self._status = conveyor.jsonrpc.Serialized(
+                        conveyor.json.dumps(status))
+                    self._status_version = version
+                result = self._status
+        return result
 
     def _find_port_by_port_name(self, port_name):
         if None is not port_name:
@@ -222,9 +459,7 @@ class Server(conveyor.stoppable.StoppableInterface):
                 profile = self._find_profile(port, driver, profile_name)
                 machine = self._machine_manager.new_machine(
                     port, driver, profile)
-                machine.state_changed.attach(self._machine_state_changed)
-                machine.temperature_changed.attach(
-                    self._machine_temperature_changed)
+                self._machine_added(machine)
             else:
                 if None is port_name:
                     port = self._find_port_by_machine_name(machine_name)
@@ -258,9 +493,7 @@ class Server(conveyor.stoppable.StoppableInterface):
                 except conveyor.error.UnknownMachineError:
                     machine = self._machine_manager.new_machine(
                         port, driver, profile)
-                    machine.state_changed.attach(self._machine_state_changed)
-                    machine.temperature_changed.attach(
-                        self._machine_temperature_changed)
+                    self._machine_added(machine)
                 else:
                     machine.set_port(port)
                     port.set_machine(machine)
@@ -292,17 +525,58 @@ class Server(conveyor.stoppable.StoppableInterface):
         machines = self._machine_manager.get_machines()
         return machines
 
+    def get_printers(self):
+        result = []
+        for machine in self.get_machines():
+            dct = machine.get_info().to_dict()
+            result.append(dct)
+        # TODO: this is horrible... it is coupled to the s3g driver.
+        for driver in self._driver_manager.get_drivers():
+            for profile in driver.get_profiles(None):
+                info = conveyor.machine.MachineInfo(
+                    profile._s3g_profile.values['type'], None, driver.name,
+                    profile.name, conveyor.machine.MachineState.DISCONNECTED)
+                info.display_name = profile._s3g_profile.values['type']
+                info.unique_name = profile._s3g_profile.values['type']
+                info.printer_type = profile._s3g_profile.values['type']
+                info.machine_names = profile._s3g_profile.values['machinenames']
+                info.can_print = False
+                info.can_print_to_file = True
+                info.has_heated_platform = (0 != len(profile._s3g_profile.values['heated_platforms']))
+                info.number_of_toolheads = len(profile._s3g_profile.values['tools'])
+                axes = profile._s3g_profile.values['axes']
+                info.build_volume = [axes['X']['platform_length'],
+                                     axes['Y']['platform_length'],
+                                     axes['Z']['platform_length']]
+                info.temperature = {'tools': {}, 'heated_platforms': {},}
+                info.firmware_version = None
+                dct = info.to_dict()
+                result.append(dct)
+        return result
+
     def connect(
             self, client, machine_name, port_name, driver_name, profile_name,
             persistent):
         machine = self._find_machine(
             machine_name, port_name, driver_name, profile_name)
-        if conveyor.machine.MachineState.DISCONNECTED == machine.get_state():
-            machine.connect()
-            self._machine_connected(machine)
+        # NOTE: `connect` requests run concurrently. The lock keeps two of
+        # them from probing the same machine at once.
+        with self._get_connect_lock(machine):
+            state = machine.get_state()
+            if conveyor.machine.MachineState.DISCONNECTED == state:
+                machine.connect()
+                self._machine_connected(machine)
         self._connection_manager.acquire_machine(client, machine, persistent)
         return machine
 
+    def _get_connect_lock(self, machine):
+        with self._connect_locks_condition:
+            lock = self._connect_locks.get(machine.name)
+            if None is lock:
+                lock = threading.Lock()
+                self._connect_locks[machine.name] = lock
+        return lock
+
     def disconnect(self, machine_name):
         machine = self._find_machine(machine_name, None, None, None)
         machine.disconnect()
@@ -310,13 +584,14 @@ class Server(conveyor.stoppable.StoppableInterface):
     def print(
             self, machine_name, input_file, extruder_name,
             gcode_processor_name, has_start_end, material_name, slicer_name,
-            slicer_settings):
+            slicer_settings, files=()):
         job_id = self._create_job_id()
         job_name = self._get_job_name(input_file)
         machine = self._find_machine(machine_name, None, None, None)
-        if self._is_print_queued(machine) or not machine.is_idle():
-            raise conveyor.error.PrintQueuedException
-        else:
+        # NOTE: `print` requests run concurrently, so the machine is claimed
+        # here instead of when the job starts.
+        self._claim_print_queued(machine)
+        try:
             job = conveyor.job.PrintJob(
                 job_id, job_name, machine, input_file, extruder_name,
                 gcode_processor_name, has_start_end, material_name, slicer_name,
@@ -325,10 +600,14 @@ class Server(conveyor.stoppable.StoppableInterface):
                 self._config, self, self._spool)
             recipe = recipe_manager.get_recipe(job)
             job.task = recipe.print()
-            self._attach_job_callbacks(job)
-            self._attach_print_queued_callbacks(machine, job)
-            job.task.start()
-            return job
+        except:
+            self._remove_print_queued(machine)
+            raise
+        self._attach_job_callbacks(job)
+        self._attach_print_queued_callbacks(machine, job)
+        self._attach_file_callbacks(job, files)
+        job.task.start()
+        return job
 
     def pause(self, machine_name):
         machine = self._find_machine(machine_name, None, None, None)
@@ -341,7 +620,8 @@ class Server(conveyor.stoppable.StoppableInterface):
     def print_to_file(
             self, driver_name, profile_name, input_file, output_file,
             extruder_name, file_type, gcode_processor_name, has_start_end,
-            material_name, slicer_name, slicer_settings):
+            material_name, slicer_name, slicer_settings, files=(),
+            output_stream=None):
         job_id = self._create_job_id()
         job_name = self._get_job_name(output_file)
         driver = self._driver_manager.get_driver(driver_name)
@@ -350,18 +630,26 @@ class Server(conveyor.stoppable.StoppableInterface):
             job_id, job_name, driver, profile, input_file, output_file,
             extruder_name, file_type, gcode_processor_name, has_start_end,
             material_name, slicer_name, slicer_settings)
+        if None is not output_stream:
+            output_stream.job_id = job_id
+            job.output_stream = output_stream
         recipe_manager = conveyor.recipe.RecipeManager(
             self._config, self, self._spool)
         recipe = recipe_manager.get_recipe(job)
         job.task = recipe.print_to_file()
         self._attach_job_callbacks(job)
+        self._attach_file_callbacks(job, files)
+        if None is not output_stream:
+            def stopped_callback(task):
+                output_stream.abort()
+            job.task.stoppedevent.attach(stopped_callback)
         job.task.start()
         return job
 
     def slice(
             self, driver_name, profile_name, input_file, output_file,
             add_start_end, extruder_name, gcode_processor_name, material_name,
-            slicer_name, slicer_settings):
+            slicer_name, slicer_settings, files=()):
         job_id = self._create_job_id()
         job_name = self._get_job_name(output_file)
         driver = self._driver_manager.get_driver(driver_name)
@@ -375,9 +663,19 @@ class Server(conveyor.stoppable.StoppableInterface):
         recipe = recipe_manager.get_recipe(job)
         job.task = recipe.slice()
         self._attach_job_callbacks(job)
+        self._attach_file_callbacks(job, files)
         job.task.start()
         return job
 
+    def get_connections(self):
+        connections = []
+        for client in self._get_clients():
+            dct = client.get_output_stats()
+            dct.update(client.get_request_stats())
+            dct['id'] = client.id
+            connections.append(dct)
+        return connections
+
     def get_jobs(self, client):
         with self._jobs_condition:
             jobs = self._jobs.copy()
@@ -411,38 +709,57 @@ class Server(conveyor.stoppable.StoppableInterface):
     def _attach_job_callbacks(self, job):
         def start_callback(task):
             self._add_job(job)
+            self._publish_job(job)
             job.log_job_started(self._log)
         job.task.startevent.attach(start_callback)
         def heartbeat_callback(task):
             self._job_changed(job)
+            self._publish_job(job)
             job.log_job_heartbeat(self._log)
         job.task.heartbeatevent.attach(heartbeat_callback)
         def stopped_callback(task):
             self._job_changed(job)
+            self._publish_job(job)
             job.log_job_stopped(self._log)
+            job.log_job_stages(self._log)
         job.task.stoppedevent.attach(stopped_callback)
 
+    def _publish_job(self, job):
+        # NOTE: only jobs that run on a machine have a place on the status
+        # board.
+        if None is not self._status_board:
+            job_info = job.get_info()
+            if None is not job_info.machine_name:
+                progress = job_info.progress
+                if None is not progress:
+                    progress = progress.get('progress')
+                self._status_board.publish_job(
+                    job_info.machine_name, job_info.id, job_info.name,
+                    job_info.state, progress)
+
+    def _attach_file_callbacks(self, job, files):
+        if 0 != len(files):
+            def stopped_callback(task):
+                for file_ in files:
+                    conveyor.error.guard(self._log, file_.close)
+            job.task.stoppedevent.attach(stopped_callback)
+
     def _attach_print_queued_callbacks(self, machine, job):
-        def start_callback(task):
-            self._add_print_queued(machine)
-        job.task.startevent.attach(start_callback)
         def stopped_callback(task):
             self._remove_print_queued(machine)
         job.task.stoppedevent.attach(stopped_callback)
 
-    def _add_print_queued(self, machine):
+    def _claim_print_queued(self, machine):
         with self._print_queued_condition:
-            self._print_queued.add(machine.name)
+            if machine.name in self._print_queued or not machine.is_idle():
+                raise conveyor.error.PrintQueuedException
+            else:
+                self._print_queued.add(machine.name)
 
     def _remove_print_queued(self, machine):
         with self._print_queued_condition:
             self._print_queued.remove(machine.name)
 
-    def _is_print_queued(self, machine):
-        with self._print_queued_condition:
-            result = machine.name in self._print_queued
-        return result
-
     ## old stuff ##############################################################
 
     def get_uploadable_machines(self, driver_name):
@@ -497,6 +814,23 @@ class Server(conveyor.stoppable.StoppableInterface):
         return task
 
 
+def _merge_delta(older, newer):
+    '''
+    Merge two delta notifications for the same object into one that applies
+    to the base version of the older.
+
+    '''
+
+    changes = dict(older.params['changes'])
+    changes.update(newer.params['changes'])
+    params = dict(newer.params, changes=changes)
+    params['base_version'] = older.params.get(
+        'base_version', older.params['version'] - 1)
+    notification = conveyor.jsonrpc.Notification(
+        newer.method, params, newer.key, newer.terminal, newer.merge)
+    return notification
+
+
 class _Client(conveyor.stoppable.StoppableThread):
     '''
     This is the `Server`'s notion of a client. One `_Client` is allocated for
@@ -504,72 +838,179 @@ class _Client(conveyor.stoppable.StoppableThread):
 
     '''
 
-    def __init__(self, config, server, jsonrpc):
+    def __init__(self, config, server, jsonrpc, connection):
         conveyor.stoppable.StoppableThread.__init__(self)
         self._config = config
         self._server = server
         self._jsonrpc = jsonrpc
+        self._connection = connection
         self._log = conveyor.log.getlogger(self)
+        self._output_streams = set()
+        self._output_streams_condition = threading.Condition()
+        self.id = None
+        self.delta = False
 
     def stop(self):
         self._jsonrpc.stop()
 
     def run(self):
         def func():
-            conveyor.jsonrpc.install(self._jsonrpc, self)
-            self._server._add_client(self)
+            self.open()
             try:
                 self._jsonrpc.run()
             finally:
                 self._server._remove_client(self)
         conveyor.error.guard(self._log, func)
 
+    def open(self):
+        conveyor.jsonrpc.install(self._jsonrpc, self)
+        self._server._add_client(self)
+
+    def feed(self, data):
+        self._jsonrpc.feed(data)
+
+    def feedeof(self):
+        try:
+            self._jsonrpc.feedeof()
+        finally:
+            self._server._remove_client(self)
+
+    def writeoutput(self):
+        return self._jsonrpc.writeoutput()
+
+    def get_output_stats(self):
+        return self._jsonrpc.getoutputstats()
+
+    def get_request_stats(self):
+        return self._jsonrpc.getrequeststats()
+
+    def abort_output_streams(self):
+        with self._output_streams_condition:
+            output_streams = list(self._output_streams)
+            self._output_streams.clear()
+        for output_stream in output_streams:
+            output_stream.abort()
+
+    def _send_output(self, output_stream, sequence, data, eof):
+        params = {
+            'id': output_stream.job_id,
+            'sequence': sequence,
+            'data': base64.b64encode(data),
+            'eof': eof,
+        }
+        self._jsonrpc.notify('job_output', params)
+        if eof:
+            with self._output_streams_condition:
+                self._output_streams.discard(output_stream)
+
     @staticmethod
     def port_attached(clients, port_info):
         params = port_info.to_dict()
+        notification = conveyor.jsonrpc.Notification('port_attached', params)
         for client in clients:
-            client._jsonrpc.notify('port_attached', params)
+            client._jsonrpc.sendnotification(notification)
 
     @staticmethod
     def port_detached(clients, port_name):
         params = {'port_name': port_name}
+        notification = conveyor.jsonrpc.Notification('port_detached', params)
         for client in clients:
-            client._jsonrpc.notify('port_detached', params)
+            client._jsonrpc.sendnotification(notification)
 
     @staticmethod
-    def machine_state_changed(clients, machine_info):
-        params = machine_info.to_dict()
+    def _send_versioned(
+            clients, method, key, snapshot, version, delta, changes):
+        '''
+        Send the complete snapshot to the clients that did not ask for delta
+        notifications and the `delta` params to those that did. Each is only
+        serialized if some client needs it.
+
+        A change of state is terminal and is sent at once. Other changes, like
+        progress and temperature, may be coalesced by a client's connection.
+
+        '''
+
+        terminal = 'state' in changes
+        full_notification = None
+        delta_notification = None
         for client in clients:
-            client._jsonrpc.notify('machine_state_changed', params)
+            if client.delta:
+                if None is delta_notification:
+                    delta_notification = conveyor.jsonrpc.Notification(
+                        method, delta, key, terminal, _merge_delta)
+                notification = delta_notification
+            else:
+                if None is full_notification:
+                    params = dict(snapshot, version=version)
+                    full_notification = conveyor.jsonrpc.Notification(
+                        method, params, key, terminal)
+                notification = full_notification
+            client._jsonrpc.sendnotification(notification)
+
+    # NOTE: the state and temperature notifications of a machine both carry
+    # a version of the same object, so they are coalesced under one key. A
+    # temperature notification that is still pending when the state changes is
+    # merged into the state notification instead of being sent after it with
+    # the older version.
 
     @staticmethod
-    def machine_temperature_changed(clients, machine_info):
-        params = machine_info.to_dict()
-        for client in clients:
-            client._jsonrpc.notify('machine_temperature_changed', params)
+    def machine_state_changed(clients, machine_info, version, changes):
+        key = ('machine', machine_info.name)
+        delta = {
+            'name': machine_info.name, 'version': version, 'changes': changes}
+        _Client._send_versioned(
+            clients, 'machine_state_changed', key, machine_info.to_dict(),
+            version, delta, changes)
 
     @staticmethod
-    def job_added(clients, job_info):
-        params = job_info.to_dict()
-        for client in clients:
-            client._jsonrpc.notify('jobadded', params)
+    def machine_temperature_changed(clients, machine_info, version, changes):
+        key = ('machine', machine_info.name)
+        delta = {
+            'name': machine_info.name, 'version': version, 'changes': changes}
+        _Client._send_versioned(
+            clients, 'machine_temperature_changed', key,
+            machine_info.to_dict(), version, delta, changes)
 
     @staticmethod
-    def job_changed(clients, job_info):
-        params = job_info.to_dict()
+    def job_added(clients, job_info, version):
+        params = dict(job_info.to_dict(), version=version)
+        notification = conveyor.jsonrpc.Notification('jobadded', params)
         for client in clients:
-            client._jsonrpc.notify('jobchanged', params)
+            client._jsonrpc.sendnotification(notification)
+
+    @staticmethod
+    def job_changed(clients, job_info, version, changes):
+        key = ('jobchanged', job_info.id)
+        delta = {'id': job_info.id, 'version': version, 'changes': changes}
+        _Client._send_versioned(
+            clients, 'jobchanged', key, job_info.to_dict(), version, delta,
+            changes)
 
     @jsonrpc()
-    def hello(self):
+    def hello(self, framing=None, compression=None, delta=None):
         '''
         This is the first method any client must invoke after connecting to the
-        conveyor service.
+        conveyor service. A client may pass a list of message framings and a
+        list of compressions it supports, in order of preference, to switch to
+        a cheaper framing or to compress its messages. It may also ask for job
+        and machine notifications that only carry the changed fields.
 
         '''
-        return 'world'
+        if None is framing and None is compression and None is delta:
+            result = 'world'
+        else:
+            result = {'hello': 'world'}
+            if None is not framing:
+                result['framing'] = self._jsonrpc.negotiateframing(framing)
+            if None is not compression:
+                result['compression'] = self._jsonrpc.negotiatecompression(
+                    compression)
+            if None is not delta:
+                self.delta = bool(delta)
+                result['delta'] = self.delta
+        return result
 
-    @jsonrpc()
+    @jsonrpc(rate_class='query')
     def dir(self):
         '''
         Lists the methods available from the conveyor service.
@@ -585,7 +1026,16 @@ class _Client(conveyor.stoppable.StoppableThread):
         result['__version__'] = conveyor.__version__
         return result
 
-    @jsonrpc()
+    @jsonrpc(ordered=False, rate_class='query')
+    def event_stats(self):
+        '''
+        Returns the statistics of the event queue.
+
+        '''
+        result = conveyor.event.geteventqueue().getreport()
+        return result
+
+    @jsonrpc(ordered=False, rate_class='query')
     def getports(self):
         result = []
         for port in self._server.get_ports():
@@ -593,7 +1043,7 @@ class _Client(conveyor.stoppable.StoppableThread):
             result.append(dct)
         return result
 
-    @jsonrpc()
+    @jsonrpc(ordered=False, rate_class='query')
     def get_drivers(self):
         result = []
         for driver in self._server.get_drivers():
@@ -601,13 +1051,13 @@ class _Client(conveyor.stoppable.StoppableThread):
             result.append(dct)
         return result
 
-    @jsonrpc()
+    @jsonrpc(ordered=False, rate_class='query')
     def get_driver(self, driver_name):
         driver = self._server.get_driver(driver_name)
         result = driver.get_info().to_dict()
         return result
 
-    @jsonrpc()
+    @jsonrpc(ordered=False, rate_class='query')
     def get_profiles(self, driver_name):
         result = []
         for profile in self._server.get_profiles(driver_name):
@@ -615,16 +1065,22 @@ class _Client(conveyor.stoppable.StoppableThread):
             result.append(dct)
         return result
 
-    @jsonrpc()
+    @jsonrpc(ordered=False, rate_class='query')
     def get_profile(self, driver_name, profile_name):
         profile = self._server.get_profile(driver_name, profile_name)
         result = profile.get_info().to_dict()
         return result
 
-    @jsonrpc()
+    @jsonrpc(ordered=False)
     def connect(
             self, machine_name, port_name, driver_name, profile_name,
             persistent):
+        '''
+        Connects to a machine. The port is probed on the request's thread, so
+        this runs concurrently with the client's other requests when
+        `jsonrpc_threads` is set.
+
+        '''
         machine = self._server.connect(
             self, machine_name, port_name, driver_name, profile_name,
             persistent)
@@ -636,17 +1092,54 @@ class _Client(conveyor.stoppable.StoppableThread):
         self._server.disconnect(machine_name)
         return None
 
-    @jsonrpc()
+    def _open_descriptor(self, number, name, files, output=False):
+        '''
+        Take a descriptor the client passed with its request and return a path
+        to a copy of its file that has the base name of `name`. The file is
+        added to `files` and is closed when the job stops, which writes an
+        `output` file back to the descriptor.
+
+        '''
+
+        fd = self._connection.takedescriptor(number)
+        try:
+            file_ = conveyor.fdpass.DescriptorFile(fd, name, output)
+        except:
+            os.close(fd)
+            raise
+        files.append(file_)
+        return file_.path
+
+    @staticmethod
+    def _close_descriptors(files):
+        for file_ in files:
+            file_.close()
+
+    @jsonrpc(ordered=False, rate_class='job')
     def print(
             self, machine_name, input_file, extruder_name,
             gcode_processor_name, has_start_end, material_name, slicer_name,
-            slicer_settings):
+            slicer_settings, input_descriptor=None):
+        '''
+        Prints a file on a machine. The recipe is built on the request's
+        thread, so this runs concurrently with the client's other requests
+        when `jsonrpc_threads` is set.
+
+        '''
         slicer_settings = conveyor.domain.SlicerConfiguration.fromdict(
             slicer_settings)
-        job = self._server.print(
-            machine_name, input_file, extruder_name,
-            gcode_processor_name, has_start_end, material_name, slicer_name,
-            slicer_settings)
+        files = []
+        try:
+            if None is not input_descriptor:
+                input_file = self._open_descriptor(
+                    input_descriptor, input_file, files)
+            job = self._server.print(
+                machine_name, input_file, extruder_name,
+                gcode_processor_name, has_start_end, material_name,
+                slicer_name, slicer_settings, files)
+        except:
+            self._close_descriptors(files)
+            raise
         dct = job.get_info().to_dict()
         return dct
 
@@ -660,65 +1153,105 @@ class _Client(conveyor.stoppable.StoppableThread):
         self._server.unpause(machine_name)
         return None
 
-    @jsonrpc()
+    @jsonrpc(ordered=False, rate_class='query')
     def getprinters(self):
-        result = []
-        for machine in self._server.get_machines():
-            dct = machine.get_info().to_dict()
-            result.append(dct)
-        # TODO: this is horrible... it is coupled to the s3g driver.
-        for driver in self._server._driver_manager.get_drivers():
-            for profile in driver.get_profiles(None):
-                info = conveyor.machine.MachineInfo(
-                    profile._s3g_profile.values['type'], None, driver.name,
-                    profile.name, conveyor.machine.MachineState.DISCONNECTED)
-                info.display_name = profile._s3g_profile.values['type']
-                info.unique_name = profile._s3g_profile.values['type']
-                info.printer_type = profile._s3g_profile.values['type']
-                info.machine_names = profile._s3g_profile.values['machinenames']
-                info.can_print = False
-                info.can_print_to_file = True
-                info.has_heated_platform = (0 != len(profile._s3g_profile.values['heated_platforms']))
-                info.number_of_toolheads = len(profile._s3g_profile.values['tools'])
-                axes = profile._s3g_profile.values['axes']
-                info.build_volume = [axes['X']['platform_length'],
-                                     axes['Y']['platform_length'],
-                                     axes['Z']['platform_length']]
-                info.temperature = {'tools': {}, 'heated_platforms': {},}
-                info.firmware_version = None
-                dct = info.to_dict()
-                result.append(dct)
+        result = self._server.get_printers()
         return result
 
-    @jsonrpc()
+    @jsonrpc(rate_class='job')
     def print_to_file(
             self, driver_name, profile_name, input_file, output_file,
             extruder_name, file_type, gcode_processor_name, has_start_end,
-            material_name, slicer_name, slicer_settings):
+            material_name, slicer_name, slicer_settings,
+            input_descriptor=None, output_descriptor=None, stream=False):
+        '''
+        Create and start a print-to-file job. When `stream` is true the output
+        is sent to this client in `job_output` notifications instead of being
+        written to `output_file`, and the client acknowledges them with
+        `job_output_ack`.
+
+        '''
+
         slicer_settings = conveyor.domain.SlicerConfiguration.fromdict(
             slicer_settings)
-        job = self._server.print_to_file(
-            driver_name, profile_name, input_file, output_file,
-            extruder_name, file_type, gcode_processor_name, has_start_end,
-            material_name, slicer_name, slicer_settings)
+        if not stream:
+            output_stream = None
+        else:
+            output_stream = conveyor.stream.OutputStream(
+                self._send_output,
+                self._config.get('server', 'output_stream_chunk_bytes'),
+                self._config.get('server', 'output_stream_window'))
+            # NOTE: the stream is registered before the job starts so that no
+            # acknowledgment can arrive before it.
+            with self._output_streams_condition:
+                self._output_streams = set(
+                    other for other in self._output_streams
+                    if not other.isfinished())
+                self._output_streams.add(output_stream)
+        files = []
+        try:
+            if None is not input_descriptor:
+                input_file = self._open_descriptor(
+                    input_descriptor, input_file, files)
+            if None is not output_descriptor:
+                output_file = self._open_descriptor(
+                    output_descriptor, output_file, files, True)
+            job = self._server.print_to_file(
+                driver_name, profile_name, input_file, output_file,
+                extruder_name, file_type, gcode_processor_name, has_start_end,
+                material_name, slicer_name, slicer_settings, files,
+                output_stream)
+        except:
+            self._close_descriptors(files)
+            if None is not output_stream:
+                with self._output_streams_condition:
+                    self._output_streams.discard(output_stream)
+            raise
         dct = job.get_info().to_dict()
         return dct
 
-    @jsonrpc()
+    @jsonrpc(ordered=False)
+    def job_output_ack(self, id, sequence):
+        with self._output_streams_condition:
+            output_streams = [
+                output_stream for output_stream in self._output_streams
+                if id == output_stream.job_id]
+        for output_stream in output_streams:
+            output_stream.acknowledge(sequence)
+        return None
+
+    @jsonrpc(rate_class='job')
     def slice(
             self, driver_name, profile_name, input_file, output_file,
             add_start_end, extruder_name, gcode_processor_name,
-            material_name, slicer_name, slicer_settings):
+            material_name, slicer_name, slicer_settings,
+            input_descriptor=None, output_descriptor=None):
         slicer_settings = conveyor.domain.SlicerConfiguration.fromdict(
             slicer_settings)
-        job = self._server.slice(
-            driver_name, profile_name, input_file, output_file, add_start_end,
-            extruder_name, gcode_processor_name, material_name, slicer_name,
-            slicer_settings)
+        files = []
+        try:
+            if None is not input_descriptor:
+                input_file = self._open_descriptor(
+                    input_descriptor, input_file, files)
+            if None is not output_descriptor:
+                output_file = self._open_descriptor(
+                    output_descriptor, output_file, files, True)
+            job = self._server.slice(
+                driver_name, profile_name, input_file, output_file,
+                add_start_end, extruder_name, gcode_processor_name,
+                material_name, slicer_name, slicer_settings, files)
+        except:
+            self._close_descriptors(files)
+            raise
         dct = job.get_info().to_dict()
         return dct
 
-    @jsonrpc()
+    @jsonrpc(ordered=False, rate_class='query')
+    def getconnections(self):
+        result = self._server.get_connections()
+        return result
+
+    @jsonrpc(ordered=False, rate_class='query')
     def getjobs(self):
         jobs = self._server.get_jobs(self)
         result = {}
@@ -727,9 +1260,50 @@ class _Client(conveyor.stoppable.StoppableThread):
         return result
 
     @jsonrpc()
+    def subscribe(self, events=None, machine_names=None, job_ids=None):
+        '''
+        Subscribes to notifications. Every notification is sent until a client
+        changes its subscriptions. Returns the current subscriptions.
+
+        '''
+        result = self._server.subscribe(self, events, machine_names, job_ids)
+        return result
+
+    @jsonrpc()
+    def unsubscribe(self, events=None, machine_names=None, job_ids=None):
+        '''
+        Unsubscribes from notifications. Returns the current subscriptions.
+
+        '''
+        result = self._server.unsubscribe(
+            self, events, machine_names, job_ids)
+        return result
+
+    @jsonrpc(ordered=False, rate_class='query')
+    def resync(self, job_ids=None, machine_names=None):
+        '''
+        Returns the latest versioned snapshot of the given jobs and machines,
+        or of all of them.
+
+        '''
+        result = self._server.get_snapshots(job_ids, machine_names)
+        return result
+
+    @jsonrpc(ordered=False, rate_class='query')
+    def get_status_snapshot(self, since_version=None):
+        '''
+        Returns the ports, machines and jobs along with a version that changes
+        whenever any of them does. When nothing has changed since
+        `since_version` only the version is returned.
+
+        '''
+        result = self._server.get_status_snapshot(since_version)
+        return result
+
+    @jsonrpc(ordered=False, rate_class='query')
     def getjob(self, id):
         job = self._server.get_job(id)
-        result = job.to_dict()
+        result = job.get_info().to_dict()
         return result
 
     @jsonrpc()
@@ -737,28 +1311,28 @@ class _Client(conveyor.stoppable.StoppableThread):
         self._server.cancel_job(id)
         return None
 
-    @jsonrpc()
+    @jsonrpc(ordered=False)
     def getuploadablemachines(self, driver_name):
         task = self._server.get_uploadable_machines(driver_name)
         return task
 
-    @jsonrpc()
+    @jsonrpc(ordered=False)
     def getmachineversions(self, driver_name, machine_type):
         task = self._server.get_machine_versions(driver_name, machine_type)
         return task
 
-    @jsonrpc()
+    @jsonrpc(ordered=False)
     def compatiblefirmware(self, driver_name, firmware_version):
         result = self._server.compatible_firmware(self, firmware_version)
         return result
 
-    @jsonrpc()
+    @jsonrpc(ordered=False)
     def downloadfirmware(self, driver_name, machine_type, firmware_version):
         task = self._server.download_firmware(
             driver_name, machine_type, firmware_version)
         return task
 
-    @jsonrpc()
+    @jsonrpc(ordered=False)
     def verifys3g(self, s3gpath):
         task = self._server.verify_s3g(s3gpath)
         return task
@@ -800,3 +1374,87 @@ class ConnectionManager(object):
 
     def job_changed(self, job):
         pass
+
+
+class _FakeClient(object):
+    def __init__(self, jsonrpc, delta):
+        self._jsonrpc = jsonrpc
+        self.delta = delta
+
+
+class _FakeServer(object):
+    def __init__(self, jobs):
+        self._jobs = jobs
+
+    def get_job(self, id):
+        return self._jobs[id]
+
+    def get_jobs(self, client):
+        return dict(self._jobs)
+
+
+class _ClientTestCase(unittest.TestCase):
+    def _client(self, delta):
+        outfp = StringIO.StringIO()
+        jsonrpc = conveyor.jsonrpc.JsonRpc(StringIO.StringIO(), outfp)
+        jsonrpc.setnotificationinterval(60.0)
+        client = _FakeClient(jsonrpc, delta)
+        return client, outfp
+
+    def _params(self, client, outfp):
+        client._jsonrpc.waitoutput()
+        params = []
+        reader = conveyor.json.JsonReader(
+            lambda data: params.append(json.loads(data)['params']), False)
+        reader.feed(outfp.getvalue().decode('UTF-8'))
+        return params
+
+    def test_machine_coalesce(self):
+        '''
+        Test that a temperature notification that is still pending when the
+        state of the machine changes is not sent after the state change with
+        the older version and state.
+
+        '''
+
+        for delta in (False, True):
+            client, outfp = self._client(delta)
+            versions = conveyor.delta.VersionedStore()
+            machine_info = conveyor.machine.MachineInfo(
+                'machine', 'port', 'driver', 'profile', 'IDLE')
+            def send(func, attr, value):
+                setattr(machine_info, attr, value)
+                version, changes = versions.update(
+                    ('machine', machine_info.name), machine_info.to_dict())
+                func([client], machine_info, version, changes)
+            send(_Client.machine_temperature_changed, 'temperature', 20)
+            send(_Client.machine_temperature_changed, 'temperature', 30)
+            send(_Client.machine_state_changed, 'state', 'RUNNING')
+            client._jsonrpc.setnotificationinterval(None)
+            params = self._params(client, outfp)
+            self.assertEqual(2, len(params))
+            self.assertEqual(3, params[-1]['version'])
+            if delta:
+                self.assertEqual(
+                    {'temperature': 30, 'state': 'RUNNING'},
+                    params[-1]['changes'])
+            else:
+                self.assertEqual('RUNNING', params[-1]['state'])
+                self.assertEqual(30, params[-1]['temperature'])
+
+    def test_getjob(self):
+        '''Test that getjob returns the job info with its stages.'''
+
+        job = conveyor.job.Job('print', 1, 'job')
+        stage = conveyor.task.Task(name='slice')
+        stage.start()
+        stage.end(None)
+        job.stages.append(stage)
+        client = _FakeClient(None, False)
+        client._server = _FakeServer({1: job})
+        result = _Client.getjob.__func__(client, 1)
+        self.assertEqual(1, result['id'])
+        self.assertEqual(['slice'], [s['name'] for s in result['stages']])
+        self.assertEqual(
+            stage.stopped_time, result['stages'][0]['stopped_time'])
+        self.assertEqual(result, _Client.getjobs.__func__(client)[1])
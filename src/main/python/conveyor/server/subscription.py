@@ -0,0 +1,220 @@
+# vim:ai:et:ff=unix:fileencoding=utf-8:sw=4:ts=4:
+# conveyor/src/main/python/conveyor/server/subscription.py
+#
+# conveyor - Printing dispatch engine for 3D objects and their friends.
+# Copyright © 2012 Matthew W. Samsonoff <matthew.samsonoff@makerbot.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import (absolute_import, print_function, unicode_literals)
+
+import threading
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import conveyor.error
+
+# The notifications that can be subscribed to.
+EVENTS = (
+    'port_attached',
+    'port_detached',
+    'jobadded',
+    'jobchanged',
+    'machine_state_changed',
+    'machine_temperature_changed',
+)
+
+# The kinds of subscription keys. A key is a tuple of its kind, the event, and
+# the machine name or job id it is limited to.
+_ALL = 'all'
+_MACHINE = 'machine'
+_JOB = 'job'
+
+
+class SubscriptionIndex(object):
+    '''
+    An index from event keys to the subscribers that want them, so that a
+    notification is only built and sent for the connections that are
+    interested in it.
+
+    A subscriber can subscribe to an event for every object or only for
+    certain machines or jobs. Job events match both the job's id and the name
+    of its machine. Port events can only be subscribed to as a whole.
+
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = {} # of key -> set of subscribers
+        self._keys = {} # of subscriber -> set of keys
+
+    def _getkeys(self, events, machine_names, job_ids):
+        if None is events:
+            events = EVENTS
+        keys = set()
+        for event in events:
+            if event not in EVENTS:
+                raise conveyor.error.UnknownEventError(event)
+            elif None is machine_names and None is job_ids:
+                keys.add((_ALL, event, None))
+            else:
+                for machine_name in machine_names or ():
+                    keys.add((_MACHINE, event, machine_name))
+                for job_id in job_ids or ():
+                    keys.add((_JOB, event, job_id))
+        return keys
+
+    def subscribe(self, subscriber, events, machine_names, job_ids):
+        '''
+        Subscribe to `events`, or to every event if it is `None`, for the given
+        machines and jobs, or for all of them if both are `None`.
+
+        '''
+
+        keys = self._getkeys(events, machine_names, job_ids)
+        with self._lock:
+            self._keys.setdefault(subscriber, set()).update(keys)
+            for key in keys:
+                self._index.setdefault(key, set()).add(subscriber)
+
+    def unsubscribe(self, subscriber, events, machine_names, job_ids):
+        '''
+        Remove the subscriptions to `events`, or to every event if it is
+        `None`, for the given machines and jobs. If both are `None` every
+        subscription to those events is removed.
+
+        '''
+
+        if None is machine_names and None is job_ids:
+            if None is events:
+                events = EVENTS
+            for event in events:
+                if event not in EVENTS:
+                    raise conveyor.error.UnknownEventError(event)
+            with self._lock:
+                keys = set(
+                    key for key in self._keys.get(subscriber, ())
+                    if key[1] in events)
+                self._removekeys(subscriber, keys)
+        else:
+            keys = self._getkeys(events, machine_names, job_ids)
+            with self._lock:
+                self._removekeys(subscriber, keys)
+
+    def remove(self, subscriber):
+        '''Remove every subscription of `subscriber`.'''
+
+        with self._lock:
+            keys = set(self._keys.get(subscriber, ()))
+            self._removekeys(subscriber, keys)
+
+    def _removekeys(self, subscriber, keys):
+        # NOTE: the caller must hold `_lock`.
+        subscriberkeys = self._keys.get(subscriber)
+        if None is not subscriberkeys:
+            for key in keys:
+                subscriberkeys.discard(key)
+                subscribers = self._index.get(key)
+                if None is not subscribers:
+                    subscribers.discard(subscriber)
+                    if 0 == len(subscribers):
+                        del self._index[key]
+            if 0 == len(subscriberkeys):
+                del self._keys[subscriber]
+
+    def get(self, event, machine_name=None, job_id=None):
+        '''Return the subscribers for an event about a machine or job.'''
+
+        result = set()
+        with self._lock:
+            subscribers = self._index.get((_ALL, event, None))
+            if None is not subscribers:
+                result.update(subscribers)
+            if None is not machine_name:
+                subscribers = self._index.get((_MACHINE, event, machine_name))
+                if None is not subscribers:
+                    result.update(subscribers)
+            if None is not job_id:
+                subscribers = self._index.get((_JOB, event, job_id))
+                if None is not subscribers:
+                    result.update(subscribers)
+        return result
+
+    def getsubscriptions(self, subscriber):
+        '''Return the subscriptions of `subscriber` as a list of dicts.'''
+
+        subscriptions = []
+        with self._lock:
+            keys = sorted(self._keys.get(subscriber, ()))
+        for kind, event, value in keys:
+            subscription = {'event': event}
+            if _MACHINE == kind:
+                subscription['machine_name'] = value
+            elif _JOB == kind:
+                subscription['job_id'] = value
+            subscriptions.append(subscription)
+        return subscriptions
+
+
+class _SubscriptionIndexTestCase(unittest.TestCase):
+    def test_filter(self):
+        '''Test that events only reach the matching subscribers.'''
+
+        index = SubscriptionIndex()
+        index.subscribe('all', None, None, None)
+        index.subscribe('panel', None, ['m1'], None)
+        index.subscribe('job', ['jobchanged'], None, [7])
+        self.assertEqual(
+            set(['all', 'panel']),
+            index.get('machine_temperature_changed', machine_name='m1'))
+        self.assertEqual(
+            set(['all']),
+            index.get('machine_temperature_changed', machine_name='m2'))
+        self.assertEqual(
+            set(['all', 'panel', 'job']),
+            index.get('jobchanged', machine_name='m1', job_id=7))
+        self.assertEqual(
+            set(['all']), index.get('jobadded', machine_name='m2', job_id=7))
+        self.assertEqual(set(['all']), index.get('port_attached'))
+
+    def test_unsubscribe(self):
+        '''Test that subscriptions are removed from the index.'''
+
+        index = SubscriptionIndex()
+        index.subscribe('panel', None, None, None)
+        index.unsubscribe('panel', ['machine_temperature_changed'], None, None)
+        self.assertEqual(
+            set(), index.get('machine_temperature_changed', machine_name='m1'))
+        self.assertEqual(
+            set(['panel']),
+            index.get('machine_state_changed', machine_name='m1'))
+        index.unsubscribe('panel', None, None, None)
+        index.subscribe('panel', ['jobchanged'], ['m1', 'm2'], None)
+        index.unsubscribe('panel', None, ['m2'], None)
+        self.assertEqual(
+            [{'event': 'jobchanged', 'machine_name': 'm1'}],
+            index.getsubscriptions('panel'))
+        index.remove('panel')
+        self.assertEqual({}, index._index)
+        self.assertEqual({}, index._keys)
+
+    def test_unknown(self):
+        '''Test that an unknown event is rejected.'''
+
+        index = SubscriptionIndex()
+        with self.assertRaises(conveyor.error.UnknownEventError):
+            index.subscribe('client', ['bogus'], None, None)
@@ -0,0 +1,420 @@
+# vim:ai:et:ff=unix:fileencoding=utf-8:sw=4:ts=4:
+# conveyor/src/main/python/conveyor/statusboard.py
+#
+# conveyor - Printing dispatch engine for 3D objects and their friends.
+# Copyright © 2012 Matthew W. Samsonoff <matthew.samsonoff@makerbot.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+A memory-mapped file with the state, temperatures and current job of each
+machine, for tools on the same host that only want to watch them. The server
+writes it in place and a reader maps it and polls it at any rate without
+talking to the server.
+
+The file is a header followed by a fixed number of slots. All numbers are
+little-endian.
+
+    header  8s magic "CNVYSTAT", uint32 layout version, uint32 slot count,
+            uint32 slot size, uint32 open (0 once the server closes it)
+    slot    uint32 sequence, uint32 used, double update time,
+            64s machine name, 16s machine state, uint8 toolhead count,
+            4 double toolhead temperatures, double platform temperature,
+            int32 job id, 16s job state, int32 job progress, 64s job name
+
+Strings are UTF-8 and padded with NULs. Missing temperatures are NaN and a
+missing job id or progress is -1.
+
+Each slot is guarded by its sequence, like a seqlock. The server makes it odd
+before it changes the slot and even again afterward. A reader copies a slot
+whose sequence is even and keeps the copy if the sequence did not change
+meanwhile. The server replaces the file when it starts, so a reader that
+finds the board closed should open it again.
+
+`StatusBoardReader` only needs the standard library.
+
+'''
+
+from __future__ import (absolute_import, print_function, unicode_literals)
+
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+
+_MAGIC = b'CNVYSTAT'
+
+_LAYOUT_VERSION = 1
+
+_HEADER = struct.Struct(str('<8sIIII'))
+
+_HEADER_SIZE = 64
+
+_UINT32 = struct.Struct(str('<I'))
+
+_TOOLHEADS = 4
+
+_SLOT = struct.Struct(str('<IId64s16sB3x4ddi16si64s'))
+
+_SLOT_SIZE = 256
+
+_OPEN_OFFSET = 20
+
+# The number of times a reader copies a slot before it gives up on it for
+# this read. The server holds a slot for a few microseconds at a time.
+_READ_ATTEMPTS = 100
+
+
+def _encode(s, size):
+    if None is s:
+        data = b''
+    else:
+        data = unicode(s).encode('UTF-8')[:size]
+    return data
+
+
+def _decode(data):
+    s = data.rstrip(b'\0').decode('UTF-8', 'replace')
+    return s
+
+
+def _float(value):
+    if None is value:
+        result = float('nan')
+    else:
+        result = float(value)
+    return result
+
+
+class StatusBoard(object):
+    '''
+    The writing side of the board. The file at `path` is replaced with an
+    empty board of `slot_count` slots. Each machine takes a slot the first
+    time it is published and keeps it; machines beyond the last slot are not
+    published.
+
+    '''
+
+    def __init__(self, path, slot_count, log=None):
+        self._path = path
+        self._slot_count = slot_count
+        self._log = log
+        self._lock = threading.Lock()
+        self._slots = {} # of machine name -> slot index
+        self._records = [] # of dict, by slot index
+        self._sequences = [] # of int, by slot index
+        self._full = False
+        size = _HEADER_SIZE + slot_count * _SLOT_SIZE
+        self._fp = self._create(path, size)
+        self._mmap = mmap.mmap(self._fp.fileno(), size)
+        _HEADER.pack_into(
+            self._mmap, 0, _MAGIC, _LAYOUT_VERSION, slot_count, _SLOT_SIZE, 1)
+
+    @staticmethod
+    def _create(path, size):
+        # NOTE: the new board is written beside the old one and renamed over
+        # it, so that a reader that still maps the old one is not cut short.
+        # Windows cannot rename over an open file, so there it is truncated.
+        if 'nt' == os.name:
+            fp = open(path, 'w+b')
+        else:
+            directory = os.path.dirname(os.path.abspath(path))
+            fd, temppath = tempfile.mkstemp(
+                prefix='.conveyor-status-', dir=directory)
+            os.fchmod(fd, 0o644)
+            fp = os.fdopen(fd, 'w+b')
+        try:
+            fp.write(b'\0' * size)
+            fp.flush()
+            if 'nt' != os.name:
+                os.rename(temppath, path)
+        except:
+            fp.close()
+            if 'nt' != os.name:
+                os.unlink(temppath)
+            raise
+        return fp
+
+    def close(self):
+        with self._lock:
+            if None is not self._mmap:
+                _UINT32.pack_into(self._mmap, _OPEN_OFFSET, 0)
+                self._mmap.close()
+                self._mmap = None
+                self._fp.close()
+
+    def publish_machine(
+            self, name, state, toolhead_temperatures, platform_temperature):
+        '''
+        Publish the state and temperatures of the machine `name`. A `None`
+        temperature is unknown.
+
+        '''
+
+        with self._lock:
+            record = self._getrecord(name)
+            if None is not record:
+                if None is toolhead_temperatures:
+                    toolhead_temperatures = ()
+                record['state'] = state
+                record['toolhead_temperatures'] = list(
+                    toolhead_temperatures)[:_TOOLHEADS]
+                record['platform_temperature'] = platform_temperature
+                self._write(name)
+
+    def publish_job(self, machine_name, job_id, job_name, state, progress):
+        '''
+        Publish the job running on the machine `machine_name`. `progress` is
+        a percentage or `None`.
+
+        '''
+
+        with self._lock:
+            record = self._getrecord(machine_name)
+            if None is not record:
+                record['job_id'] = job_id
+                record['job_name'] = job_name
+                record['job_state'] = state
+                record['job_progress'] = progress
+                self._write(machine_name)
+
+    def _getrecord(self, name):
+        # NOTE: the caller must hold `_lock`.
+        if None is self._mmap:
+            record = None
+        elif name in self._slots:
+            record = self._records[self._slots[name]]
+        elif len(self._records) < self._slot_count:
+            self._slots[name] = len(self._records)
+            record = {
+                'state': None, 'toolhead_temperatures': [],
+                'platform_temperature': None, 'job_id': None,
+                'job_name': None, 'job_state': None, 'job_progress': None,
+            }
+            self._records.append(record)
+            self._sequences.append(0)
+        else:
+            if not self._full and None is not self._log:
+                self._log.warning(
+                    'the status board is full; machine %s is not published',
+                    name)
+            self._full = True
+            record = None
+        return record
+
+    def _write(self, name):
+        # NOTE: the caller must hold `_lock`.
+        index = self._slots[name]
+        record = self._records[index]
+        temperatures = record['toolhead_temperatures']
+        padded = [_float(t) for t in temperatures]
+        padded.extend([float('nan')] * (_TOOLHEADS - len(padded)))
+        job_id = record['job_id']
+        progress = record['job_progress']
+        data = _SLOT.pack(
+            0, 1, time.time(), _encode(name, 64),
+            _encode(record['state'], 16), len(temperatures),
+            *(padded + [
+                _float(record['platform_temperature']),
+                -1 if None is job_id else job_id,
+                _encode(record['job_state'], 16),
+                -1 if None is progress else progress,
+                _encode(record['job_name'], 64)]))
+        offset = _HEADER_SIZE + index * _SLOT_SIZE
+        sequence = self._sequences[index] + 1
+        _UINT32.pack_into(self._mmap, offset, sequence)
+        self._mmap[offset + _UINT32.size:offset + _SLOT.size] = (
+            data[_UINT32.size:])
+        _UINT32.pack_into(self._mmap, offset, sequence + 1)
+        self._sequences[index] = sequence + 1
+
+
+class StatusBoardReader(object):
+    '''The reading side of the board.'''
+
+    def __init__(self, path):
+        self._path = path
+        self._fp = None
+        self._mmap = None
+        self._slot_count = 0
+        self._open()
+
+    def _open(self):
+        self.close()
+        self._fp = open(self._path, 'rb')
+        try:
+            self._mmap = mmap.mmap(
+                self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, slot_count, slot_size, is_open = (
+                _HEADER.unpack_from(self._mmap, 0))
+            if _MAGIC != magic or _LAYOUT_VERSION != version:
+                raise ValueError(self._path)
+            self._slot_count = slot_count
+        except:
+            self.close()
+            raise
+
+    def close(self):
+        if None is not self._mmap:
+            self._mmap.close()
+            self._mmap = None
+        if None is not self._fp:
+            self._fp.close()
+            self._fp = None
+
+    def isopen(self):
+        '''Return whether the server still writes this board.'''
+
+        is_open, = _UINT32.unpack_from(self._mmap, _OPEN_OFFSET)
+        return 0 != is_open
+
+    def reopen(self):
+        '''Map the board the server is writing now.'''
+
+        self._open()
+
+    def read(self):
+        '''
+        Return a consistent copy of each slot that is in use. A slot that the
+        server is changing too quickly to copy is left out.
+
+        '''
+
+        machines = []
+        for index in range(self._slot_count):
+            machine = self._readslot(index)
+            if None is not machine:
+                machines.append(machine)
+        return machines
+
+    def _readslot(self, index):
+        offset = _HEADER_SIZE + index * _SLOT_SIZE
+        for attempt in range(_READ_ATTEMPTS):
+            before, = _UINT32.unpack_from(self._mmap, offset)
+            if 0 == before % 2:
+                data = self._mmap[offset:offset + _SLOT.size]
+                after, = _UINT32.unpack_from(self._mmap, offset)
+                if before == after:
+                    return self._parse(data)
+            time.sleep(0)
+        return None
+
+    def _parse(self, data):
+        fields = _SLOT.unpack(data)
+        (sequence, used, updated, name, state, toolhead_count) = fields[:6]
+        temperatures = fields[6:6 + _TOOLHEADS]
+        (platform_temperature, job_id, job_state, job_progress,
+            job_name) = fields[6 + _TOOLHEADS:]
+        if not used:
+            machine = None
+        else:
+            def temperature(value):
+                if math.isnan(value):
+                    value = None
+                return value
+            machine = {
+                'name': _decode(name),
+                'state': _decode(state) or None,
+                'updated': updated,
+                'toolhead_temperatures': [
+                    temperature(t)
+                    for t in temperatures[:min(toolhead_count, _TOOLHEADS)]],
+                'platform_temperature': temperature(platform_temperature),
+                'job_id': None if -1 == job_id else job_id,
+                'job_name': _decode(job_name) or None,
+                'job_state': _decode(job_state) or None,
+                'job_progress': None if -1 == job_progress else job_progress,
+            }
+        return machine
+
+
+class _StatusBoardTestCase(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._path = os.path.join(self._directory, 'conveyord.status')
+
+    def tearDown(self):
+        for name in os.listdir(self._directory):
+            os.unlink(os.path.join(self._directory, name))
+        os.rmdir(self._directory)
+
+    def test_publish(self):
+        '''Test that a reader sees what the server published.'''
+
+        board = StatusBoard(self._path, 2)
+        reader = StatusBoardReader(self._path)
+        self.assertEqual([], reader.read())
+        board.publish_machine('bot', 'IDLE', [210.5, None], 110.0)
+        board.publish_job('bot', 7, 'box', 'RUNNING', 42)
+        machine, = reader.read()
+        self.assertEqual('bot', machine['name'])
+        self.assertEqual('IDLE', machine['state'])
+        self.assertEqual([210.5, None], machine['toolhead_temperatures'])
+        self.assertEqual(110.0, machine['platform_temperature'])
+        self.assertEqual(
+            (7, 'box', 'RUNNING', 42),
+            (machine['job_id'], machine['job_name'], machine['job_state'],
+                machine['job_progress']))
+        board.publish_machine('other', 'BUSY', None, None)
+        board.publish_machine('third', 'BUSY', None, None)
+        self.assertEqual(
+            ['bot', 'other'], [m['name'] for m in reader.read()])
+        self.assertTrue(reader.isopen())
+        board.close()
+        self.assertFalse(reader.isopen())
+        reader.close()
+
+    def test_replace(self):
+        '''
+        Test that a new board replaces the file without disturbing a reader
+        of the old one until it reopens it.
+
+        '''
+
+        board = StatusBoard(self._path, 1)
+        board.publish_machine('bot', 'IDLE', [], None)
+        reader = StatusBoardReader(self._path)
+        board.close()
+        board = StatusBoard(self._path, 1)
+        board.publish_machine('bot', 'BUSY', [], None)
+        self.assertFalse(reader.isopen())
+        self.assertEqual('IDLE', reader.read()[0]['state'])
+        reader.reopen()
+        self.assertEqual('BUSY', reader.read()[0]['state'])
+        board.close()
+        reader.close()
+
+    def test_torn(self):
+        '''Test that a slot that is being written is not read.'''
+
+        board = StatusBoard(self._path, 1)
+        board.publish_machine('bot', 'IDLE', [], None)
+        reader = StatusBoardReader(self._path)
+        offset = _HEADER_SIZE
+        sequence, = _UINT32.unpack_from(board._mmap, offset)
+        _UINT32.pack_into(board._mmap, offset, sequence + 1)
+        self.assertEqual([], reader.read())
+        _UINT32.pack_into(board._mmap, offset, sequence)
+        self.assertEqual(1, len(reader.read()))
+        board.close()
+        reader.close()
@@ -0,0 +1,218 @@
+# vim:ai:et:ff=unix:fileencoding=utf-8:sw=4:ts=4:
+# conveyor/src/main/python/conveyor/stream.py
+#
+# conveyor - Printing dispatch engine for 3D objects and their friends.
+# Copyright © 2012 Matthew W. Samsonoff <matthew.samsonoff@makerbot.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Stream the output of a job to a client in sequenced chunks instead of writing
+it to a file on the server.
+
+The producer writes to an `OutputStream` as if it were a file. Each full chunk
+is handed to a send function with its sequence number, starting at 0, and the
+last chunk is marked as the end of the stream. The client acknowledges the
+chunks it has consumed. At most `window` chunks are unacknowledged at a time;
+a write that would exceed the window blocks until the client catches up, so a
+slow client slows the producer down instead of the server queueing the output.
+
+'''
+
+from __future__ import (absolute_import, print_function, unicode_literals)
+
+import threading
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import conveyor.error
+
+# The default number of bytes in a chunk.
+CHUNK_BYTES = 65536
+
+# The default number of chunks that may be unacknowledged.
+WINDOW = 4
+
+
+class OutputStream(object):
+    '''
+    A file-like object that sends what is written to it with
+    `send(stream, sequence, data, eof)`. The send function is invoked on the
+    writing thread and must not block on the client.
+
+    Leaving a `with` block closes the stream, or aborts it if an exception was
+    raised.
+
+    '''
+
+    def __init__(self, send, chunk_bytes=CHUNK_BYTES, window=WINDOW):
+        self._send = send
+        self._chunk_bytes = chunk_bytes
+        self._window = window
+        self._condition = threading.Condition()
+        self._buffer = bytearray()
+        self._sequence = 0 # the sequence number of the next chunk
+        self._acknowledged = -1
+        self._closed = False
+        self._aborted = False
+        self._finished = False
+        self.job_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if None is exc_type:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def write(self, data):
+        if self._closed:
+            raise ValueError('write to a closed stream')
+        self._buffer.extend(data)
+        while len(self._buffer) >= self._chunk_bytes:
+            chunk = bytes(self._buffer[:self._chunk_bytes])
+            del self._buffer[:self._chunk_bytes]
+            self._sendchunk(chunk, False)
+
+    def flush(self):
+        # NOTE: partial chunks are held until they fill up or the stream is
+        # closed so that small writes do not become small messages.
+        pass
+
+    def close(self):
+        '''Send the rest of the output as the last chunk.'''
+
+        if not self._closed:
+            self._closed = True
+            chunk = bytes(self._buffer)
+            del self._buffer[:]
+            self._sendchunk(chunk, True)
+
+    def abort(self):
+        '''
+        Stop the stream without sending the rest of the output. A blocked or
+        subsequent write raises `StreamAbortedException`.
+
+        '''
+
+        with self._condition:
+            self._aborted = True
+            self._condition.notify_all()
+
+    def acknowledge(self, sequence):
+        '''Record that the client has consumed the chunks up to `sequence`.'''
+
+        with self._condition:
+            if sequence > self._acknowledged:
+                self._acknowledged = sequence
+                self._condition.notify_all()
+
+    def isfinished(self):
+        '''Return whether the last chunk was sent or the stream aborted.'''
+
+        with self._condition:
+            return self._finished or self._aborted
+
+    def getunacknowledged(self):
+        '''Return the number of chunks the client has not consumed.'''
+
+        with self._condition:
+            return self._sequence - self._acknowledged - 1
+
+    def _sendchunk(self, chunk, eof):
+        with self._condition:
+            while (not self._aborted
+                    and self._sequence - self._acknowledged > self._window):
+                self._condition.wait()
+            if self._aborted:
+                raise conveyor.error.StreamAbortedException(self.job_id)
+            sequence = self._sequence
+            self._sequence += 1
+        self._send(self, sequence, chunk, eof)
+        if eof:
+            with self._condition:
+                self._finished = True
+
+
+class _OutputStreamTestCase(unittest.TestCase):
+    def test_chunks(self):
+        '''Test that the output is sent in sequenced, full chunks.'''
+
+        chunks = []
+        def send(stream, sequence, data, eof):
+            chunks.append((sequence, data, eof))
+            stream.acknowledge(sequence)
+        with OutputStream(send, 4, 1) as stream:
+            stream.write(b'abc')
+            stream.write(b'defghij')
+            stream.write(bytearray(b'k'))
+            self.assertFalse(stream.isfinished())
+        self.assertTrue(stream.isfinished())
+        self.assertEqual(
+            [(0, b'abcd', False), (1, b'efgh', False), (2, b'ijk', True)],
+            chunks)
+
+    def test_window(self):
+        '''Test that a writer waits for the client to acknowledge chunks.'''
+
+        condition = threading.Condition()
+        chunks = []
+        def send(stream, sequence, data, eof):
+            with condition:
+                chunks.append(sequence)
+                condition.notify_all()
+        stream = OutputStream(send, 1, 2)
+        thread = threading.Thread(target=stream.write, args=(b'abcde',))
+        thread.start()
+        with condition:
+            while len(chunks) < 2:
+                condition.wait(1.0)
+        thread.join(0.05)
+        self.assertTrue(thread.is_alive())
+        self.assertEqual([0, 1], chunks)
+        self.assertEqual(2, stream.getunacknowledged())
+        stream.acknowledge(0)
+        with condition:
+            while len(chunks) < 3:
+                condition.wait(1.0)
+        self.assertEqual(2, stream.getunacknowledged())
+        stream.acknowledge(4)
+        thread.join(1.0)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual([0, 1, 2, 3, 4], chunks)
+
+    def test_abort(self):
+        '''Test that aborting the stream releases a blocked writer.'''
+
+        errors = []
+        stream = OutputStream(lambda *args: None, 1, 1)
+        stream.job_id = 3
+        def target():
+            try:
+                stream.write(b'abc')
+            except conveyor.error.StreamAbortedException as e:
+                errors.append(e.job_id)
+        thread = threading.Thread(target=target)
+        thread.start()
+        thread.join(0.05)
+        self.assertTrue(thread.is_alive())
+        stream.abort()
+        thread.join(1.0)
+        self.assertEqual([3], errors)
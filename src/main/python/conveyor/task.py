@@ -19,6 +19,15 @@
 
 from __future__ import (absolute_import, print_function, unicode_literals)
 
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
 try:
     import unittest2 as unittest
 except ImportError:
@@ -48,69 +57,166 @@ class IllegalTransitionException(Exception):
         self.event = event
 
 
+if hasattr(time, 'thread_time'):
+    _threadcputime = time.thread_time
+elif None is not resource and sys.platform.startswith('linux'):
+    def _threadcputime():
+        # NOTE: Python 2 does not define RUSAGE_THREAD. Its value on Linux
+        # is 1.
+        usage = resource.getrusage(getattr(resource, 'RUSAGE_THREAD', 1))
+        result = usage.ru_utime + usage.ru_stime
+        return result
+else:
+    # NOTE: this is only an approximation on other platforms. It is the CPU
+    # time of the whole process on Unix and the wall time on Windows.
+    _threadcputime = time.clock
+
+
+class _TaskEvent(conveyor.event.Event):
+    '''An event of a task that adds the CPU time of its handlers to the
+    task.'''
+
+    __slots__ = ()
+
+    def _deliver(self, args, kwargs):
+        # NOTE: the events of a task are delivered one at a time, so the
+        # task's total is only updated by one thread at a time.
+        start = _threadcputime()
+        try:
+            conveyor.event.Event._deliver(self, args, kwargs)
+        finally:
+            self._key.callback_cpu_time += _threadcputime() - start
+
+
+# Guards the creation of the events of every task. It is only taken while an
+# event of a task has not been created yet.
+_taskeventlock = threading.Lock()
+
+
+def _taskevent(name, priority=conveyor.event.EventPriority.BULK):
+    attr = ''.join(('_', name))
+    eventname = '.'.join(('Task', name))
+    def fget(self):
+        event = getattr(self, attr)
+        if None is event:
+            with _taskeventlock:
+                event = getattr(self, attr)
+                if None is event:
+                    # NOTE: the events of a task share its key so that they
+                    # are delivered in the order they happen.
+                    event = _TaskEvent(
+                        eventname, self._eventqueue, self, priority)
+                    setattr(self, attr, event)
+        return event
+    result = property(fget)
+    return result
+
+
 class Task(object):
     """ Class for managing an ongoing task, including starting, stopping, 
         hearbeat (updates) and related tools.       
+
+        The events are created the first time they are used, so a task whose
+        events have no handlers does not queue them. Handlers may be attached
+        from any thread; a handler sees the transitions that happen after it
+        is attached, whether or not its event already existed.
     """
-    def __init__(self, eventqueue=None):
+
+    __slots__ = (
+        'state', 'conclusion', 'name', 'data', 'progress', 'result',
+        'failure', 'pending_time', 'running_time', 'stopped_time',
+        'callback_cpu_time', '_eventqueue', '_startevent', '_heartbeatevent',
+        '_endevent', '_failevent', '_cancelevent', '_runningevent',
+        '_stoppedevent')
+
+    def __init__(self, eventqueue=None, name=None):
         self.state = TaskState.PENDING
         self.conclusion = None
-        self.name = None
+        self.name = name
         self.data = None
 
         self.progress = None # data from 'heartbeat'
         self.result = None   # data from 'end'
         self.failure = None  # data from 'fail'
 
-        # Event events (edge-ish events)
-        self.startevent = conveyor.event.Event('Task.startevent', eventqueue)
-        self.heartbeatevent = conveyor.event.Event(
-            'Task.heartbeatevent', eventqueue)
-        self.endevent = conveyor.event.Event('Task.endevent', eventqueue)
-        self.failevent = conveyor.event.Event('Task.failevent', eventqueue)
-        self.cancelevent = conveyor.event.Event('Task.cancelevent', eventqueue)
+        # The times the task entered each state, and the thread CPU time
+        # spent in the handlers of its events, in seconds.
+        self.pending_time = time.time()
+        self.running_time = None
+        self.stopped_time = None
+        self.callback_cpu_time = 0.0
 
-        # State events (level-ish events)
-        self.runningevent = conveyor.event.Event(
-            'Task.runningevent', eventqueue)
-        self.stoppedevent = conveyor.event.Event(
-            'Task.stoppedevent', eventqueue)
+        self._eventqueue = eventqueue
+        self._startevent = None
+        self._heartbeatevent = None
+        self._endevent = None
+        self._failevent = None
+        self._cancelevent = None
+        self._runningevent = None
+        self._stoppedevent = None
 
+    # Event events (edge-ish events)
+    startevent = _taskevent('startevent')
+    heartbeatevent = _taskevent('heartbeatevent')
+    endevent = _taskevent('endevent')
+    failevent = _taskevent('failevent')
+    cancelevent = _taskevent(
+        'cancelevent', conveyor.event.EventPriority.CONTROL)
+
+    # State events (level-ish events)
+    runningevent = _taskevent('runningevent')
+    stoppedevent = _taskevent('stoppedevent')
+
+    def _fire(self, attr):
+        event = getattr(self, attr)
+        if None is event:
+            # NOTE: an event that another thread is creating is fired once it
+            # exists, so a handler attached before the transition is never
+            # skipped.
+            with _taskeventlock:
+                event = getattr(self, attr)
+        if None is not event:
+            event(self)
 
     def _transition(self, event, data):
         if TaskState.PENDING == self.state:
             if TaskEvent.START == event:
                 self.state = TaskState.RUNNING
-                self.startevent(self)
-                self.runningevent(self)
+                self.running_time = time.time()
+                self._fire('_startevent')
+                self._fire('_runningevent')
             elif TaskEvent.CANCEL == event:
                 self.state = TaskState.STOPPED
+                self.stopped_time = time.time()
                 self.conclusion = TaskConclusion.CANCELED
-                self.cancelevent(self)
-                self.stoppedevent(self)
+                self._fire('_cancelevent')
+                self._fire('_stoppedevent')
             else:
                 raise IllegalTransitionException(self.state, event)
         elif TaskState.RUNNING == self.state:
             if TaskEvent.HEARTBEAT == event:
                 self.progress = data
-                self.heartbeatevent(self)
+                self._fire('_heartbeatevent')
             elif TaskEvent.END == event:
                 self.state = TaskState.STOPPED
+                self.stopped_time = time.time()
                 self.conclusion = TaskConclusion.ENDED
                 self.result = data
-                self.endevent(self)
-                self.stoppedevent(self)
+                self._fire('_endevent')
+                self._fire('_stoppedevent')
             elif TaskEvent.FAIL == event:
                 self.state = TaskState.STOPPED
+                self.stopped_time = time.time()
                 self.conclusion = TaskConclusion.FAILED
                 self.failure = data
-                self.failevent(self)
-                self.stoppedevent(self)
+                self._fire('_failevent')
+                self._fire('_stoppedevent')
             elif TaskEvent.CANCEL == event:
                 self.state = TaskState.STOPPED
+                self.stopped_time = time.time()
                 self.conclusion = TaskConclusion.CANCELED
-                self.cancelevent(self)
-                self.stoppedevent(self)
+                self._fire('_cancelevent')
+                self._fire('_stoppedevent')
             else:
                 raise IllegalTransitionException(self.state, event)
         elif TaskState.STOPPED == self.state:
@@ -118,6 +224,27 @@ class Task(object):
         else:
             raise ValueError(self.state)
 
+    def get_timing(self):
+        """ Returns a dict with the times the task entered each state and
+        the thread CPU seconds spent in its callbacks. The time of a state the
+        task has not entered is None, and so is the CPU time until the task
+        stops, so the timing only changes when the state does.
+        """
+        if TaskState.STOPPED == self.state:
+            callback_cpu = self.callback_cpu_time
+        else:
+            callback_cpu = None
+        timing = {
+            'name': self.name,
+            'state': self.state,
+            'conclusion': self.conclusion,
+            'pending_time': self.pending_time,
+            'running_time': self.running_time,
+            'stopped_time': self.stopped_time,
+            'callback_cpu': callback_cpu,
+        }
+        return timing
+
     def start(self):
         """ Sets the Task in to active mode, where it can accept heartbeats,
         events, etc 
@@ -0,0 +1,217 @@
+# vim:ai:et:ff=unix:fileencoding=utf-8:sw=4:ts=4:
+# conveyor/src/main/python/conveyor/timer.py
+#
+# conveyor - Printing dispatch engine for 3D objects and their friends.
+# Copyright © 2012 Matthew W. Samsonoff <matthew.samsonoff@makerbot.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import (absolute_import, print_function, unicode_literals)
+
+import heapq
+import itertools
+import threading
+import time
+
+try:
+    import unittest2 as unittest
+except ImportError:
+    import unittest
+
+import conveyor.error
+import conveyor.log
+import conveyor.stoppable
+
+_timer = None
+
+_timerlock = threading.Lock()
+
+
+def gettimer():
+    '''Return the shared `Timer`, starting it on first use.'''
+
+    global _timer
+    with _timerlock:
+        if None is _timer:
+            _timer = Timer('timer')
+            _timer.start()
+    return _timer
+
+
+class TimerHandle(object):
+    '''A scheduled call. See `Timer.schedule`.'''
+
+    def __init__(self, timer, deadline, func):
+        self._timer = timer
+        self.deadline = deadline
+        self.func = func
+        self.canceled = False
+
+    def cancel(self):
+        '''
+        Cancel the call. Returns `False` if it has already been invoked or
+        canceled.
+
+        '''
+
+        return self._timer._cancel(self)
+
+
+class Timer(conveyor.stoppable.StoppableInterface):
+    '''
+    Invokes scheduled calls on a single thread when their deadlines pass. The
+    deadlines are kept in a heap so that scheduling and expiring a call costs
+    O(log n) however many calls are pending.
+
+    A canceled call is left in the heap and skipped when it reaches the top.
+    The heap is rebuilt without them when they outnumber the live calls, so
+    calls that are nearly always canceled, like request deadlines, do not
+    accumulate.
+
+    The calls should be brief since each one delays those after it.
+
+    '''
+
+    def __init__(self, name):
+        conveyor.stoppable.StoppableInterface.__init__(self)
+        self._log = conveyor.log.getlogger(self)
+        self._condition = threading.Condition()
+        self._heap = [] # of (deadline, sequence, handle)
+        self._sequence = itertools.count()
+        self._canceled = 0
+        self._stop = False
+        self._thread = threading.Thread(target=self.run, name=name)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def run(self):
+        while True:
+            with self._condition:
+                handle = self._next()
+            if None is handle:
+                break
+            else:
+                conveyor.error.guard(self._log, handle.func)
+
+    def _next(self):
+        while not self._stop:
+            if 0 == len(self._heap):
+                self._condition.wait()
+            else:
+                deadline, sequence, handle = self._heap[0]
+                if handle.canceled:
+                    heapq.heappop(self._heap)
+                    self._canceled -= 1
+                else:
+                    now = time.time()
+                    if deadline > now:
+                        self._condition.wait(deadline - now)
+                    else:
+                        heapq.heappop(self._heap)
+                        handle.canceled = True
+                        return handle
+        return None
+
+    def stop(self):
+        with self._condition:
+            self._stop = True
+            self._condition.notify_all()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def schedule(self, delay, func):
+        '''
+        Invoke `func` on the timer thread after `delay` seconds. Returns a
+        `TimerHandle` that can cancel the call.
+
+        '''
+
+        deadline = time.time() + delay
+        handle = TimerHandle(self, deadline, func)
+        with self._condition:
+            # NOTE: the sequence number keeps calls with the same deadline in
+            # the order they were scheduled and keeps the handles from being
+            # compared.
+            entry = deadline, next(self._sequence), handle
+            heapq.heappush(self._heap, entry)
+            if self._heap[0] is entry:
+                self._condition.notify_all()
+        return handle
+
+    def _cancel(self, handle):
+        with self._condition:
+            if handle.canceled:
+                result = False
+            else:
+                handle.canceled = True
+                self._canceled += 1
+                if self._canceled > len(self._heap) // 2:
+                    self._heap = [
+                        entry for entry in self._heap if not entry[2].canceled]
+                    heapq.heapify(self._heap)
+                    self._canceled = 0
+                result = True
+        return result
+
+    def getpending(self):
+        '''Return the number of calls that are waiting for their deadlines.'''
+
+        with self._condition:
+            return len(self._heap) - self._canceled
+
+
+class _TimerTestCase(unittest.TestCase):
+    def setUp(self):
+        self._timer = Timer('test')
+        self._timer.start()
+
+    def tearDown(self):
+        self._timer.stop()
+        self._timer.join(1)
+
+    def test_order(self):
+        '''Test that calls are invoked in the order of their deadlines.'''
+
+        condition = threading.Condition()
+        calls = []
+        def func(i):
+            def target():
+                with condition:
+                    calls.append(i)
+                    condition.notify_all()
+            return target
+        for i in (3, 1, 2):
+            self._timer.schedule(0.01 * i, func(i))
+        with condition:
+            while len(calls) < 3:
+                condition.wait(1.0)
+        self.assertEqual([1, 2, 3], calls)
+        self.assertEqual(0, self._timer.getpending())
+
+    def test_cancel(self):
+        '''Test that canceled calls are not invoked and are discarded.'''
+
+        calls = []
+        handles = [
+            self._timer.schedule(60.0, lambda: calls.append(i))
+            for i in range(100)]
+        for handle in handles:
+            self.assertTrue(handle.cancel())
+            self.assertFalse(handle.cancel())
+        self.assertEqual(0, self._timer.getpending())
+        self.assertTrue(len(self._timer._heap) <= 1)
+        self.assertEqual([], calls)
@@ -0,0 +1,140 @@
+# vim:ai:et:ff=unix:fileencoding=utf-8:sw=4:ts=4:
+# conveyor/src/test/python/bench_compression.py
+#
+# conveyor - Printing dispatch engine for 3D objects and their friends.
+# Copyright © 2012 Matthew W. Samsonoff <matthew.samsonoff@makerbot.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Benchmark the bytes on the wire and the CPU cost of compressing the traffic of
+a remote monitoring station that polls `getprinters` and `getjobs` for a farm of
+machines. The connection-wide zlib stream is measured at several levels,
+alongside uncompressed messages and messages compressed independently of each
+other.
+
+'''
+
+from __future__ import (absolute_import, print_function, unicode_literals)
+
+import argparse
+import sys
+import time
+import zlib
+
+import conveyor.job
+import conveyor.json
+import conveyor.jsonrpc
+import conveyor.machine
+
+
+def _machine(i, tick):
+    machine_info = conveyor.machine.MachineInfo(
+        'Replicator2-%d' % (i,), '/dev/ttyACM%d' % (i,), 's3g', 'Replicator2',
+        'RUNNING')
+    machine_info.display_name = 'The Replicator 2 #%d' % (i,)
+    machine_info.unique_name = '23C1A0%02X' % (i,)
+    machine_info.printer_type = 'The Replicator 2'
+    machine_info.machine_names = ['The Replicator 2']
+    machine_info.can_print = True
+    machine_info.can_printtofile = True
+    machine_info.has_heated_platform = False
+    machine_info.number_of_toolheads = 1
+    machine_info.temperature = {
+        'tools': {'0': 225 + (i + tick) % 10}, 'heated_platforms': {}}
+    machine_info.firmware_version = 700
+    machine_info.build_volume = [285, 153, 155]
+    return machine_info.to_dict()
+
+
+def _job(i, tick):
+    job_info = conveyor.job.JobInfo(
+        'PRINT_JOB', i, 'part-%d.stl' % (i,), 'RUNNING',
+        {'name': 'print', 'progress': (i + tick) % 100}, None, None,
+        'Replicator2-%d' % (i,), '/dev/ttyACM%d' % (i,), 's3g', 'Replicator2')
+    return job_info.to_dict()
+
+
+def _messages(machines, polls):
+    messages = []
+    id = 0
+    for tick in range(polls):
+        for method, func in (('getprinters', _machine), ('getjobs', _job)):
+            result = [func(i, tick) for i in range(machines)]
+            response = {'jsonrpc': '2.0', 'result': result, 'id': id}
+            messages.append(conveyor.json.dumps(response))
+            id += 1
+    return messages
+
+
+def _none(framed):
+    return framed, lambda: (lambda data: data)
+
+
+def _stream(level):
+    def mode(framed):
+        compressobj = zlib.compressobj(level)
+        wire = [
+            compressobj.compress(data) + compressobj.flush(zlib.Z_SYNC_FLUSH)
+            for data in framed]
+        return wire, lambda: zlib.decompressobj().decompress
+    return mode
+
+
+def _independent(framed):
+    wire = [zlib.compress(data) for data in framed]
+    return wire, lambda: zlib.decompress
+
+
+def _run(framed, mode):
+    start = time.time()
+    wire, decompressorfactory = mode(framed)
+    compressed = time.time()
+    decompress = decompressorfactory()
+    for data in wire:
+        decompress(data)
+    decompressed = time.time()
+    return wire, compressed - start, decompressed - compressed
+
+
+def _main(argv):
+    parser = argparse.ArgumentParser(prog='bench_compression')
+    parser.add_argument('--machines', type=int, default=8)
+    parser.add_argument('--polls', type=int, default=500)
+    args = parser.parse_args(argv[1:])
+    messages = _messages(args.machines, args.polls)
+    framing = conveyor.jsonrpc._LengthFraming(None)
+    framed = [framing.encode(message) for message in messages]
+    raw = sum(len(data) for data in framed)
+    modes = [
+        ('none', _none),
+        ('independent', _independent),
+        ('stream-1', _stream(1)),
+        ('stream-6', _stream(6)),
+        ('stream-9', _stream(9)),
+    ]
+    for name, mode in modes:
+        wire, compress, decompress = _run(framed, mode)
+        size = sum(len(data) for data in wire)
+        count = len(framed)
+        print(
+            '%-12s %8d bytes/message %6.1f%% %8.1f us/compress'
+            ' %8.1f us/decompress' % (
+                name, size // count, 100.0 * size / raw, compress / count * 1e6,
+                decompress / count * 1e6))
+    return 0
+
+
+if '__main__' == __name__:
+    sys.exit(_main(sys.argv))
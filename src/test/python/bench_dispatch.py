@@ -0,0 +1,121 @@
+# vim:ai:et:ff=unix:fileencoding=utf-8:sw=4:ts=4:
+# conveyor/src/test/python/bench_dispatch.py
+#
+# conveyor - Printing dispatch engine for 3D objects and their friends.
+# Copyright © 2012 Matthew W. Samsonoff <matthew.samsonoff@makerbot.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Benchmark the overhead of dispatching a request to a small method, like
+`getjob` and `getports`, once its params are parsed. The legacy mode calls the
+method the way `JsonRpc._invokemethod` used to, converting the keys of the
+named params on every call and catching `TypeError` for bad params. The
+compiled mode binds the params with the `_MethodInfo` built when the method
+was added.
+
+'''
+
+from __future__ import (absolute_import, print_function, unicode_literals)
+
+import argparse
+import sys
+import time
+
+import conveyor.jsonrpc
+
+
+class _Methods(object):
+    def getjob(self, id):
+        return id
+
+    def getports(self):
+        return []
+
+    def printtofile(
+            self, machine_name, input_file, output_file, slicer_settings,
+            extruder_name, has_start_end, material_name, job_name,
+            print_to_file_type=None):
+        return job_name
+
+
+def _requests():
+    methods = _Methods()
+    requests = [
+        ('getjob', methods.getjob, (), {'id': 17}),
+        ('getjob', methods.getjob, [17], {}),
+        ('getports', methods.getports, (), {}),
+        ('printtofile', methods.printtofile, (), {
+            'machine_name': None, 'input_file': '/tmp/box.stl',
+            'output_file': '/tmp/box.x3g', 'slicer_settings': {},
+            'extruder_name': '0', 'has_start_end': False,
+            'material_name': 'PLA', 'job_name': 'box'}),
+    ]
+    return requests
+
+
+def _fixkwargs(kwargs):
+    kwargs1 = {}
+    for k, v in kwargs.items():
+        k = str(k)
+        kwargs1[k] = v
+    return kwargs1
+
+
+def _legacy(func, args, kwargs):
+    kwargs = _fixkwargs(kwargs)
+    try:
+        result = func(*args, **kwargs)
+    except TypeError:
+        result = None
+    return result
+
+
+def _compiled(info, args, kwargs):
+    result = info.invoke(args, kwargs)
+    return result
+
+
+def _run(func, target, args, kwargs, count, repeat):
+    durations = []
+    for i in xrange(repeat):
+        start = time.time()
+        for j in xrange(count):
+            func(target, args, kwargs)
+        durations.append(time.time() - start)
+    return min(durations)
+
+
+def _main(argv):
+    parser = argparse.ArgumentParser(prog='bench_dispatch')
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv[1:])
+    for method, func, params, kwparams in _requests():
+        if 0 != len(params):
+            kind = 'positional'
+        else:
+            kind = 'named'
+        info = conveyor.jsonrpc._MethodInfo(func)
+        modes = [('legacy', _legacy, func), ('compiled', _compiled, info)]
+        for name, dispatch, target in modes:
+            duration = _run(
+                dispatch, target, params, kwparams, args.count, args.repeat)
+            print('%-12s %-10s %-8s %8.3f us/call' % (
+                method, kind, name, duration / args.count * 1e6))
+    return 0
+
+
+if '__main__' == __name__:
+    sys.exit(_main(sys.argv))
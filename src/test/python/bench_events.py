@@ -0,0 +1,175 @@
+# vim:ai:et:ff=unix:fileencoding=utf-8:sw=4:ts=4:
+# conveyor/src/test/python/bench_events.py
+#
+# conveyor - Printing dispatch engine for 3D objects and their friends.
+# Copyright © 2012 Matthew W. Samsonoff <matthew.samsonoff@makerbot.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Benchmark delivering the events of many concurrent tasks on several event
+queue threads. Each task fires a start event, a number of heartbeat events
+and a stop event from a producer thread, and the handlers can sleep to stand
+in for the socket writes of a real client. The legacy mode uses one queue for
+every event and wakes every worker thread for each event, the way
+`EventQueue` used to. The sharded mode uses the lanes of `EventQueue`, where
+the events of each task are delivered in order. The number of events that
+were delivered out of order for their task is reported for both modes.
+
+'''
+
+from __future__ import (absolute_import, print_function, unicode_literals)
+
+import argparse
+import collections
+import sys
+import threading
+import time
+
+import conveyor.event
+
+
+class _LegacyEventQueue(conveyor.event.EventQueue):
+    def __init__(self):
+        conveyor.event.EventQueue.__init__(self)
+        self._queue = collections.deque()
+
+    def runiteration(self, block):
+        self._log.debug('block=%r', block)
+        with self._condition:
+            if block:
+                while 0 == len(self._queue) and not self._stop:
+                    self._log.debug('waiting')
+                    self._condition.wait()
+                    self._log.debug('resumed')
+            if 0 == len(self._queue):
+                tuple_ = None
+            else:
+                tuple_ = self._queue.pop()
+        if None is not tuple_:
+            event, args, kwargs = tuple_
+            event._deliver(args, kwargs)
+        result = None is not tuple_
+        self._log.debug('result=%r', result)
+        return result
+
+    def run(self):
+        self._log.debug('starting')
+        self._stop = False
+        while not self._stop:
+            self.runiteration(True)
+        self._log.debug('ending')
+
+    def _enqueue(self, event, args, kwargs):
+        self._log.debug('event=%r, args=%r, kwargs=%r', event, args, kwargs)
+        tuple_ = event, args, kwargs
+        with self._condition:
+            self._queue.appendleft(tuple_)
+            self._condition.notify_all()
+
+
+class _Task(object):
+    def __init__(self, eventqueue, latencies, delay, done):
+        self.startevent = conveyor.event.Event(
+            'Task.startevent', eventqueue, self)
+        self.heartbeatevent = conveyor.event.Event(
+            'Task.heartbeatevent', eventqueue, self)
+        self.stopevent = conveyor.event.Event(
+            'Task.stopevent', eventqueue, self)
+        self.last = 0.0
+        self.reordered = 0
+        def callback(timestamp):
+            latencies.append(time.time() - timestamp)
+            if timestamp < self.last:
+                self.reordered += 1
+            self.last = timestamp
+            if 0 != delay:
+                time.sleep(delay)
+        self.startevent.attach(callback)
+        self.heartbeatevent.attach(callback)
+        self.stopevent.attach(callback)
+        self.stopevent.attach(done)
+
+
+def _run(eventqueue, tasks, heartbeats, delay, workers, producers):
+    latencies = []
+    lock = threading.Lock()
+    finished = threading.Event()
+    stopped = [0]
+    def done(timestamp):
+        with lock:
+            stopped[0] += 1
+            if tasks == stopped[0]:
+                finished.set()
+    tasklist = [
+        _Task(eventqueue, latencies, delay, done) for i in xrange(tasks)]
+    threads = []
+    for i in xrange(workers):
+        thread = threading.Thread(target=eventqueue.run)
+        thread.start()
+        threads.append(thread)
+    def produce(tasklist):
+        for task in tasklist:
+            task.startevent(time.time())
+        for i in xrange(heartbeats):
+            for task in tasklist:
+                task.heartbeatevent(time.time())
+        for task in tasklist:
+            task.stopevent(time.time())
+    start = time.time()
+    producerthreads = []
+    for i in xrange(producers):
+        thread = threading.Thread(
+            target=produce, args=(tasklist[i::producers],))
+        thread.start()
+        producerthreads.append(thread)
+    for thread in producerthreads:
+        thread.join()
+    finished.wait()
+    duration = time.time() - start
+    eventqueue.stop()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    reordered = sum(task.reordered for task in tasklist)
+    return duration, latencies, reordered
+
+
+def _main(argv):
+    parser = argparse.ArgumentParser(prog='bench_events')
+    parser.add_argument('--tasks', type=int, default=2000)
+    parser.add_argument('--heartbeats', type=int, default=8)
+    parser.add_argument('--delay', type=float, default=0.0)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--producers', type=int, default=4)
+    args = parser.parse_args(argv[1:])
+    events = args.tasks * (args.heartbeats + 2)
+    modes = [
+        ('legacy', _LegacyEventQueue),
+        ('sharded', conveyor.event.EventQueue),
+    ]
+    for name, factory in modes:
+        duration, latencies, reordered = _run(
+            factory(), args.tasks, args.heartbeats, args.delay, args.workers,
+            args.producers)
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[len(latencies) * 99 // 100]
+        print(
+            '%-8s %8.0f events/s  p50 %8.3f ms  p99 %8.3f ms  %d reordered' % (
+                name, events / duration, p50 * 1e3, p99 * 1e3, reordered))
+    return 0
+
+
+if '__main__' == __name__:
+    sys.exit(_main(sys.argv))
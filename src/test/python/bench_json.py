@@ -0,0 +1,141 @@
+# vim:ai:et:ff=unix:fileencoding=utf-8:sw=4:ts=4:
+# conveyor/src/test/python/bench_json.py
+#
+# conveyor - Printing dispatch engine for 3D objects and their friends.
+# Copyright © 2012 Matthew W. Samsonoff <matthew.samsonoff@makerbot.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Benchmark the `conveyor.json` codec backends on the notifications the server
+broadcasts. Each payload is encoded the way the server used to, as a `to_dict`
+envelope through the original top-level-only `DecimalEncoder`, then through
+`conveyor.jsonrpc.Notification` with each available backend.
+
+'''
+
+from __future__ import (absolute_import, print_function, unicode_literals)
+
+import argparse
+import decimal
+import json
+import sys
+import time
+
+import conveyor.job
+import conveyor.json
+import conveyor.jsonrpc
+import conveyor.machine
+import conveyor.machine.port
+
+
+class _LegacyEncoder(json.JSONEncoder):
+    # The encoder used before the backends were added.
+    def iterencode(self, o, *args, **kwargs):
+        if isinstance(o, decimal.Decimal):
+            result = (str(o),)
+        else:
+            result = json.JSONEncoder.iterencode(self, o, *args, **kwargs)
+        return result
+
+
+def _payloads():
+    job_info = conveyor.job.JobInfo(
+        'PRINT_JOB', 17, 'calibration box', 'RUNNING',
+        {'name': 'print', 'progress': 42}, None, None, 'Replicator2',
+        '/dev/ttyACM0', 's3g', 'Replicator2')
+    machine_info = conveyor.machine.MachineInfo(
+        'Replicator2', '/dev/ttyACM0', 's3g', 'Replicator2', 'RUNNING')
+    machine_info.display_name = 'The Replicator 2'
+    machine_info.unique_name = '23C1A0EB'
+    machine_info.printer_type = 'The Replicator 2'
+    machine_info.machine_names = ['The Replicator 2']
+    machine_info.can_print = True
+    machine_info.can_printtofile = True
+    machine_info.has_heated_platform = False
+    machine_info.number_of_toolheads = 1
+    machine_info.temperature = {
+        'tools': {'0': 229}, 'heated_platforms': {}}
+    machine_info.firmware_version = 700
+    machine_info.build_volume = [285, 153, 155]
+    port_info = conveyor.machine.port.PortInfo(
+        'SERIAL', '/dev/ttyACM0', {'s3g': ['Replicator2', 'Replicator2X']})
+    slicer_settings = {
+        'slicer': 'MIRACLEGRUE', 'extruder': '0', 'raft': False,
+        'support': True, 'infill': decimal.Decimal('0.1'),
+        'layer_height': decimal.Decimal('0.2'), 'shells': 2,
+        'extruder_temperature': decimal.Decimal('230.0'),
+        'platform_temperature': decimal.Decimal('110.0'),
+        'print_speed': decimal.Decimal('80.0'),
+        'travel_speed': decimal.Decimal('100.0'), 'path': None}
+    payloads = [
+        ('jobchanged', job_info),
+        ('machine_state_changed', machine_info),
+        ('port_attached', port_info),
+        ('slicer_settings', slicer_settings),
+    ]
+    return payloads
+
+
+def _todict(params):
+    if isinstance(params, dict):
+        result = params
+    else:
+        result = params.to_dict()
+    return result
+
+
+def _legacy(method, params):
+    envelope = {'jsonrpc': '2.0', 'method': method, 'params': _todict(params)}
+    return json.dumps(envelope, cls=_LegacyEncoder)
+
+
+def _notification(method, params):
+    return conveyor.jsonrpc.Notification(method, _todict(params)).data
+
+
+def _run(func, method, params, count, repeat):
+    durations = []
+    for i in xrange(repeat):
+        start = time.time()
+        for j in xrange(count):
+            func(method, params)
+        durations.append(time.time() - start)
+    return min(durations)
+
+
+def _main(argv):
+    parser = argparse.ArgumentParser(prog='bench_json')
+    parser.add_argument('--count', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv[1:])
+    for method, params in _payloads():
+        modes = []
+        if not isinstance(params, dict) or not any(
+                isinstance(v, decimal.Decimal) for v in params.values()):
+            # The legacy encoder fails on nested decimals.
+            modes.append(('legacy', _legacy))
+        for name in conveyor.json.getbackends():
+            modes.append((name, _notification))
+        for name, func in modes:
+            if 'legacy' != name:
+                conveyor.json.setbackend(name)
+            duration = _run(func, method, params, args.count, args.repeat)
+            print('%-22s %-18s %8.2f us/message' % (
+                method, name, duration / args.count * 1e6))
+    return 0
+
+
+if '__main__' == __name__:
+    sys.exit(_main(sys.argv))
@@ -0,0 +1,106 @@
+# vim:ai:et:ff=unix:fileencoding=utf-8:sw=4:ts=4:
+# conveyor/src/test/python/bench_jsonreader.py
+#
+# conveyor - Printing dispatch engine for 3D objects and their friends.
+# Copyright © 2012 Matthew W. Samsonoff <matthew.samsonoff@makerbot.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Benchmark the `JsonReader` by feeding it multi-megabyte streams of JSON-RPC
+messages in small and large chunks. The character-at-a-time state machine is
+measured alongside the scanning `feed` for comparison.
+
+'''
+
+from __future__ import (absolute_import, print_function, unicode_literals)
+
+import argparse
+import sys
+import time
+
+import conveyor.json
+
+
+def _message(i):
+    eeprom_map = {}
+    for j in range(64):
+        eeprom_map['key_%d' % (j,)] = {
+            'offset': '0x%04x' % (j,), 'type': 'B', 'value': [j, j + 1],
+            'mightyboard_comment': 'a "quoted" \\ comment'}
+    message = {
+        'jsonrpc': '2.0', 'result': eeprom_map, 'id': i}
+    return conveyor.json.dumps(message)
+
+
+def _stream(size, comments):
+    parts = []
+    length = 0
+    i = 0
+    while length < size:
+        message = _message(i)
+        if comments:
+            message = ''.join(('// message ', unicode(i), '\n', message,
+                ' /* trailing */\n'))
+        parts.append(message)
+        length += len(message)
+        i += 1
+    return ''.join(parts), i
+
+
+def _bychar(reader, chunk):
+    for ch in chunk:
+        reader._consume(ch)
+
+
+def _byscan(reader, chunk):
+    reader.feed(chunk)
+
+
+def _run(data, chunksize, strip_comments, func):
+    count = [0]
+    def callback(indata):
+        count[0] += 1
+    reader = conveyor.json.JsonReader(callback, strip_comments)
+    start = time.time()
+    for i in xrange(0, len(data), chunksize):
+        func(reader, data[i:i + chunksize])
+    reader.feedeof()
+    duration = time.time() - start
+    return duration, count[0]
+
+
+def _main(argv):
+    parser = argparse.ArgumentParser(prog='bench_jsonreader')
+    parser.add_argument('--size', type=int, default=4 * 1024 * 1024)
+    parser.add_argument('--skip-bychar', action='store_true', default=False)
+    args = parser.parse_args(argv[1:])
+    for comments in (False, True):
+        data, messages = _stream(args.size, comments)
+        for chunksize in (64, 4096, 1024 * 1024):
+            modes = [('scan', _byscan)]
+            if not args.skip_bychar:
+                modes.insert(0, ('bychar', _bychar))
+            for name, func in modes:
+                duration, count = _run(data, chunksize, comments, func)
+                assert count == messages
+                print(
+                    'comments=%-5s chunk=%-8d mode=%-6s %8.3fs %8.2f MB/s' % (
+                        comments, chunksize, name, duration,
+                        len(data) / duration / 1e6))
+    return 0
+
+
+if '__main__' == __name__:
+    sys.exit(_main(sys.argv))
@@ -0,0 +1,167 @@
+# vim:ai:et:ff=unix:fileencoding=utf-8:sw=4:ts=4:
+# conveyor/src/test/python/bench_tasks.py
+#
+# conveyor - Printing dispatch engine for 3D objects and their friends.
+# Copyright © 2012 Matthew W. Samsonoff <matthew.samsonoff@makerbot.com>
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Benchmark creating and running many tasks, the way a JSON-RPC request or a
+recipe stage does: create a task, attach a stopped handler, start it, end it
+and deliver its events. The legacy mode uses a task that creates all seven of
+its events up front, where every event looks up its own logger, keeps its own
+handle dict and makes its debug logging calls unconditionally. The compact
+mode uses `conveyor.task.Task`. The bytes per task are the shallow sizes of
+the task, its events and their dicts.
+
+'''
+
+from __future__ import (absolute_import, print_function, unicode_literals)
+
+import argparse
+import sys
+import time
+
+import conveyor.event
+import conveyor.log
+import conveyor.task
+
+
+class _LegacyEvent(object):
+    def __init__(self, name, eventqueue=None, key=None):
+        self._name = name
+        self._eventqueue = eventqueue
+        if None is key:
+            key = self
+        self._key = key
+        self._priority = conveyor.event.EventPriority.BULK
+        self._handles = {}
+        self._log = conveyor.log.getlogger(self)
+
+    def attach(self, func):
+        handle = object()
+        self._handles[handle] = func
+        self._log.debug(
+            'name=%r, func=%r, handle=%r', self._name, func, handle)
+        return handle
+
+    def __call__(self, *args, **kwargs):
+        self._log.debug(
+            'name=%r, args=%r, kwargs=%r', self._name, args, kwargs)
+        self._eventqueue._enqueue(self, args, kwargs)
+
+    def _deliver(self, args, kwargs):
+        self._log.debug(
+            'name=%r, args=%r, kwargs=%r', self._name, args, kwargs)
+        for func in self._handles.itervalues():
+            func(*args, **kwargs)
+
+
+class _LegacyTask(object):
+    def __init__(self, eventqueue):
+        self.state = conveyor.task.TaskState.PENDING
+        self.conclusion = None
+        self.name = None
+        self.data = None
+        self.progress = None
+        self.result = None
+        self.failure = None
+        self.startevent = _LegacyEvent('Task.startevent', eventqueue, self)
+        self.heartbeatevent = _LegacyEvent(
+            'Task.heartbeatevent', eventqueue, self)
+        self.endevent = _LegacyEvent('Task.endevent', eventqueue, self)
+        self.failevent = _LegacyEvent('Task.failevent', eventqueue, self)
+        self.cancelevent = _LegacyEvent('Task.cancelevent', eventqueue, self)
+        self.runningevent = _LegacyEvent(
+            'Task.runningevent', eventqueue, self)
+        self.stoppedevent = _LegacyEvent(
+            'Task.stoppedevent', eventqueue, self)
+
+    def start(self):
+        self.state = conveyor.task.TaskState.RUNNING
+        self.startevent(self)
+        self.runningevent(self)
+
+    def end(self, result):
+        self.state = conveyor.task.TaskState.STOPPED
+        self.conclusion = conveyor.task.TaskConclusion.ENDED
+        self.result = result
+        self.endevent(self)
+        self.stoppedevent(self)
+
+
+def _footprint(task):
+    objects = [task]
+    names = (
+        'startevent', 'heartbeatevent', 'endevent', 'failevent',
+        'cancelevent', 'runningevent', 'stoppedevent')
+    for name in names:
+        # NOTE: only the events that were already created are counted.
+        if hasattr(task, '__dict__'):
+            event = task.__dict__.get(name)
+        else:
+            event = getattr(task, ''.join(('_', name)))
+        if None is not event:
+            objects.append(event)
+    result = 0
+    for o in objects:
+        result += sys.getsizeof(o)
+        for attr in ('__dict__', '_handles'):
+            value = getattr(o, attr, None)
+            if isinstance(value, dict):
+                result += sys.getsizeof(value)
+    return result
+
+
+def _run(factory, count):
+    eventqueue = conveyor.event.EventQueue()
+    stopped = []
+    tasks = []
+    start = time.time()
+    for i in xrange(count):
+        task = factory(eventqueue)
+        task.stoppedevent.attach(stopped.append)
+        tasks.append(task)
+    created = time.time()
+    for task in tasks:
+        task.start()
+        task.end(None)
+        while eventqueue.runiteration(False):
+            pass
+    ran = time.time()
+    assert count == len(stopped)
+    footprint = _footprint(tasks[0])
+    return created - start, ran - created, footprint
+
+
+def _main(argv):
+    parser = argparse.ArgumentParser(prog='bench_tasks')
+    parser.add_argument('--count', type=int, default=100000)
+    args = parser.parse_args(argv[1:])
+    modes = [
+        ('legacy', _LegacyTask),
+        ('compact', conveyor.task.Task),
+    ]
+    for name, factory in modes:
+        create, run, footprint = _run(factory, args.count)
+        print(
+            '%-8s create %6.2f us/task  run %6.2f us/task  %5d bytes/task' % (
+                name, create / args.count * 1e6, run / args.count * 1e6,
+                footprint))
+    return 0
+
+
+if '__main__' == __name__:
+    sys.exit(_main(sys.argv))
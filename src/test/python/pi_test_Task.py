@@ -2,6 +2,8 @@ import unittest
 
 import sys
 import os
+import threading
+import time
 
 #override sys.path for testing only 
 sys.path.insert(0,'./src/main/python')
@@ -254,6 +256,99 @@ class TaskTestCase(unittest.TestCase):
             TaskEvent.FAIL, TaskEvent.CANCEL,)
         func(TaskState.STOPPED, events)
 
+    def test_lazy_events(self):
+        '''Test that a task does not queue the events that were never
+        used.'''
+
+        eventqueue = conveyor.event.EventQueue()
+        task = Task(eventqueue)
+        self.assertFalse(hasattr(task, '__dict__'))
+        stoppedcallback = conveyor.event.Callback()
+        task.stoppedevent.attach(stoppedcallback)
+        self.assertIs(task.stoppedevent, task.stoppedevent)
+        task.start()
+        self.assertFalse(eventqueue.runiteration(False))
+        task.end(None)
+        self.assertTrue(eventqueue.runiteration(False))
+        self.assertFalse(eventqueue.runiteration(False))
+        self.assertTrue(stoppedcallback.delivered)
+
+    def test_lazy_events_threads(self):
+        '''Test that threads that use an event at the same time get the same
+        event, so no handler is lost.'''
+
+        # NOTE: slow down the creation of an event so that the threads race.
+        taskevent = conveyor.task._TaskEvent
+        class _SlowTaskEvent(taskevent):
+            __slots__ = ()
+            def __init__(self, *args):
+                time.sleep(0.001)
+                taskevent.__init__(self, *args)
+        self.addCleanup(setattr, conveyor.task, '_TaskEvent', taskevent)
+        conveyor.task._TaskEvent = _SlowTaskEvent
+        for i in range(20):
+            eventqueue = conveyor.event.EventQueue()
+            task = Task(eventqueue)
+            callbacks = [conveyor.event.Callback() for j in range(8)]
+            barrier = threading.Event()
+            def attach(callback):
+                barrier.wait()
+                task.stoppedevent.attach(callback)
+            threads = [
+                threading.Thread(target=attach, args=(callback,))
+                for callback in callbacks]
+            for thread in threads:
+                thread.start()
+            barrier.set()
+            for thread in threads:
+                thread.join()
+            task.cancel()
+            while eventqueue.runiteration(False):
+                pass
+            for callback in callbacks:
+                self.assertTrue(callback.delivered)
+
+    def test_get_timing(self):
+        '''Test the timestamps and callback CPU time of a task, and that the
+        timing of a running task does not change with the clock.'''
+
+        eventqueue = conveyor.event.EventQueue()
+        task = Task(eventqueue, 'stage')
+        def callback(task):
+            start = time.time()
+            while time.time() - start < 0.05:
+                pass
+        task.runningevent.attach(callback)
+        timing = task.get_timing()
+        self.assertEqual('stage', timing['name'])
+        self.assertEqual(task.pending_time, timing['pending_time'])
+        self.assertIsNone(timing['running_time'])
+        task.start()
+        while eventqueue.runiteration(False):
+            pass
+        timing = task.get_timing()
+        self.assertEqual(task.running_time, timing['running_time'])
+        self.assertIsNone(timing['stopped_time'])
+        self.assertIsNone(timing['callback_cpu'])
+        time.sleep(0.01)
+        self.assertEqual(timing, task.get_timing())
+        task.end(None)
+        self.assertLessEqual(task.pending_time, task.running_time)
+        self.assertLessEqual(task.running_time, task.stopped_time)
+        timing = task.get_timing()
+        self.assertEqual(task.stopped_time, timing['stopped_time'])
+        self.assertLess(0.0, timing['callback_cpu'])
+
+    def test_get_timing_canceled(self):
+        '''Test the timing of a task canceled before it ran.'''
+
+        task = Task()
+        task.cancel()
+        timing = task.get_timing()
+        self.assertIsNone(timing['running_time'])
+        self.assertEqual(task.stopped_time, timing['stopped_time'])
+        self.assertEqual(0.0, timing['callback_cpu'])
+
 if __name__ == "__main__":
     unittest.main()
 
@@ -189,7 +189,9 @@ class _JsonRpcTest(unittest.TestCase):
 
         data = '{"jsonrpc": "2.0", "method": "subtract", "params": [1], "id": "1"}'
         response = self._test_jsonresponse(data, True)
-        self._asserterror(-32602, 'invalid params', '1', response)
+        self._asserterror(
+            -32602, 'invalid params', '1', response,
+            'missing parameter: subtrahend')
 
     def test_invalidparams_notification(self):
         '''Test a notification with invalid parameters.'''